@@ -4,6 +4,8 @@ import imaplib
 import email
 import os
 
+from qbo_metrics import ATTACHMENTS, ERRORS
+
 """
 
 # Example usage:
@@ -51,10 +53,12 @@ def download_attachments(email_address, password, search_criteria, save_folder):
                                     save_path = os.path.join(save_folder, attachment_name)
                                     with open(save_path, 'wb') as attachment_file:
                                         attachment_file.write(attachment_data)
+                                    ATTACHMENTS.inc()
                                     print(f"Downloaded attachment: {attachment_name}")
 
         # Logout and close the connection
         imap_server.logout()
     
     except Exception as e:
+        ERRORS.inc(stage="fetch")
         print(f"Error: {str(e)}")
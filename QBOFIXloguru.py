@@ -38,12 +38,8 @@ from loguru import logger
 import datetime as dt
 from pathlib import Path
 
-from time_strings import LOCAL_NOW_STRING
-
 RUNTIME_NAME = Path(__file__).name
 RUNTIME_CWD = Path.cwd()
-LN = LOCAL_NOW_STRING()
-OS_FILENAME_SAFE_TIMESTR = "".join(i for i in LN if i not in "\/:*?<>|")
 QBO_DOWNLOAD_DIRECTORY = Path(BASE_DIRECTORY)
 QBO_MODIFIED_DIRECTORY = Path(OUTPUT_DIRECTORY)
 
@@ -340,7 +336,7 @@ def defineLoggers(filename):
 
 @logger.catch
 def Main():
-    # defineLoggers(f"{RUNTIME_NAME}_{OS_FILENAME_SAFE_TIMESTR}")
+    # defineLoggers(f"{RUNTIME_NAME}_{LOCAL_NOW_FILENAME_STRING()}")  # from time_strings
     defineLoggers(f"{RUNTIME_NAME}")
 
     logger.info("Program Start.")  # log the start of the program
@@ -5,10 +5,18 @@
 
 import os
 import sys
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from loguru import logger
 import datetime as dt
 from pathlib import Path
-from time_strings import LOCAL_NOW_STRING
+from structured_log import add_structured_sink, file_size, stage
+from qbo_metrics import ERRORS, MEMOS_CLEANED, arrival_time, file_converted, files_waiting
+from qbo_archive import archive_original
+from qbo_checkpoint import CHECKPOINT_XACTS, OffsetLines, ResumableOutput, has_checkpoint
+from qbo_util import chunked, tag_values
+from qbo_validate import StatementValidator, save_report
 import re
 
 # files to be updated
@@ -18,10 +26,14 @@ BASE_DIRECTORY = "D:/Users/Conrad/Downloads/"
 OUTPUT_DIRECTORY = "D:/Users/Conrad/Documents/"
 RUNTIME_NAME = Path(__file__).name
 RUNTIME_CWD = Path.cwd()
-LN = LOCAL_NOW_STRING()
-OS_FILENAME_SAFE_TIMESTR = "".join(i for i in LN if i not in r"\:/*?<>|")
 QBO_DOWNLOAD_DIRECTORY = Path(BASE_DIRECTORY)
 QBO_MODIFIED_DIRECTORY = Path(OUTPUT_DIRECTORY)
+QBO_WORKERS = 1  # worker processes used to rewrite the transactions of a single large file
+QBO_PIPELINE_THREADS = 0  # transform threads of the batch pipeline, 0 processes files one at a time
+PARALLEL_CHUNK_SIZE = 2000  # transactions per chunk handed to a worker process
+QBO_STORE_PATH = None  # SQLite transaction store the written transactions are added to, see qbo_store.py
+QBO_CHECKPOINT_XACTS = 0  # transactions between checkpoints of a resumable conversion, 0 reads files whole, see qbo_checkpoint.py
+QBO_ARCHIVE_DIRECTORY = None  # archive the downloads are stored in before they are removed, see qbo_archive.py
 BAD_TEXT = [
     r"DEBIT +\d{4}",
     "CKCD ",  # the space included here ensures that this string is not part of a bigger word
@@ -44,19 +56,51 @@ BAD_TEXT = [
 ]
 
 
+MULTIPLE_SPACES = re.compile(' +')
+
+
+def compile_bad_text(bad_text):
+    """Decide once how each BAD_TEXT entry is removed.
+    Return a list of (compiled regex or None, literal text or None) pairs in the original order.
+    """
+    compiled = []
+    for item in bad_text:
+        if re.match(r".*\d{4}.*", item):  # Check if the bad text is a regex pattern
+            compiled.append((re.compile(item), None))
+        else:
+            compiled.append((None, item))
+    return compiled
+
+
+class CleaningRules:
+    """The rules process_qbo_lines applies to each transaction.
+    Build one per rule set and pass it down; it is never modified afterwards
+    so a single instance can be shared by any number of threads.
+    """
+
+    def __init__(self, bad_text=BAD_TEXT, payees=None, amounts=None):
+        self.bad_text = compile_bad_text(bad_text)
+        self.payees = payees  # payee_index.PayeeIndex resolving names to known payees, or None
+        self.amounts = amounts  # amount_rules.AmountRuleIndex naming transactions by amount, or None
+
+
+DEFAULT_RULES = CleaningRules()
+QBO_RULES = DEFAULT_RULES  # rules used by the batch tools, the CLI adds the payee index to them
+
+
 @logger.catch
-def preprocess_memo(memo):
+def preprocess_memo(memo, rules=DEFAULT_RULES):
     # Remove specified bad text patterns
     logger.debug(f"Original memo line:{memo}")
-    for bad_text in BAD_TEXT:
-        if re.match(r".*\d{4}.*", bad_text):  # Check if the bad text is a regex pattern
-            memo = re.sub(bad_text, "", memo)
+    for pattern, text in rules.bad_text:
+        if pattern is not None:
+            memo = pattern.sub("", memo)
         else:
-            memo = memo.replace(bad_text, "")
+            memo = memo.replace(text, "")
     # Shortening common phrases (if any remain)
     memo = memo.replace("BILL PAYMT", "BillPay").strip()
     # Further cleanup to remove extra spaces and standardize spacing
-    memo = re.sub(' +', ' ', memo).strip()
+    memo = MULTIPLE_SPACES.sub(' ', memo).strip()
     logger.debug(f"Cleaned memo:{memo}")
     return memo
 
@@ -70,29 +114,27 @@ def truncate_name(name, max_length=32):
 @logger.catch
 def extract_transaction_details(transaction_lines):
     """Extract details from transaction lines into a dictionary of tag:value."""
-    transaction_details = {}
-    for line in transaction_lines:
-        # Split the line at the first occurrence of ">" to separate the tag from its value
-        parts = line.split(">", 1)
-        if len(parts) == 2:
-            if parts[0].startswith('<'):  # is this a valid tag?
-                tag, value = parts[0][1:], parts[1]  # Remove the opening "<" from the tag
-                transaction_details[tag] = value.strip()
+    transaction_details = tag_values(transaction_lines)
     logger.debug(transaction_details)
     return transaction_details
 
 
 @logger.catch
-def process_transaction(transaction_lines):
+def process_transaction(transaction_lines, rules=DEFAULT_RULES, found=None):
     """Process individual transactions, ensuring memo presence, checking name and memo equality,
-    and reformatting back into a list of lines."""
+    and reformatting back into a list of lines.
+    If a found dict is given its 'cleaned' entry counts the memos changed by preprocess_memo.
+    """
     transaction_details = extract_transaction_details(transaction_lines)
     # Ensure there's a memo tag, add a default one if necessary
     if 'MEMO' not in transaction_details:
         transaction_details['MEMO'] = 'No Memo'
     else:
         # memo needs to be stripped of bad text and truncated
-        transaction_details['MEMO'] = truncate_name(preprocess_memo(transaction_details['MEMO']))
+        memo = preprocess_memo(transaction_details['MEMO'], rules)
+        if found is not None and memo != transaction_details['MEMO']:
+            found['cleaned'] = found.get('cleaned', 0) + 1
+        transaction_details['MEMO'] = truncate_name(memo)
     logger.debug(transaction_details)
     # Check for equality of name and memo
     if 'NAME' not in transaction_details:
@@ -108,50 +150,137 @@ def process_transaction(transaction_lines):
     else:
         # name and memo are different so we need to swap their values using the power of tuple unpacking
         transaction_details['NAME'], transaction_details['MEMO'] = transaction_details['MEMO'], transaction_details.get('NAME', 'No Name')
+        if rules.payees is not None:
+            transaction_details['NAME'] = rules.payees.resolve(transaction_details['NAME'])
+    if rules.amounts is not None:
+        # a rule for the type and amount names the transaction whatever the bank called it
+        rule_name = rules.amounts.match(transaction_details.get('TRNTYPE'), transaction_details.get('TRNAMT'),
+                                        transaction_details.get('DTPOSTED', ''))
+        if rule_name:
+            transaction_details['NAME'] = truncate_name(rule_name)
     logger.debug(transaction_details)
     # Convert transaction_details back into a list of lines
-    processed_lines = []
-    for tag, value in transaction_details.items():
-        line = f"<{tag}>{value}\n"
-        processed_lines.append(line)
-    return processed_lines
+    return [f"<{tag}>{value}\n" for tag, value in transaction_details.items()]
 
 
-@logger.catch
-def process_qbo_lines(lines):
-    qbo_file_date = '19700101'  # default value incase no date found
-    account_number = '42'  # default  
-    modified_lines = []  # Stores the modified lines of the entire file
+def iter_qbo_blocks(lines, found=None):
+    """Split the lines of a QBO file at <STMTTRN> boundaries.
+    Yield (is_transaction, list of lines) pairs in file order: runs of lines outside any
+    transaction and complete <STMTTRN>...</STMTTRN> transactions. A transaction that is
+    never closed is dropped, just like process_qbo_lines always did.
+    If a found dict is given it receives the last DTEND and ACCTID values seen and the
+    number of <STMTTRN> tags counted.
+    """
+    if found is None:
+        found = {}
+    found.setdefault('DTEND', '19700101')  # default value incase no date found
+    found.setdefault('ACCTID', '42')  # default
+    found['STMTTRN'] = 0
+    text_lines = []  # lines outside of transactions not yet handed out
     transaction_lines = []  # Temporarily stores lines of the current transaction
     processing_transaction = False  # Flag to indicate if we're within a transaction block
-    xacts_found = 0  # initialize counter of transactions found
     for line in lines:
-        line_stripped = line.strip()        
+        line_stripped = line.strip()
         # Process header lines to extract date and account number
         if line_stripped.startswith('<DTEND>'):
-            qbo_file_date = line_stripped.replace('<DTEND>', '')
+            found['DTEND'] = line_stripped.replace('<DTEND>', '')
         elif line_stripped.startswith('<ACCTID>'):
-            account_number = line_stripped.replace('<ACCTID>', '')        
+            found['ACCTID'] = line_stripped.replace('<ACCTID>', '')
         if line_stripped.startswith('<STMTTRN>'):
             processing_transaction = True  # Mark the start of a transaction
-            xacts_found += 1  # increment counter
+            found['STMTTRN'] += 1
             transaction_lines = [line]  # Start a new transaction block
         elif line_stripped.startswith('</STMTTRN>'):
             # End of transaction found
-            transaction_lines.append(line)  # append the line
+            if processing_transaction:
+                transaction_lines.append(line)
+            else:
+                # a stray closing tag repeats the previous transaction, copy it since that list was handed out
+                transaction_lines = transaction_lines + [line]
             processing_transaction = False  # Reset the flag as the transaction block ends
-            modified_transaction_lines = process_transaction(transaction_lines)  # Process the collected lines of the transaction
-            modified_lines.extend(modified_transaction_lines)  # Add processed lines to the output
+            if text_lines:
+                yield False, text_lines
+                text_lines = []
+            yield True, transaction_lines
         elif processing_transaction:
             # If we are within a transaction, keep collecting its lines
             transaction_lines.append(line)
         else:
-            # Lines not part of a transaction are added directly to the output
-            modified_lines.append(line)
-    logger.info(f"{xacts_found} transactions found.")
+            # Lines not part of a transaction are passed on unchanged
+            text_lines.append(line)
+    if text_lines:
+        yield False, text_lines
+
+
+def _process_blocks(blocks, rules=DEFAULT_RULES, found=None):
+    """Return the output lines for a sequence of iter_qbo_blocks pairs.
+    found, if given, counts the cleaned memos as in process_transaction.
+    """
+    modified_lines = []
+    for is_transaction, block in blocks:
+        if is_transaction:
+            modified_lines.extend(process_transaction(block, rules, found))  # Process the collected lines of the transaction
+        else:
+            modified_lines.extend(block)  # Lines not part of a transaction are added directly to the output
+    return modified_lines
+
+
+@logger.catch
+def process_qbo_lines(lines, rules=DEFAULT_RULES):
+    found = {'cleaned': 0}
+    modified_lines = _process_blocks(iter_qbo_blocks(lines, found), rules, found)
+    MEMOS_CLEANED.inc(found['cleaned'])
+    logger.info(f"{found['STMTTRN']} transactions found.")
     logger.debug(modified_lines)  # TODO make this output more log friendly
-    return modified_lines, qbo_file_date, account_number
+    return modified_lines, found['DTEND'], found['ACCTID']
+
+
+def _process_chunk(blocks, rules=DEFAULT_RULES):
+    """_process_blocks in a worker process. Also return the memos it cleaned, the parent counts them."""
+    found = {'cleaned': 0}
+    lines = _process_blocks(blocks, rules, found)
+    return lines, found['cleaned']
+
 
+def _chunk_blocks(blocks, chunk_size):
+    """Group iter_qbo_blocks pairs into lists holding chunk_size transactions each."""
+    chunk, xacts = [], 0
+    for block in blocks:
+        chunk.append(block)
+        xacts += block[0]
+        if xacts >= chunk_size:
+            yield chunk
+            chunk, xacts = [], 0
+    if chunk:
+        yield chunk
+
+
+def _quiet_worker():
+    """Worker processes only report problems; the parent process does the logging."""
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+
+@logger.catch
+def process_qbo_lines_parallel(lines, rules=DEFAULT_RULES, workers=None, chunk_size=PARALLEL_CHUNK_SIZE):
+    """Same result as process_qbo_lines, byte for byte, with the transactions rewritten by a pool
+    of worker processes. The file is split at <STMTTRN> boundaries into chunks of chunk_size
+    transactions; header, footer and the order of every line are preserved.
+    Files with fewer than two chunks are processed in this process.
+    """
+    found = {'cleaned': 0}
+    chunks = list(_chunk_blocks(iter_qbo_blocks(lines, found), chunk_size))
+    if len(chunks) < 2 or workers == 1:
+        modified_lines = _process_blocks(itertools.chain.from_iterable(chunks), rules, found)
+        MEMOS_CLEANED.inc(found['cleaned'])
+    else:
+        modified_lines = []
+        with ProcessPoolExecutor(workers, initializer=_quiet_worker) as pool:
+            for chunk_lines, cleaned in pool.map(_process_chunk, chunks, itertools.repeat(rules)):
+                modified_lines.extend(chunk_lines)
+                MEMOS_CLEANED.inc(cleaned)
+    logger.info(f"{found['STMTTRN']} transactions found in {len(chunks)} chunks.")
+    return modified_lines, found['DTEND'], found['ACCTID']
 
 
 @logger.catch
@@ -160,13 +289,16 @@ def read_base_file(input_file):
     Return a list of lines contained in base_file.
     """
     logger.info(f"Attempting to open input file {input_file.name}")
-    try:
-        with open(input_file) as IN_FILE:
-            file_contents = IN_FILE.readlines()
-    except Exception as e:
-        logger.error(f"Error in reading {input_file.name}")
-        logger.warning(str(e))
-        file_contents = []
+    with stage("read_base_file", input_file.name, file_size(input_file)) as fields:
+        try:
+            with open(input_file) as IN_FILE:
+                file_contents = IN_FILE.readlines()
+        except Exception as e:
+            logger.error(f"Error in reading {input_file.name}")
+            logger.warning(str(e))
+            ERRORS.inc(stage="read")
+            file_contents = []
+        fields["xacts"] = sum(1 for line in file_contents if line.strip().startswith("<STMTTRN>"))
     if file_contents != []:
         logger.info("File contents read successfully.")
     return file_contents
@@ -180,49 +312,198 @@ def modify_QBO(QBO_records_list, originalfile_pathobj):
     Let's swap those to help quickbooks process the transactions and categorize them.
     Quickbooks limits names of transactions to 32 characters so let's remove the verbose language from the original memos.
     """
-    modified_qbo, file_date, acct_number = process_qbo_lines(QBO_records_list)
-    # Attempt to write results to cleanfile
-    fname = "".join([file_date, "_", acct_number, QBO_FILE_EXT])
-    logger.info(f"Attempting to output to file name: {fname}")
-    clean_output_file = Path(QBO_MODIFIED_DIRECTORY, fname)
-    try:
-        with open(clean_output_file, "w") as f:
-            f.writelines(modified_qbo)
-    except Exception as e:
-        logger.error(f"Error in writing {clean_output_file}")
-        logger.warning(str(e))
+    name = Path(originalfile_pathobj).name
+    arrived = arrival_time(originalfile_pathobj)
+    with stage("modify_QBO", name) as fields:
+        with stage("rewrite_QBO", name) as rewritten:
+            modified_qbo, file_date, acct_number = rewrite_qbo_lines(QBO_records_list)
+            fields["xacts"] = rewritten["xacts"] = modified_qbo.count("<STMTTRN>\n")
+        # Attempt to write results to cleanfile
+        clean_output_file = output_path(file_date, acct_number)
+        logger.info(f"Attempting to output to file name: {clean_output_file.name}")
+        try:
+            with stage("write_QBO", clean_output_file.name, xacts=fields["xacts"]) as written:
+                write_validated(clean_output_file, modified_qbo)
+                written["bytes"] = file_size(clean_output_file)
+        except Exception as e:
+            logger.error(f"Error in writing {clean_output_file}")
+            logger.warning(str(e))
+            ERRORS.inc(stage="write")
+            sys.exit(1)
+        fields["bytes"] = written["bytes"]
+    file_converted("qbo", fields["xacts"], arrived)
+    logger.info(f"File {clean_output_file} contents written successfully.")
+    store_transactions(modified_qbo, clean_output_file.name)
+    if not remove_original(originalfile_pathobj):
         sys.exit(1)
+    return
+
+
+def iter_modified_pieces(input_file, checkpoint, state, rules=DEFAULT_RULES):
+    """The output of process_qbo_lines on the lines of input_file, streamed from disk as
+    (text, is_transaction, input offset) pieces for qbo_checkpoint.ResumableOutput.write.
+    state holds the DTEND and ACCTID found so far and the last transaction, which a stray
+    </STMTTRN> after the checkpoint repeats.
+    """
+    resumed_last = state.get("last") if checkpoint is not None else None
+    found = {'cleaned': 0}  # kept out of state, which goes into the checkpoint
+    try:
+        with open(input_file, "rb") as f:
+            lines = OffsetLines(f, checkpoint.input_offset if checkpoint is not None else 0)
+            for is_transaction, block in iter_qbo_blocks(lines, state):
+                if not is_transaction:
+                    yield "".join(block), False, None
+                    continue
+                if resumed_last is not None:
+                    if block[0].strip().startswith('<STMTTRN>'):
+                        resumed_last = None
+                    else:
+                        block = resumed_last + block
+                state["last"] = block
+                yield "".join(process_transaction(block, rules, found)), True, lines.offset
+    finally:
+        MEMOS_CLEANED.inc(found['cleaned'])
+
+
+@logger.catch
+def modify_QBO_resumable(originalfile_pathobj, every=None):
+    """modify_QBO streaming the file from disk and recording a checkpoint every `every`
+    (QBO_CHECKPOINT_XACTS) transactions, resuming from the checkpoint a killed run left behind.
+    Writes the same bytes as modify_QBO. Return the number of transactions written.
+    """
+    name = Path(originalfile_pathobj).name
+    arrived = arrival_time(originalfile_pathobj)
+    output = ResumableOutput(originalfile_pathobj, QBO_MODIFIED_DIRECTORY)
+    validator = StatementValidator(name)
+    with stage("modify_QBO", name) as fields:
+        try:
+            with stage("write_QBO", name) as written:  # rewritten while it is written
+                xacts, state = output.write(
+                    lambda checkpoint, state: iter_modified_pieces(originalfile_pathobj, checkpoint, state, QBO_RULES),
+                    validator, every or QBO_CHECKPOINT_XACTS or CHECKPOINT_XACTS,
+                )
+                clean_output_file = output_path(state.get('DTEND', '19700101'), state.get('ACCTID', '42'))
+                output.finish(clean_output_file)
+                fields["xacts"] = written["xacts"] = xacts
+                fields["bytes"] = written["bytes"] = file_size(clean_output_file)
+        except Exception as e:
+            logger.error(f"Error in writing the modified {name}, it resumes from its last checkpoint next time")
+            logger.warning(str(e))
+            ERRORS.inc(stage="write")
+            sys.exit(1)
+    validator.source = clean_output_file.name
+    save_report(validator.report())
+    file_converted("qbo", xacts, arrived)
     logger.info(f"File {clean_output_file} contents written successfully.")
+    if QBO_STORE_PATH:
+        with open(clean_output_file) as f:
+            store_transactions(f, clean_output_file.name)
+    if not remove_original(originalfile_pathobj):
+        sys.exit(1)
+    return xacts
+
+
+def rewrite_qbo_lines(QBO_records_list):
+    """process_qbo_lines, spread over QBO_WORKERS processes when more than one is configured."""
+    if QBO_WORKERS > 1:
+        return process_qbo_lines_parallel(QBO_records_list, QBO_RULES, workers=QBO_WORKERS)
+    return process_qbo_lines(QBO_records_list, QBO_RULES)
+
+
+def write_validated(clean_output_file, modified_qbo):
+    """write_qbo_file, checking the statement as it is written, then save the validation report."""
+    validator = StatementValidator(clean_output_file.name)
+    write_qbo_file(clean_output_file, validator.watch(chunked(modified_qbo)))
+    save_report(validator.report())
+
+
+def store_transactions(modified_qbo, source):
+    """Add the written transactions to the transaction store when QBO_STORE_PATH is set."""
+    if QBO_STORE_PATH:
+        from qbo_store import store_qbo_lines
+
+        store_qbo_lines(QBO_STORE_PATH, modified_qbo, source)
+
+
+def output_path(file_date, acct_number):
+    """Return the Path of the modified file: <DTEND>_<ACCTID>.qbo in the output directory."""
+    return Path(QBO_MODIFIED_DIRECTORY, "".join([file_date, "_", acct_number, QBO_FILE_EXT]))
+
+
+def write_qbo_file(clean_output_file, modified_qbo):
+    """Write the lines to a temporary file beside clean_output_file and rename it into place
+    so a reader never sees a half written QBO file.
+    """
+    temporary_file = Path(f"{clean_output_file}.tmp")
+    try:
+        with open(temporary_file, "w") as f:
+            f.writelines(modified_qbo)
+        os.replace(temporary_file, clean_output_file)
+    finally:
+        if temporary_file.exists():
+            temporary_file.unlink()
+
+
+def remove_original(originalfile_pathobj):
+    """Delete the bank download once it has been converted, archiving it first when
+    QBO_ARCHIVE_DIRECTORY is set. Return False if that failed; a download that could not
+    be archived is kept.
+    """
     logger.info(f"Attempting to remove old {originalfile_pathobj} file...")
     if Path(originalfile_pathobj).exists():
-        try:
-            os.remove(originalfile_pathobj)
-        except OSError as e:
-            logger.warning(f"Error: {e.file_path} - {e.strerror}")
-            sys.exit(1)
+        with stage("remove_original", Path(originalfile_pathobj).name, file_size(originalfile_pathobj)) as fields:
+            try:
+                if QBO_ARCHIVE_DIRECTORY:
+                    archive_original(QBO_ARCHIVE_DIRECTORY, originalfile_pathobj)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Error archiving {originalfile_pathobj}: {e}")
+                ERRORS.inc(stage="archive")
+                fields["ok"] = False
+                return False
+            try:
+                os.remove(originalfile_pathobj)
+            except OSError as e:
+                logger.warning(f"Error: {e.filename} - {e.strerror}")
+                ERRORS.inc(stage="remove")
+                fields["ok"] = False
+                return False
         logger.info(f"Success removing {originalfile_pathobj.name}")
     else:
         logger.warning(f"Sorry, I can not find {originalfile_pathobj.name} file.")
-    return
+    return True
 
 
 @logger.catch
 def process_QBO():
     logger.info("...checking download directory...")
     names = list(QBO_DOWNLOAD_DIRECTORY.glob(f"*{QBO_FILE_EXT}"))
-    while names != []:
-        # loop while something to process is found
-        file_pathobj = names.pop()
-        original_records_list = read_base_file(file_pathobj)
-        # we have a file, try to process
-        logger.info(f"file found to process: {file_pathobj.name}")
-        modify_QBO(original_records_list, file_pathobj)
+    files_waiting("qbo", names)
+    with stage("process_QBO", str(QBO_DOWNLOAD_DIRECTORY), 0, 0) as fields:
+        if QBO_PIPELINE_THREADS > 0 and names and not QBO_CHECKPOINT_XACTS:
+            from qbo_pipeline import run_pipeline  # imported here, qbo_pipeline builds on this module
+
+            metrics = run_pipeline(names, transform_threads=QBO_PIPELINE_THREADS)
+            fields["bytes"], fields["xacts"] = metrics["read"].nbytes, metrics["transform"].xacts
+            names = []
+        while names != []:
+            # loop while something to process is found
+            file_pathobj = names.pop()
+            fields["bytes"] += file_size(file_pathobj) or 0
+            if QBO_CHECKPOINT_XACTS or has_checkpoint(file_pathobj, QBO_MODIFIED_DIRECTORY):
+                logger.info(f"file found to process resumably: {file_pathobj.name}")
+                fields["xacts"] += modify_QBO_resumable(file_pathobj) or 0
+                continue
+            original_records_list = read_base_file(file_pathobj)
+            fields["xacts"] += sum(1 for line in original_records_list if line.strip().startswith("<STMTTRN>"))
+            # we have a file, try to process
+            logger.info(f"file found to process: {file_pathobj.name}")
+            modify_QBO(original_records_list, file_pathobj)
     if names == []:
         logger.info(f"no QBO files remain in {QBO_DOWNLOAD_DIRECTORY} directory.")
     return
 
 
-def defineLoggers(filename):
+def defineLoggers(filename, structured=False):
     def should_rotate(message, file):
         # Determine if log file should rotate based on size
         filesize_limit = 5e8  # 500 MB
@@ -242,18 +523,35 @@ def defineLoggers(filename):
     logger.add(log_path, rotation=should_rotate, level="DEBUG", encoding="utf8", retention="10 days")
     logger.add(sys.stderr, level="INFO")  # Optional: Add a console handler if needed
     print(f"Logging to {log_path}")
+    if structured:
+        add_structured_sink(filename, log_directory)
 
 
 @logger.catch
-def Main():
-    defineLoggers(f"{RUNTIME_NAME}")
+def Main(structured=False):
+    defineLoggers(f"{RUNTIME_NAME}", structured)
     logger.info("Program Start.")  # log the start of the program
     process_QBO()
     logger.info("Program End.")
     return
 
 
+@logger.catch
+def Watch(interval=10, structured=False):
+    """Keep checking the download directory every interval seconds until interrupted."""
+    defineLoggers(f"{RUNTIME_NAME}", structured)
+    logger.info("Program Start.")
+    try:
+        while True:
+            process_QBO()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user.")
+    logger.info("Program End.")
+    return
+
+
 """Check if this file is being run directly and activate main function if so.
 """
 if __name__ == "__main__":
-    Main()
+    Main(structured="--json-log" in sys.argv)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+""" amount_rules / name transactions by their type, amount and date
+
+QuickBooks only matches transactions on their names and a check or a transfer often has
+none worth matching: "CHECK PAID", "DEPOSIT". Recurring payments of a fixed amount are
+recognised by that amount instead, e.g. a CHECK for -300.00 on the 1st is the rent.
+
+Rules are kept in a JSON file:
+
+    [
+        {"name": "Rent", "trntype": "CHECK", "amount": "-300.00", "days": [1, 2, 3]},
+        {"name": "Electric", "trntype": "DEBIT", "min": "-180", "max": "-60", "from": "20220101"},
+        {"name": "Payroll", "amount": "1520.75"}
+    ]
+
+amount matches one amount exactly; min/max match a range, both included. trntype,
+days (days of the month), from and until (YYYYMMDD, both included) are optional.
+
+An AmountRuleIndex answers in O(log n): exact amounts are a dict keyed by (TRNTYPE,
+cents) and ranges are kept in one interval tree per TRNTYPE. When several rules match,
+an exact amount beats a range, a narrower range beats a wider one, and otherwise the
+rule listed first wins.
+"""
+
+import json
+from collections import namedtuple
+
+from qbo_util import amount_cents
+
+ANY_TYPE = "*"
+
+AmountRule = namedtuple("AmountRule", "name trntype low high days start end order")
+
+
+def _rule_from_dict(data, order):
+    if "amount" in data:
+        low = high = amount_cents(data["amount"])
+    else:
+        low, high = amount_cents(data["min"]), amount_cents(data["max"])
+    if low is None or high is None or low > high:
+        raise ValueError(f"rule {data.get('name')!r} has no valid amount or range")
+    days = frozenset(data["days"]) if data.get("days") else None
+    return AmountRule(data["name"], data.get("trntype") or ANY_TYPE, low, high, days,
+                      data.get("from"), data.get("until"), order)
+
+
+def applies_on(rule, dtposted):
+    """True when the date of the transaction is within the days and dates of the rule."""
+    date = dtposted[:8]
+    if rule.start and date < rule.start:
+        return False
+    if rule.end and date > rule.end:
+        return False
+    if rule.days is not None:
+        try:
+            return int(date[6:8]) in rule.days
+        except ValueError:
+            return False
+    return True
+
+
+class IntervalTree:
+    """Static centered interval tree over AmountRules, stabbing queries in O(log n + matches)."""
+
+    def __init__(self, rules):
+        self.center = None
+        self.left = self.right = None
+        self.by_low = self.by_high = []
+        if not rules:
+            return
+        ends = sorted(end for rule in rules for end in (rule.low, rule.high))
+        self.center = ends[len(ends) // 2]
+        here = [rule for rule in rules if rule.low <= self.center <= rule.high]
+        self.by_low = sorted(here, key=lambda rule: rule.low)
+        self.by_high = sorted(here, key=lambda rule: -rule.high)
+        left = [rule for rule in rules if rule.high < self.center]
+        right = [rule for rule in rules if rule.low > self.center]
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def stab(self, point):
+        """Yield the rules whose range holds point."""
+        node = self
+        while node is not None and node.center is not None:
+            if point < node.center:
+                for rule in node.by_low:
+                    if rule.low > point:
+                        break
+                    yield rule
+                node = node.left
+            elif point > node.center:
+                for rule in node.by_high:
+                    if rule.high < point:
+                        break
+                    yield rule
+                node = node.right
+            else:
+                yield from node.by_low
+                return
+
+
+class AmountRuleIndex:
+    """Rules naming transactions by type, amount and date. Plain containers only, so it pickles."""
+
+    def __init__(self, rules=()):
+        self.exact = {}  # (trntype, cents) -> rules in order
+        ranges = {}
+        for rule in rules:
+            if rule.low == rule.high:
+                self.exact.setdefault((rule.trntype, rule.low), []).append(rule)
+            else:
+                ranges.setdefault(rule.trntype, []).append(rule)
+        self.ranges = {trntype: IntervalTree(type_rules) for trntype, type_rules in ranges.items()}
+        self.count = len(rules)
+
+    def __len__(self):
+        return self.count
+
+    def match(self, trntype, trnamt, dtposted=""):
+        """Return the name given by the best rule for the transaction, None if no rule applies."""
+        cents = amount_cents(trnamt)
+        if cents is None:
+            return None
+        best = None
+        for key in (trntype, ANY_TYPE):
+            for rule in self.exact.get((key, cents), ()):
+                if applies_on(rule, dtposted) and (best is None or rule.order < best.order):
+                    best = rule
+        if best is not None:
+            return best.name
+        for key in (trntype, ANY_TYPE):
+            tree = self.ranges.get(key)
+            if tree is None:
+                continue
+            for rule in tree.stab(cents):
+                if applies_on(rule, dtposted) and (
+                        best is None or (rule.high - rule.low, rule.order) < (best.high - best.low, best.order)):
+                    best = rule
+        return None if best is None else best.name
+
+    @classmethod
+    def from_dicts(cls, items):
+        return cls([_rule_from_dict(item, order) for order, item in enumerate(items)])
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dicts(json.load(f))
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+""" bank_profiles / the csv layouts csv2qbo can convert
+
+Each bank writes its own csv: different columns, date formats, signs and delimiters.
+A profile (csv2qbo.CsvProfile) holds everything bank specific: the column titles that
+identify the layout, a row mapper turning a csv row into RowFields, the date format,
+whether the newest transaction comes first and the OFX FI/BANKID/ACCTID header.
+
+schwab.com checking is built in. Other banks are described in JSON files registered with
+register_file() (qbo csv2qbo --profiles FILE):
+
+    {
+        "name": "credit_union_checking",
+        "header": ["Posting Date", "Description", "Amount", "Check Number", "Balance"],
+        "columns": {"date": "Posting Date", "description": "Description", "amount": "Amount",
+                    "check": "Check Number", "balance": "Balance"},
+        "sign": "signed",
+        "date_format": "%m/%d/%Y",
+        "newest_first": false,
+        "fi": {"org": "My Credit Union", "fid": "12345", "bank_id": "123456789",
+               "account_id": "0001234567", "account_type": "CHECKING"},
+        "bad_text": ["POS "]
+    }
+
+sign is "signed" (one amount column, debits negative), "negated" (one amount column,
+debits positive as on card statements) or "split" ("withdrawal" and "deposit" columns,
+both positive). "decimal": "," reads amounts and balances written like 1.234,56.
+posted_marker names the row before the posted transactions when the file has one,
+otherwise the transactions follow the header row.
+
+Profiles are loaded the first time a file has to be identified. identify() reads only the
+first HEAD_BYTES of a file, detects the delimiter with csv.Sniffer (or tries each of
+SNIFF_DELIMITERS) and looks the column titles up in a dict, so identifying costs the same
+however many profiles are registered. The row mapper of a profile is compiled once from its column titles into column indexes.
+"""
+
+import csv
+import json
+from operator import itemgetter
+
+import csv2qbo
+from csv2qbo import CsvProfile, RowFields, money_cents
+
+HEAD_BYTES = 8192
+SNIFF_DELIMITERS = ",;\t|"
+
+BANK_ID_TEMPLATE = """
+<LANGUAGE>ENG
+<FI>
+<ORG>{org}
+<FID>{fid}
+</FI>
+<INTU.BID>{fid}
+</SONRS>
+</SIGNONMSGSRSV1>
+<BANKMSGSRSV1>
+<STMTTRNRS>
+<TRNUID>0
+<STATUS>
+<CODE>0
+<SEVERITY>INFO
+</STATUS>
+<STMTRS>
+<CURDEF>USD
+<BANKACCTFROM>
+<BANKID>{bank_id}
+<ACCTID>{account_id}
+<ACCTTYPE>{account_type}
+</BANKACCTFROM>
+<BANKTRANLIST>
+"""
+
+_loaders = {"schwab_checking": lambda: [csv2qbo.SCHWAB_CHECKING]}  # name -> function returning profiles
+_profiles = None  # name -> CsvProfile, once loaded
+_by_header = None  # tuple of column titles -> CsvProfile
+
+
+def register(name, loader):
+    """Register a function returning a list of CsvProfiles. It is called when profiles are first needed."""
+    global _profiles, _by_header
+    _loaders[name] = loader
+    _profiles = _by_header = None
+
+
+def register_file(path):
+    """Register the profile, or list of profiles, described in the JSON file path."""
+    def load():
+        with open(path) as f:
+            data = json.load(f)
+        return [profile_from_dict(item) for item in (data if isinstance(data, list) else [data])]
+
+    register(str(path), load)
+
+
+def _load():
+    """Load the registered profiles. ValueError if two of them share a name or column titles,
+    identify() could not tell them apart.
+    """
+    global _profiles, _by_header
+    if _profiles is None:
+        profiles, by_header = {}, {}
+        for loader in _loaders.values():
+            for profile in loader():
+                header = tuple(profile.header)
+                if profile.name in profiles:
+                    raise ValueError(f"two csv profiles are called {profile.name!r}")
+                if header in by_header:
+                    raise ValueError(f"csv profiles {by_header[header].name!r} and {profile.name!r} have the same header {list(header)}")
+                profiles[profile.name], by_header[header] = profile, profile
+        _profiles, _by_header = profiles, by_header
+    return _profiles
+
+
+def names():
+    return sorted(_load())
+
+
+def get(name):
+    """The profile called name. KeyError if there is none."""
+    return _load()[name]
+
+
+def format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    return f"{sign}{abs(cents) // 100}.{abs(cents) % 100:02d}"
+
+
+def compile_row_mapper(header, columns, sign="signed", decimal="."):
+    """Return a function making RowFields of a row of the csv layout with column titles header,
+    whose amount is None when the row has none. columns maps the fields date, description, amount (or withdrawal and deposit), balance and
+    check to column titles; the titles are resolved to indexes here, once.
+    """
+    index = {title: i for i, title in enumerate(header)}
+
+    def column(field):
+        title = columns.get(field)
+        if not title:
+            return lambda row: ""
+        return itemgetter(index[title])
+
+    def money_column(field):
+        get = column(field)
+        if decimal == ".":
+            return get
+        return lambda row: get(row).replace(".", "").replace(decimal, ".")
+
+    date, description, balance, check = column("date"), column("description"), money_column("balance"), column("check")
+    if sign == "split":
+        withdrawal, deposit = money_column("withdrawal"), money_column("deposit")
+
+        def cents(row):
+            credit = money_cents(deposit(row))
+            if credit is not None:
+                return credit
+            debit = money_cents(withdrawal(row))
+            return None if debit is None else -debit
+    elif sign in ("signed", "negated"):
+        amount, factor = money_column("amount"), -1 if sign == "negated" else 1
+
+        def cents(row):
+            value = money_cents(amount(row))
+            return None if value is None else factor * value
+    else:
+        raise ValueError(f"unknown sign convention {sign!r}")
+
+    def row_mapper(row):
+        value = cents(row)
+        checknum = check(row).strip()
+        trntype = "CHECK" if checknum else "CREDIT" if value is not None and value >= 0 else "DEBIT"
+        amount = None if value is None else format_cents(value)  # a row without one, check_running_balance skips it
+        return RowFields(date(row), trntype, checknum, description(row), amount, balance(row))
+
+    return row_mapper
+
+
+def profile_from_dict(data):
+    """Build a CsvProfile from its JSON description (see the module docstring)."""
+    header = tuple(data["header"])
+    fi = data.get("fi", {})
+    account_id = fi.get("account_id", "")
+    bank_id_boilerplate = BANK_ID_TEMPLATE.format(
+        org=fi.get("org", ""), fid=fi.get("fid", ""), bank_id=fi.get("bank_id", ""),
+        account_id=account_id, account_type=fi.get("account_type", "CHECKING"),
+    )
+    return CsvProfile(
+        data["name"],
+        bank_id_boilerplate,
+        account_id,
+        data.get("bad_text", []),
+        header,
+        data.get("posted_marker"),
+        compile_row_mapper(header, data["columns"], data.get("sign", "signed"), data.get("decimal", ".")),
+        data.get("date_format"),
+        data.get("newest_first", True),
+    )
+
+
+def _head(path):
+    with open(path, newline="") as f:
+        return f.read(HEAD_BYTES)
+
+
+def _delimited(delimiter):
+    return type("delimited", (csv.excel,), {"delimiter": delimiter})
+
+
+def _dialects(head):
+    """The sniffed dialect of head, then the default comma separated one, then the other delimiters.
+    Sniffing fails on files starting with a title line, the header lookup then tells the delimiter.
+    """
+    try:
+        yield csv.Sniffer().sniff(head, delimiters=SNIFF_DELIMITERS)
+    except csv.Error:
+        pass
+    yield csv.excel
+    for delimiter in SNIFF_DELIMITERS[1:]:
+        yield _delimited(delimiter)
+
+
+def sniff_dialect(path):
+    return next(_dialects(_head(path)))
+
+
+def identify_head(head):
+    """Return (CsvProfile, csv dialect) whose column titles appear in head, the first lines of a file.
+    (None, None) if no profile matches.
+    """
+    _load()
+    lines = head.splitlines()[:-1] or head.splitlines()  # the last line may be cut short
+    for dialect in _dialects(head):
+        for row in csv.reader(lines, dialect):
+            profile = _by_header.get(tuple(cell.strip() for cell in row))
+            if profile is not None:
+                return profile, dialect
+    return None, None
+
+
+def identify(path):
+    """identify_head of the first HEAD_BYTES of the file path."""
+    return identify_head(_head(path))
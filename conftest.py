@@ -0,0 +1,33 @@
+# conftest.py
+
+import pytest
+
+import QBOfix2024_2
+import qbo_validate
+from qbo_test_data import SAMPLE_QBO
+
+
+@pytest.fixture(autouse=True)
+def validation_reports(tmp_path, monkeypatch):
+    """Validation reports of every test go to its own tmp_path, not LOGS."""
+    monkeypatch.setattr(qbo_validate, "REPORT_DIRECTORY", str(tmp_path / "validation"))
+    return tmp_path / "validation"
+
+
+@pytest.fixture
+def directories(tmp_path, monkeypatch):
+    """(download, output) directories the fixer reads from and writes to."""
+    download, output = tmp_path / "download", tmp_path / "output"
+    download.mkdir()
+    output.mkdir()
+    monkeypatch.setattr(QBOfix2024_2, "QBO_DOWNLOAD_DIRECTORY", download)
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", output)
+    return download, output
+
+
+@pytest.fixture
+def sample_download(directories):
+    """The sample statement waiting in the download directory."""
+    path = directories[0] / "download.qbo"
+    path.write_text(SAMPLE_QBO.read_text())
+    return path
@@ -13,11 +13,20 @@ runtime_name = os.path.basename(__file__)
 
 import re
 import csv
+import datetime
+import itertools
+import locale
 import sys
 import time
+from collections import namedtuple
+from functools import lru_cache
 from loguru import logger
-from dateutil.parser import parse
-from hashids import Hashids
+from structured_log import add_structured_sink, file_size, stage
+from qbo_metrics import BACKLOG, ERRORS, FILES_SEEN, REGISTRY, arrival_time, file_converted
+from qbo_util import chunked
+from qbo_validate import StatementValidator, parse_amount, save_report
+from qbo_archive import archive_original
+from qbo_checkpoint import CHECKPOINT_XACTS, OffsetLines, ResumableOutput, has_checkpoint
 
 
 # files to be updated
@@ -26,6 +35,11 @@ filename = "download.csv"
 basedirectory = home + "/Downloads/"
 outputdirectory = home + "/Documents/"
 output_file_extension = ".qbo"
+store_path = None  # SQLite transaction store the converted transactions are added to, see qbo_store.py
+allow_balance_gaps = False  # convert even when the running balance shows missing or reordered rows
+checkpoint_xacts = 0  # transactions between checkpoints of a resumable conversion, 0 for none, see qbo_checkpoint.py
+archive_directory = None  # archive the downloads are stored in before they are removed, see qbo_archive.py
+bank_profile = None  # name of the bank profile to convert with, None to recognise the bank from the file
 
 # header line for schwab.com downloads
 schwabHeader = "Transactions  for Checking account XXXXXX-090258"
@@ -99,18 +113,27 @@ qbo_xact_amount = (
 qbo_xact_unique_id = (
     "<FITID>"
 )  # +date+amount+index+memo (maximum 31 characters) (index is a nonce)
-nonce_index = 4095  # 3 digit hex counter counting down from 4095(fff)
 qbo_xact_memo = "<MEMO>"  # +up to 64 characters
 qbo_xact_name = "<NAME>"  # + nomore than 31 characters
+# one format per transaction type, each <STMTTRN> block is written with a single format call
+STMTTRN_TEMPLATE = (
+    "<STMTTRN>\n<TRNTYPE>{0}\n<DTPOSTED>{1}\n<TRNAMT>{2}\n<FITID>{3}\n"
+    "<NAME>{5}\n<MEMO>{6}\n</STMTTRN>\n"
+)
+CHECK_STMTTRN_TEMPLATE = (
+    "<STMTTRN>\n<TRNTYPE>{0}\n<DTPOSTED>{1}\n<TRNAMT>{2}\n<FITID>{3}\n<CHECKNUM>{4}\n"
+    "<NAME>{5}\n<MEMO>{6}\n</STMTTRN>\n"
+)
+STMTTRN_FORMATS = {"CHECK": CHECK_STMTTRN_TEMPLATE.format}
 qbo_file_final_boilerplate = """
 </BANKTRANLIST>
 <LEDGERBAL>
-<BALAMT>0
-<DTASOF>20181231000000.000[-6:CST]
+<BALAMT>{balance}
+<DTASOF>{file_date}000000.000[-6:CST]
 </LEDGERBAL>
 <AVAILBAL>
-<BALAMT>0
-<DTASOF>20181231000000.000[-6:CST]
+<BALAMT>{balance}
+<DTASOF>{file_date}000000.000[-6:CST]
 </AVAILBAL>
 </STMTRS>
 </STMTTRNRS>
@@ -118,21 +141,106 @@ qbo_file_final_boilerplate = """
 </OFX>
 """
 
+# the csv rows following this marker are the posted transactions
+POSTED_MARKER = "Posted Transactions"
+
+DATE_CACHE_SIZE = 4096  # distinct csv dates remembered by qbo_date
+
 # text to remove from transaction descriptions
 bad_text = [r"DEBIT +\d{4}", "CKCD ", "AC-", "POS ", "POS DB "]
 
 qbo_file_date_tag = "<DTEND>"
-file_date = ""
 acct_number_tag = "<ACCTID>"
 acct_number = ""
 
+# column titles of the posted transactions
+SCHWAB_HEADER = ("Date", "Type", "Check #", "Description", "Withdrawal (-)", "Deposit (+)", "RunningBalance")
+
+# what a row mapper makes of one csv row, every field is text as written to the QBO file.
+# fitid_amount is the amount as it went into the FITID of earlier conversions when that
+# differs from amount, so FITIDs stay the same and QuickBooks does not import rows again.
+RowFields = namedtuple("RowFields", "date trntype checknum description amount balance fitid_amount", defaults=(None,))
+
+
+def schwab_row(xact):
+    """Map a schwab.com csv row
+        Date,Type,Check #,Description,Withdrawal (-),Deposit (+),RunningBalance
+    to RowFields, converting debits and credits into the correct form.
+    """
+    # amounts are "$" followed by the number, sometimes with spaces in front of the "$".
+    # TRNAMT has them stripped; the FITID keeps the amount as first converted, a " $5.00"
+    # withdrawal as "-$5.00", so rows already imported keep their FITID.
+    if xact[1] == "CHECK":
+        debit_credit = "CHECK"
+        written = xact[4]
+    else:
+        debit_credit = "DEBIT"
+        if xact[5] != "":  # csv position 5 is blank for debits
+            debit_credit = "CREDIT"
+            written = xact[5]
+        else:
+            written = xact[4]
+    sign = "" if debit_credit == "CREDIT" else "-"
+    amount = (sign + written.strip()[1:]).strip()
+    fitid_amount = (sign + written[1:]).strip()
+    return RowFields(xact[0], debit_credit, xact[2], xact[3], amount, xact[6],  # xact[6] is the banks own running balance
+                     None if fitid_amount == amount else fitid_amount)
+
+
+# the bank specific pieces of a conversion. Passed to each call instead of living in
+# module globals so conversions of different files can run at the same time.
+#   header        column titles of the posted transactions, identifies the bank (see bank_profiles.py)
+#   posted_marker row before the posted transactions, None when they follow the header
+#   row_mapper    function making RowFields of a csv row
+#   date_format   strptime format of the dates, None to let dateutil guess
+#   newest_first  the most recent transaction is the first row
+CsvProfile = namedtuple(
+    "CsvProfile",
+    "name bank_id_boilerplate account_number bad_text header posted_marker row_mapper date_format newest_first",
+    defaults=(SCHWAB_HEADER, POSTED_MARKER, schwab_row, None, True),
+)
+SCHWAB_CHECKING = CsvProfile("schwab_checking", qbo_file_bank_id_boilerplate, acct_number, bad_text)
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def qbo_date(string, date_format=None):
+    """The QBO date of a csv date, parsed with strptime when date_format is known, else by dateutil.
+    A statement repeats a few hundred dates at most so each is only parsed once.
+    """
+    if date_format is not None:
+        return datetime.datetime.strptime(string.strip(), date_format).strftime("%Y%m%d")
+    from dateutil.parser import parse  # imported on first use to keep startup fast
+
+    return parse(string).strftime("%Y%m%d")
+
+
+REGISTRY.cache_metrics.register("csv_dates", qbo_date)
+
+
 @logger.catch
 def Fix_date(string):
     """Fix_date(time in any format)
     return date in quickbooks qbo format
     """
-    dt = parse(string)
-    return dt.strftime("%Y%m%d")
+    return qbo_date(string)
+
+
+def date_fixer(profile):
+    """Return the function turning the dates of profile into QBO dates: strptime when the format is known."""
+    if profile.date_format is None:
+        return Fix_date
+    date_format = profile.date_format
+
+    def fix_date(string):
+        return qbo_date(string, date_format)
+
+    return fix_date
+
+@lru_cache(maxsize=None)
+def _hashids():
+    """Create the Hashids encoder once, importing hashids on first use."""
+    from hashids import Hashids
+
+    return Hashids()
 
 @logger.catch
 def hashID(string):
@@ -156,7 +264,7 @@ def hashID(string):
     #   imported into quickbooks. An earlier implemntation used a random NONCE inserted into the
     #   ID string but this was not repeatable over different CSV downloads.
 
-    hashids = Hashids()  # create an instance of the module object
+    hashids = _hashids()  # shared instance of the module object
     cleaned = string.replace(",", "")  # remove any commas
     return hashids.encode(int(float(cleaned.strip("$")) * 100))
 
@@ -167,9 +275,6 @@ def hashID(string):
 #d = {"clientip": "xxx.xxx.xxx.xxx", "user": "qbo_loggs"}
 # logger.warning('Protocol problem: %s', 'connection reset')
 
-# declare program start
-logger.info("Program Start: %s" % "nominal")
-
 @logger.catch
 def read_csv_file(base_file):
     """read_base_file(fully qualified filename)
@@ -177,15 +282,16 @@ def read_csv_file(base_file):
     """
     csv_lines = []
     csv_output = []
-    try:
-        with open(base_file) as csv_file:
-            csv_lines = csv.reader(csv_file, delimiter=",")
-            for row in csv_lines:  # convert from csv object to list
-                csv_output.append(row)
+    with stage("read_csv_file", os.path.basename(base_file), file_size(base_file)):
+        try:
+            with open(base_file) as csv_file:
+                csv_lines = csv.reader(csv_file, delimiter=",")
+                for row in csv_lines:  # convert from csv object to list
+                    csv_output.append(row)
 
-    except Exception as e:
-        logger.error("Error in reading " + base_file)
-        logger.warning(str(e))
+        except Exception as e:
+            logger.error("Error in reading " + base_file)
+            logger.warning(str(e))
 
     if csv_lines != []:
         logger.debug(csv_lines)
@@ -208,7 +314,7 @@ def Clean_Line(text_list, line):
     )  # returns line without leading or trailing whitespace or newline
 
 @logger.catch
-def create_qbo_statement_block(xact):
+def create_qbo_statement_block(xact, text_list=bad_text):
     """create_qbo_statement_block(xact in form of a list)
         convert csv row in the form of:
             Date,Type,Check #,Description,Withdrawal (-),Deposit (+),RunningBalance
@@ -217,44 +323,255 @@ def create_qbo_statement_block(xact):
             converting debits and credits into the correct form
             and adding a nonce to the FITID to make each one unique to quickbooks
     """
-    global nonce_index
-    maximum_nametag_line_length = 31
+    return qbo_statement_block(schwab_row(xact), text_list)
+
+
+def qbo_statement_block(fields, text_list=bad_text, fix_date=Fix_date):
+    """qbo_statement_block(RowFields of a csv row, text list to be removed, date converter)
+    Return the lines of the <STMTTRN> block of one transaction.
+    """
+    return format_statement_block(fields, text_list, fix_date).splitlines(keepends=True)
 
-    if xact[1] == "CHECK":
-        debit_credit = "CHECK"
-        amount = "-" + xact[4][1:]
-    else:
-        debit_credit = "DEBIT"
-        amount = "0"
-        if xact[5] != "":  # csv position 5 is blank for debits
-            debit_credit = "CREDIT"
-            amount = xact[5][1:]
-        else:
-            amount = "-" + xact[4][1:]
-    amount = amount.strip()
 
-    description = Clean_Line(bad_text, xact[3])
-    xact_date = Fix_date(xact[0])
+def format_statement_block(fields, text_list=bad_text, fix_date=Fix_date, formats=STMTTRN_FORMATS):
+    """The <STMTTRN> block of one transaction as a single string, see qbo_statement_block."""
+    maximum_nametag_line_length = 31
+
+    if fields.amount is None:
+        raise ValueError(f"no amount in csv row {fields}")
+    description = Clean_Line(text_list, fields.description)
+    xact_date = fix_date(fields.date)
     # fit_id = xact_date + amount + hex(nonce_index)[2:] + description
     # nonce_index -= 1 # update nonce after use
-    fit_id = (
-        xact_date + amount + hashID(xact[6]) + description
-    )  # xact[6] is the banks own running balance
-    fit_id = fit_id[:maximum_nametag_line_length]
+    balance_hash = hashID(fields.balance) if fields.balance else ""  # the banks own running balance
+    fit_id = (xact_date + (fields.fitid_amount or fields.amount) + balance_hash + description)[:maximum_nametag_line_length]
     xact_name = description[:maximum_nametag_line_length]
-    xact_memo = description
-    formatted_transaction = []
-    formatted_transaction.append("<STMTTRN>" + "\n")
-    formatted_transaction.append("<TRNTYPE>" + debit_credit + "\n")
-    formatted_transaction.append("<DTPOSTED>" + xact_date + "\n")
-    formatted_transaction.append("<TRNAMT>" + amount + "\n")
-    formatted_transaction.append("<FITID>" + fit_id + "\n")
-    if xact[1] == "CHECK":
-        formatted_transaction.append("<CHECKNUM>" + xact[2] + "\n")
-    formatted_transaction.append("<NAME>" + xact_name + "\n")
-    formatted_transaction.append("<MEMO>" + xact_memo + "\n")
-    formatted_transaction.append("</STMTTRN>" + "\n")
-    return formatted_transaction
+    return formats.get(fields.trntype, STMTTRN_TEMPLATE.format)(
+        fields.trntype, xact_date, fields.amount, fit_id, fields.checknum, xact_name, description
+    )
+
+
+@lru_cache(maxsize=None)
+def _header_template(bank_id_boilerplate):
+    """Everything before the first transaction of an account's statements, compiled once per account."""
+    escaped = bank_id_boilerplate.replace("{", "{{").replace("}", "}}")
+    return (
+        qbo_file_header.replace("{", "{{").replace("}", "}}")
+        + qbo_file_date_header + "{file_date}" + qbo_DTSERVER_time
+        + escaped
+        + qbo_DTSTART_date + "{dtstart}\n"
+        + qbo_DTEND_date + "{file_date}\n"
+    )
+
+
+def statement_header(profile, file_date, dtstart):
+    """The QBO header of a statement of profile's account from dtstart to file_date."""
+    return _header_template(profile.bank_id_boilerplate).format(file_date=file_date, dtstart=dtstart)
+
+def parse_money(text):
+    """Decimal of a csv money column such as "$2,500.00", "-$5.00" or "($5.00)", None if blank or invalid."""
+    text = (text or "").strip().replace("$", "").replace(",", "").replace(" ", "")
+    if text.startswith("(") and text.endswith(")"):
+        text = "-" + text[1:-1]
+    return parse_amount(text) if text else None
+
+
+def money_cents(text):
+    """Integer cents of a csv money column like parse_money, without building a Decimal. None if invalid."""
+    text = (text or "").strip().replace("$", "").replace(",", "").replace(" ", "")
+    negative = text.startswith("-") or (text.startswith("(") and text.endswith(")"))
+    whole, _, fraction = text.strip("-()").partition(".")
+    if not (whole.isdigit() or (not whole and fraction)) or len(fraction) > 2 or (fraction and not fraction.isdigit()):
+        return None
+    cents = int(whole or 0) * 100 + int(fraction.ljust(2, "0"))
+    return -cents if negative else cents
+
+
+BalanceBreak = namedtuple("BalanceBreak", "line expected found")
+
+
+def balance_breaks(amounts, balances):
+    """Return the indexes i where balances[i] != balances[i + 1] + amounts[i], rows being listed
+    most recent first. None marks a value that could not be read; pairs holding one are skipped.
+    Compares whole arrays at once with NumPy when it is installed.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return [
+            i for i in range(len(amounts) - 1)
+            if None not in (amounts[i], balances[i], balances[i + 1]) and balances[i] != balances[i + 1] + amounts[i]
+        ]
+    a = np.fromiter((0 if x is None else x for x in amounts), dtype=np.int64, count=len(amounts))
+    b = np.fromiter((0 if x is None else x for x in balances), dtype=np.int64, count=len(balances))
+    known_a = np.fromiter((x is not None for x in amounts), dtype=bool, count=len(amounts))
+    known_b = np.fromiter((x is not None for x in balances), dtype=bool, count=len(balances))
+    broken = (b[:-1] != b[1:] + a[:-1]) & known_a[:-1] & known_b[:-1] & known_b[1:]
+    return np.flatnonzero(broken).tolist()
+
+
+def check_running_balance(base_file, profile=SCHWAB_CHECKING, dialect="excel"):
+    """check_running_balance(fully qualified csv filename, CsvProfile, csv dialect)
+    Every posted row's running balance must be the balance of the previous transaction plus
+    its amount. A missing row or two rows out of order break that chain.
+    Return a list of BalanceBreak(csv line number, expected cents, found cents), empty if the chain holds.
+    """
+    lines, amounts, balances = [], [], []
+    with stage("check_running_balance", os.path.basename(base_file), file_size(base_file)) as fields:
+        with open(base_file) as csv_file:
+            reader = csv.reader(csv_file, dialect)
+            for row in posted_rows(reader, profile):
+                mapped = profile.row_mapper(row)
+                lines.append(reader.line_num)
+                amounts.append(money_cents(mapped.amount))
+                balances.append(money_cents(mapped.balance))
+        fields["xacts"] = len(lines)
+        if not profile.newest_first:
+            lines.reverse()
+            amounts.reverse()
+            balances.reverse()
+        breaks = [
+            BalanceBreak(lines[i], balances[i + 1] + amounts[i], balances[i])
+            for i in balance_breaks(amounts, balances)
+        ]
+    return breaks
+
+
+def _posted_rows(rows, marker=POSTED_MARKER):
+    """Yield only the rows after the "Posted Transactions" marker.
+    A two state machine: SEEKING skips headers and pending transactions, POSTED passes rows on.
+    Blank rows are skipped in both states.
+    """
+    posted = False
+    for row in rows:
+        if not row:
+            continue
+        if posted:
+            logger.opt(lazy=True).debug("posted: {}", lambda: ", ".join(row))
+            yield row
+        else:
+            logger.opt(lazy=True).debug("not_posted: {}", lambda: ", ".join(row))
+            posted = row[0] == marker
+
+
+def _rows_after_header(rows, header):
+    """Yield the non blank rows following the row of column titles header."""
+    rows = iter(rows)
+    for row in rows:
+        if tuple(cell.strip() for cell in row) == header:
+            break
+    for row in rows:
+        if row:
+            yield row
+
+
+def posted_rows(rows, profile=SCHWAB_CHECKING):
+    """Yield the posted transaction rows of rows in the layout of profile."""
+    if profile.posted_marker:
+        return _posted_rows(rows, profile.posted_marker)
+    return _rows_after_header(rows, tuple(profile.header))
+
+
+def last_csv_row(binary_stream, encoding=None, block_size=8192, dialect="excel"):
+    """Return the last non blank csv row of a seekable binary stream by reading only its end.
+    The stream position is left unchanged.
+    """
+    position = binary_stream.tell()
+    size = binary_stream.seek(0, os.SEEK_END)
+    while True:
+        binary_stream.seek(max(position, size - block_size))
+        tail = binary_stream.read(block_size).rstrip(b"\r\n")
+        newline = tail.rfind(b"\n")
+        if newline != -1 or block_size >= size - position:
+            break
+        block_size *= 2  # the last line is longer than the block
+    binary_stream.seek(position)
+    line = tail[newline + 1:].decode(encoding or locale.getpreferredencoding(False))
+    return next(csv.reader([line], dialect), None)
+
+
+def _last_csv_row(base_file, block_size=8192, dialect="excel"):
+    """Return the last non blank csv row of base_file by reading only the end of the file."""
+    with open(base_file, "rb") as f:
+        return last_csv_row(f, block_size=block_size, dialect=dialect)
+
+
+def scan_csv_bounds(base_file, profile=SCHWAB_CHECKING, dialect="excel"):
+    """scan_csv_bounds(fully qualified filename, CsvProfile, csv dialect)
+    Return (first posted row, last posted row) without reading the whole file: the first
+    posted row is found near the top of the file and the last one is the last row in the file.
+    For schwab.com, which lists the most recent first, that is (most recent, least recent).
+    Both are None if the file has no posted transactions.
+    """
+    with open(base_file) as csv_file:
+        first = next(posted_rows(csv.reader(csv_file, dialect), profile), None)
+    if first is None:
+        return None, None
+    return first, _last_csv_row(base_file, dialect=dialect)
+
+
+def newest_row(profile, first, last):
+    """The most recent of the first and last posted rows of a file in the layout of profile."""
+    return first if profile.newest_first else last
+
+
+def output_name(profile, first, last):
+    """Name of the QBO file converted from a csv download: <newest posted date>_<account number>.qbo"""
+    date_prefix = date_fixer(profile)(profile.row_mapper(newest_row(profile, first, last)).date) if first else ""
+    return date_prefix + "_" + profile.account_number + output_file_extension
+
+
+def iter_qbo_statement(rows, last_row, profile=SCHWAB_CHECKING, summary=None, first_row=None):
+    """iter_qbo_statement(iterable of csv rows, last posted csv row, CsvProfile, dict, first posted csv row)
+    Yield the text of the QBO file, the header, one string per transaction and the footer, while
+    reading rows lazily, so a csv.reader over an open file converts any size of download in
+    bounded memory.
+    The header needs both DTSTART and DTEND before the first transaction is written; one comes
+    from the first posted row, the other from last_row which the caller finds cheaply with
+    scan_csv_bounds (or rows[-1] for a list).
+    If a summary dict is given its "file_date" and "xacts" keys are filled in as the conversion runs,
+    along with "ledger_balance", the running balance of the most recent row written as LEDGERBAL and
+    AVAILBAL, and "opening_balance", the balance before the least recent row.
+    first_row resumes a conversion: rows are then the rows following the transactions already
+    written, the header is not repeated and first_row, the first posted row of the file, only
+    serves the footer. summary["xacts"] counts the transactions of this call.
+    """
+    if summary is None:
+        summary = {}
+    summary["file_date"], summary["xacts"] = "", 0
+    row_mapper, fix_date, bad = profile.row_mapper, date_fixer(profile), profile.bad_text
+
+    if first_row is None:
+        posted = posted_rows(rows, profile)
+        first = next(posted, None)
+        if first is None:
+            logger.info("No POSTED transactions found.")
+            yield qbo_file_header
+            return
+    else:
+        posted, first = (row for row in rows if row), first_row
+
+    newest, oldest = (first, last_row) if profile.newest_first else (last_row, first)
+    newest, oldest = row_mapper(newest), row_mapper(oldest)
+    file_date = fix_date(newest.date)  # most recent date is the statement date
+    summary["file_date"] = file_date
+    if first_row is None:
+        yield statement_header(profile, file_date, fix_date(oldest.date))
+        posted = itertools.chain([first], posted)
+
+    for row in posted:
+        block = format_statement_block(row_mapper(row), bad, fix_date)
+        summary["xacts"] += 1  # counted before the block is handed out, see iter_csv_pieces
+        yield block
+
+    ledger_balance = parse_money(newest.balance)
+    oldest_balance, oldest_amount = parse_money(oldest.balance), parse_money(oldest.amount)
+    summary["ledger_balance"] = ledger_balance
+    summary["opening_balance"] = (
+        oldest_balance - oldest_amount if oldest_balance is not None and oldest_amount is not None else None
+    )
+    yield qbo_file_final_boilerplate.format(balance=0 if ledger_balance is None else ledger_balance, file_date=file_date)
+
 
 @logger.catch
 def convert_csv_file(lines, text):
@@ -267,57 +584,89 @@ def convert_csv_file(lines, text):
         dollar amounts include a leading dollar sign and are always stated as a positive number.
         values are sometimes enclosed in quotes
     """
-    global file_date, acct_number
-
-    qbo_file_lines = []
-    qbo_file_lines.append(qbo_file_header)
-
-    # qbo_file_lines.append()
-    # print(lines)
-    not_posted = True
-    posted_xacts = []
-    for line in lines:  # first strip unwanted headers and pending xacts
-        # print(line)
-        if not_posted:
-            logger.debug(f'not_posted: {", ".join(line)}')
-            if line[0] == "Posted Transactions":
-                not_posted = False
-        else:
-            logger.debug(f'posted: {", ".join(line)}')
-            posted_xacts.append(line)
-    if posted_xacts == []:
-        logger.info("No POSTED transactions found.")
-        return qbo_file_lines
-
-    # print(posted_xacts)
-    file_date = Fix_date(
-        posted_xacts[0][0]
-    )  # most recent date is same as first xact date
-    qbo_DTSERVER_date = (
-        qbo_file_date_header + file_date + qbo_DTSERVER_time
-    )  # full datetimestamp format
-
-    qbo_file_lines.append(qbo_DTSERVER_date)
+    with stage("convert_csv_file") as fields:
+        last_row = next((line for line in reversed(lines) if line), None)
+        profile = SCHWAB_CHECKING._replace(bad_text=text)
+        qbo_file_lines = list(iter_qbo_statement(lines, last_row, profile, fields))
+        fields["bytes"] = sum(len(item) for item in qbo_file_lines)
+    return qbo_file_lines
 
-    qbo_file_lines.append(qbo_file_bank_id_boilerplate)
 
-    least_recent = Fix_date(
-        posted_xacts[-1][0]
-    )  # last xact contains the most remote date
-    qbo_file_lines.append(qbo_DTSTART_date + least_recent + "\n")
+@logger.catch
+def write_qbo_file(base_file, out_file, last_row, profile=SCHWAB_CHECKING, dialect="excel"):
+    """write_qbo_file(fully qualified csv filename, open text file, last posted csv row, CsvProfile, csv dialect)
+    Stream the conversion of base_file into out_file. Return the number of transactions written.
+    """
+    validator = StatementValidator(os.path.basename(getattr(out_file, "name", base_file)))
+    arrived = arrival_time(base_file)
+    with stage("convert_csv_file", os.path.basename(base_file), file_size(base_file)) as fields:
+        with open(base_file) as csv_file:
+            rows = csv.reader(csv_file, dialect)
+            for chunk in validator.watch(chunked(iter_qbo_statement(rows, last_row, profile, fields))):
+                out_file.write(chunk)
+    logger.info(f"{fields['xacts']} transactions converted.")
+    save_report(validator.report(fields.get("opening_balance")))
+    file_converted("csv", fields["xacts"], arrived)
+    return fields["xacts"]
+
+
+def iter_csv_pieces(base_file, first, last_row, profile, dialect, summary, checkpoint, state):
+    """iter_qbo_statement of base_file streamed from disk as (text, is_transaction, input offset)
+    pieces for qbo_checkpoint.ResumableOutput.write. first and last_row come from scan_csv_bounds.
+    """
+    with open(base_file, "rb") as f:
+        lines = OffsetLines(f, checkpoint.input_offset if checkpoint is not None else 0)
+        rows = csv.reader(lines, dialect)
+        written = 0
+        for text in iter_qbo_statement(rows, last_row, profile, summary, first if checkpoint is not None else None):
+            is_transaction = summary["xacts"] != written
+            written = summary["xacts"]
+            yield text, is_transaction, lines.offset if is_transaction else None
 
-    qbo_file_lines.append(qbo_DTEND_date + file_date + "\n")
 
-    for line in posted_xacts:
-        for item in create_qbo_statement_block(line):
-            qbo_file_lines.append(item)
+@logger.catch
+def write_qbo_file_resumable(base_file, output_file, first, last_row, profile=SCHWAB_CHECKING, dialect="excel",
+                             every=None):
+    """write_qbo_file into the path output_file, recording a checkpoint every `every` (checkpoint_xacts)
+    transactions and resuming from the checkpoint a killed run left behind, see qbo_checkpoint.py.
+    Writes the same bytes as write_qbo_file. Return the number of transactions written.
+    """
+    validator = StatementValidator(os.path.basename(output_file))
+    arrived = arrival_time(base_file)
+    output = ResumableOutput(base_file, os.path.dirname(output_file) or ".")
+    summary = {}
+    with stage("convert_csv_file", os.path.basename(base_file), file_size(base_file)) as fields:
+        xacts, _ = output.write(
+            lambda checkpoint, state: iter_csv_pieces(base_file, first, last_row, profile, dialect, summary,
+                                                      checkpoint, state),
+            validator, every or checkpoint_xacts or CHECKPOINT_XACTS,
+        )
+        output.finish(output_file)
+        fields["xacts"] = xacts
+    logger.info(f"{xacts} transactions converted.")
+    save_report(validator.report(summary.get("opening_balance")))
+    file_converted("csv", xacts, arrived)
+    return xacts
+
+
+def identify_bank(file_path):
+    """Return (CsvProfile, csv dialect) of file_path: the profile named by bank_profile, or the one
+    bank_profiles.identify recognises. (None, None) if the bank is not known.
+    """
+    import bank_profiles  # imported here, bank_profiles builds on this module
 
-    qbo_file_lines.append(qbo_file_final_boilerplate)
+    if bank_profile:
+        return bank_profiles.get(bank_profile), bank_profiles.sniff_dialect(file_path)
+    profile, dialect = bank_profiles.identify(file_path)
+    if profile is None:
+        logger.error("%s does not match any bank profile: %s" % (file_path, ", ".join(bank_profiles.names())))
+    else:
+        logger.info("%s recognised as %s" % (file_path, profile.name))
+    return profile, dialect
 
-    return qbo_file_lines
 
 @logger.catch
-def Main():
+def Main(structured=False):
     logger.configure(
         handlers=[{"sink": os.sys.stderr, "level": "DEBUG"}]
     )  # this method automatically suppresses the default handler to modify the message level
@@ -325,6 +674,8 @@ def Main():
     logger.add(
         runtime_name + "_{time}.log", level="DEBUG"
     )  # create a new log file for each run of the program
+    if structured:
+        add_structured_sink(runtime_name)
 
     logger.info("Program Start.")  # log the start of the program
     logger.info(runtime_name)
@@ -337,37 +688,72 @@ def Main():
                 print(name)
         file_path = os.path.join(basedirectory, filename)
 
-        originalfile = read_csv_file(file_path)
-
-        if originalfile == []:
+        if not os.path.exists(file_path):
             logger.info("File not yet found %s. sleeping 10 seconds..." % file_path)
             time.sleep(10)
         else:
-            # we have a file, try to process
-            result = convert_csv_file(originalfile, bad_text)
-            if result == []:
+            # we have a file, recognise the bank from its first lines
+            FILES_SEEN.inc(source="csv")
+            BACKLOG.set(1, source="csv")
+            profile, dialect = identify_bank(file_path)
+            if profile is None:
+                ERRORS.inc(stage="identify")
                 sys.exit(1)
-
-            # Attempt to write results to cleanfile
-            cf = outputdirectory + file_date + "_" + acct_number + output_file_extension
+            # find the first and last posted rows to name the output and fill in the header
+            with stage("scan_csv_bounds", os.path.basename(file_path), file_size(file_path)):
+                first, last = scan_csv_bounds(file_path, profile, dialect)
+            breaks = check_running_balance(file_path, profile, dialect)
+            for balance_break in breaks[:20]:
+                logger.error("Line %d: running balance %.2f, expected %.2f from the previous row and its amount" % (
+                    balance_break.line, balance_break.found / 100, balance_break.expected / 100))
+            if breaks:
+                logger.error("%d running balance breaks: rows are missing or out of order in %s" % (len(breaks), file_path))
+                if not allow_balance_gaps:
+                    ERRORS.inc(stage="balance")
+                    sys.exit(1)
+            # Attempt to stream results to cleanfile
+            cf = outputdirectory + output_name(profile, first, last)
             try:
-                with open(cf, "w") as f:
-                    f.writelines(result)
+                if checkpoint_xacts or has_checkpoint(file_path, outputdirectory):
+                    if write_qbo_file_resumable(file_path, cf, first, last, profile, dialect) is None:
+                        ERRORS.inc(stage="convert")
+                        sys.exit(1)
+                else:
+                    with open(cf, "w") as f:
+                        if write_qbo_file(file_path, f, last, profile, dialect) is None:
+                            ERRORS.inc(stage="convert")
+                            sys.exit(1)
             except Exception as e:
                 logger.error("Error in writing %s" % cf)
                 logger.warning(str(e))
+                ERRORS.inc(stage="write")
                 sys.exit(1)
 
             logger.info("File %s contents written successfully." % cf)
+            if store_path:
+                from qbo_store import store_qbo_lines
+
+                with open(cf) as f:
+                    store_qbo_lines(store_path, f, os.path.basename(cf))
 
             logger.info("Attempting to remove old %s file..." % file_path)
 
             if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except OSError as e:
-                    logger.warning("Error: %s - %s." % (e.file_path, e.strerror))
-                    sys.exit(1)
+                with stage("remove_original", os.path.basename(file_path), file_size(file_path)):
+                    try:
+                        if archive_directory:
+                            archive_original(archive_directory, file_path, cf)
+                    except (OSError, ValueError) as e:
+                        logger.warning("Error archiving %s: %s" % (file_path, e))
+                        ERRORS.inc(stage="archive")
+                        sys.exit(1)
+                    try:
+                        os.remove(file_path)
+                    except OSError as e:
+                        logger.warning("Error: %s - %s." % (e.filename, e.strerror))
+                        ERRORS.inc(stage="remove")
+                        sys.exit(1)
+                BACKLOG.set(0, source="csv")
                 logger.info("Success removing %s" % file_path)
 
             else:
@@ -383,5 +769,5 @@ def Main():
 """
 if __name__ == "__main__":
     # Run the processes as that seems to be the purpose
-    Main()
+    Main(structured="--json-log" in sys.argv)
     
\ No newline at end of file
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+""" payee_index / map slightly different memos of one vendor to one QuickBooks name
+
+preprocess_memo removes noise but the same vendor still arrives under many names:
+"GM FINANCIAL BillPay 05140050876", "GM FINANCIAL BillPay 05140050707",
+"TOUCHTUNES TT PAYMENT 220701 673"... QuickBooks matches transactions on the name, so
+each variant becomes a new payee. A PayeeIndex holds the known payees and resolves a
+name to the canonical one:
+
+    1. the key of a name is its words in upper case without the words holding digits
+       (dates, store numbers, trace ids); an exact key match resolves immediately
+    2. otherwise the trigrams of the key are looked up in an inverted index and the
+       payee with the best Jaccard similarity wins if it reaches the threshold
+
+Only the rarest trigrams of a name are used to find candidates (prefix filtering): a payee
+sharing none of them cannot reach the threshold. Candidates whose trigram count is out of
+range, or that share too few of the rarest trigrams to reach the threshold, are skipped
+before the similarity is computed, so a lookup stays well under a millisecond with tens
+of thousands of payees.
+
+Build an index from the transaction store and use it when fixing files:
+    python qbo.py payees --store qbo.sqlite3 --output payees.json
+    python qbo.py fix --payees payees.json
+"""
+
+import json
+import math
+
+DEFAULT_THRESHOLD = 0.6
+
+
+def payee_key(name):
+    """Upper case words of name without punctuation and without the words holding digits."""
+    words = "".join(c if c.isalnum() else " " for c in name.upper()).split()
+    return " ".join(w for w in words if not any(c.isdigit() for c in w))
+
+
+def display_name(name):
+    """name without the words holding digits, the canonical name of a payee built from history."""
+    return " ".join(w for w in name.split() if not any(c.isdigit() for c in w))
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PayeeIndex:
+    """Known payees and the trigram inverted index over their keys.
+    Only plain lists and dicts are kept so CleaningRules holding an index can be pickled
+    for the worker processes.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.names = []  # canonical name by payee id
+        self.keys = []  # payee_key by payee id
+        self.sizes = []  # number of trigrams by payee id
+        self.exact = {}  # payee_key -> payee id
+        self.postings = {}  # trigram -> payee ids
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        """Add a known payee. Return its id, or None if its key is empty."""
+        key = payee_key(name)
+        if not key:
+            return None
+        if key in self.exact:
+            return self.exact[key]
+        payee_id = len(self.names)
+        grams = trigrams(key)
+        self.names.append(name)
+        self.keys.append(key)
+        self.sizes.append(len(grams))
+        self.exact[key] = payee_id
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(payee_id)
+        return payee_id
+
+    def lookup(self, name):
+        """Return (canonical name, similarity) of the known payee closest to name, None below the threshold."""
+        key = payee_key(name)
+        if not key:
+            return None
+        payee_id = self.exact.get(key)
+        if payee_id is not None:
+            return self.names[payee_id], 1.0
+        query = trigrams(key)
+        size = len(query)
+        # a payee reaching the threshold shares at least ceil(threshold * size) trigrams with the query
+        # so it shares one of the size - ceil(threshold * size) + 1 rarest
+        prefix = size - math.ceil(self.threshold * size) + 1
+        rarest = sorted(query, key=lambda gram: len(self.postings.get(gram, ())))[:prefix]
+        shared = {}  # candidate id -> number of the rarest trigrams it has
+        for gram in rarest:
+            for candidate in self.postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        low, high = self.threshold * size, size / self.threshold
+        rest = size - prefix  # trigrams of the query not looked up, the most a candidate can add to its count
+        best, best_similarity = None, self.threshold
+        for candidate, count in shared.items():
+            candidate_size = self.sizes[candidate]
+            if not low <= candidate_size <= high:
+                continue
+            # Jaccard >= threshold needs overlap >= threshold * (size + candidate_size) / (1 + threshold)
+            if count + rest < self.threshold * (size + candidate_size) / (1 + self.threshold):
+                continue
+            overlap = len(query & trigrams(self.keys[candidate]))
+            similarity = overlap / (size + candidate_size - overlap)
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        if best is None:
+            return None
+        return self.names[best], best_similarity
+
+    def resolve(self, name):
+        """The canonical name of name, name itself when no known payee is close enough."""
+        found = self.lookup(name)
+        return name if found is None else found[0]
+
+    @classmethod
+    def from_history(cls, name_counts, threshold=DEFAULT_THRESHOLD):
+        """Build an index from (name, count) pairs of past transactions.
+        The most frequent variant of a payee, without its digit words, becomes its canonical name.
+        """
+        index = cls(threshold)
+        for name, _ in sorted(name_counts, key=lambda pair: -pair[1]):
+            if name and index.lookup(name) is None:
+                index.add(display_name(name))
+        return index
+
+    def save(self, path):
+        data = {"threshold": self.threshold, "names": self.names, "keys": self.keys,
+                "sizes": self.sizes, "postings": self.postings}
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        index = cls(data["threshold"])
+        index.names, index.keys, index.sizes, index.postings = data["names"], data["keys"], data["sizes"], data["postings"]
+        index.exact = {key: payee_id for payee_id, key in enumerate(index.keys)}
+        return index
+
+
+def build_from_store(store_path, output_path, threshold=DEFAULT_THRESHOLD):
+    """Build a PayeeIndex from the names in the transaction store and save it. Return the index."""
+    from qbo_store import TransactionStore
+
+    with TransactionStore(store_path) as store:
+        name_counts = store.connection.execute(
+            "SELECT name, COUNT(*) FROM transactions WHERE name IS NOT NULL GROUP BY name").fetchall()
+    index = PayeeIndex.from_history(name_counts, threshold)
+    index.save(output_path)
+    return index
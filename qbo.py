@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" qbo / single command line entry point for the QBO tools
+
+usage:
+    python qbo.py fix        modify Quickbooks bank downloads found in the download directory
+    python qbo.py csv2qbo    convert a bank csv download into a QBO file (see bank_profiles.py)
+    python qbo.py watch      keep checking the download directory for QBO files
+    python qbo.py fetch      download statement attachments from Gmail
+    python qbo.py serve      run the conversion daemon (see qbo_server.py)
+    python qbo.py merge      combine overlapping QBO files into one statement per account
+    python qbo.py split      cut a large QBO file into parts QuickBooks can import
+    python qbo.py ingest     add existing QBO files to the transaction store (see qbo_store.py)
+    python qbo.py query      search the transaction store
+    python qbo.py payees     build the known payee index from the transaction store (see payee_index.py)
+    python qbo.py compare    run every generation of the fixer on the same statements (see qbo_differential.py)
+    python qbo.py archive    list, extract or reprocess archived bank downloads (see qbo_archive.py)
+    python qbo.py catalog    list the account, dates and transactions of a folder of statements (see qbo_catalog.py)
+    python qbo.py backfill   convert a tree of historical statements, skipping those already done (see qbo_backfill.py)
+
+These commands are run from scheduled tasks many times a day so startup time matters.
+This module only imports argparse at import time. Every subcommand imports the module
+doing the real work (and with it loguru, dateutil, hashids...) when it runs, so
+`python qbo.py --help` or a typo in the arguments costs almost nothing.
+
+Startup target, measured with:
+    python -X importtime qbo.py --help
+no heavy dependency may appear in the import list and the cumulative import
+time must stay under STARTUP_BUDGET_MS (see test_qbo.py).
+"""
+
+import argparse
+import sys
+
+STARTUP_BUDGET_MS = 100
+HEAVY_MODULES = (
+    "loguru", "pytz", "dateutil", "hashids",
+    "QBOfix2024_2", "csv2qbo", "qbo_server", "qbo_merge", "qbo_split", "qbo_store", "payee_index", "amount_rules",
+    "bank_profiles", "qbo_profile", "qbo_metrics", "qbo_differential", "qbo_checkpoint",
+    "qbo_archive", "qbo_catalog", "qbo_backfill",
+)
+
+
+def _set_qbo_directories(module, args):
+    from pathlib import Path
+
+    if args.download_dir:
+        module.QBO_DOWNLOAD_DIRECTORY = Path(args.download_dir)
+    if args.output_dir:
+        module.QBO_MODIFIED_DIRECTORY = Path(args.output_dir)
+    module.QBO_WORKERS = args.jobs
+    module.QBO_PIPELINE_THREADS = args.pipeline
+    module.QBO_STORE_PATH = args.store
+    module.QBO_CHECKPOINT_XACTS = args.checkpoint
+    module.QBO_ARCHIVE_DIRECTORY = args.archive
+    if args.payees or args.amount_rules:
+        payees = amounts = None
+        if args.payees:
+            from payee_index import PayeeIndex
+
+            payees = PayeeIndex.load(args.payees)
+        if args.amount_rules:
+            from amount_rules import AmountRuleIndex
+
+            amounts = AmountRuleIndex.load(args.amount_rules)
+        module.QBO_RULES = module.CleaningRules(payees=payees, amounts=amounts)
+
+
+def _profiling(args):
+    """Context manager profiling the command when --profile, --pstats or --stacks is given."""
+    if not (args.profile or args.pstats or args.stacks):
+        from contextlib import nullcontext
+
+        return nullcontext()
+    from qbo_profile import profiling
+
+    return profiling(args.pstats, args.stacks)
+
+
+def _metrics(args, always=False):
+    """Context manager publishing the metrics (see qbo_metrics.py) when --metrics-port is given or always is set."""
+    if args.metrics_port is None and not always:
+        from contextlib import nullcontext
+
+        return nullcontext()
+    from qbo_metrics import MetricsPublisher
+
+    return MetricsPublisher(f"qbo_{args.command}", args.metrics_port, args.metrics_interval)
+
+
+def run_fix(args):
+    import QBOfix2024_2
+
+    _set_qbo_directories(QBOfix2024_2, args)
+    with _metrics(args), _profiling(args):
+        QBOfix2024_2.Main(structured=args.json_log)
+    return 0
+
+
+def run_watch(args):
+    import QBOfix2024_2
+
+    _set_qbo_directories(QBOfix2024_2, args)
+    with _metrics(args), _profiling(args):
+        QBOfix2024_2.Watch(interval=args.interval, structured=args.json_log)
+    return 0
+
+
+def run_csv2qbo(args):
+    import os
+    import bank_profiles
+    import csv2qbo
+
+    for path in args.profiles:
+        bank_profiles.register_file(path)
+    csv2qbo.bank_profile = args.bank
+    if args.download_dir:
+        csv2qbo.basedirectory = os.path.join(args.download_dir, "")
+    if args.output_dir:
+        csv2qbo.outputdirectory = os.path.join(args.output_dir, "")
+    csv2qbo.store_path = args.store
+    csv2qbo.checkpoint_xacts = args.checkpoint
+    csv2qbo.archive_directory = args.archive
+    csv2qbo.allow_balance_gaps = args.allow_gaps
+    with _metrics(args), _profiling(args):
+        csv2qbo.Main(structured=args.json_log)  # exits the interpreter when done
+    return 0
+
+
+def run_fetch(args):
+    import os
+    from Gmail_downloader import download_attachments
+
+    password = args.password or os.environ.get("QBO_GMAIL_PASSWORD")
+    if not password:
+        print("A password is required: use --password or set QBO_GMAIL_PASSWORD", file=sys.stderr)
+        return 2
+    with _metrics(args):
+        download_attachments(args.email, password, args.search, args.save_folder)
+    return 0
+
+
+def run_serve(args):
+    from qbo_server import serve
+
+    with _metrics(args, always=True):  # the server also answers GET /metrics itself
+        serve(args.host, args.port, args.socket, structured=args.json_log)
+    return 0
+
+
+def run_merge(args):
+    import QBOfix2024_2
+    from pathlib import Path
+    from qbo_merge import expand_paths, merge_files
+
+    if args.output_dir:
+        QBOfix2024_2.QBO_MODIFIED_DIRECTORY = Path(args.output_dir)
+    QBOfix2024_2.defineLoggers("qbo_merge", args.json_log)
+    paths = expand_paths(args.paths)
+    if not paths:
+        print("No QBO files to merge", file=sys.stderr)
+        return 2
+    return 0 if merge_files(paths, args.window_days) is not None else 1
+
+
+def run_split(args):
+    import QBOfix2024_2
+    from pathlib import Path
+    from qbo_split import split_file
+
+    if not (args.max_xacts or args.max_bytes or args.max_days is not None):
+        print("At least one of --max-xacts, --max-bytes or --max-days is required", file=sys.stderr)
+        return 2
+    if args.output_dir:
+        QBOfix2024_2.QBO_MODIFIED_DIRECTORY = Path(args.output_dir)
+    QBOfix2024_2.defineLoggers("qbo_split", args.json_log)
+    return 0 if split_file(args.path, args.max_xacts, args.max_bytes, args.max_days) is not None else 1
+
+
+def run_ingest(args):
+    from QBOfix2024_2 import defineLoggers
+    from qbo_store import ingest_paths
+
+    defineLoggers("qbo_store", args.json_log)
+    return 0 if ingest_paths(args.store, args.paths) is not None else 1
+
+
+def run_query(args):
+    from qbo_store import TransactionStore
+
+    with TransactionStore(args.store) as store:
+        rows = store.query(args.account, args.payee, args.since, args.until, args.min_amount, args.max_amount, args.limit)
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row[:7]))
+    return 0
+
+
+def run_payees(args):
+    from payee_index import build_from_store
+
+    index = build_from_store(args.store, args.output, args.threshold)
+    print(f"{len(index)} known payees written to {args.output}")
+    return 0
+
+
+def run_compare(args):
+    from QBOfix2024_2 import defineLoggers
+    from qbo_differential import ENGINES, compare_files
+
+    unknown = [name for name in args.engine or [] if name not in ENGINES]
+    if unknown:
+        print(f"Unknown engine {', '.join(unknown)}, choose from {', '.join(ENGINES)}", file=sys.stderr)
+        return 2
+    defineLoggers("qbo_compare", args.json_log)
+    equivalent = compare_files(args.paths, args.xacts, args.seed, args.engine, args.repeat, args.report)
+    return 0 if equivalent else 1
+
+
+def run_archive(args):
+    import os
+    from QBOfix2024_2 import defineLoggers
+    from qbo_archive import OriginalArchive, reprocess
+
+    defineLoggers("qbo_archive", args.json_log)
+    if args.reprocess:
+        return 0 if reprocess(args.directory, args.reprocess, args.account, args.since, args.until) is not None else 1
+    archive = OriginalArchive(args.directory)
+    for entry in archive.entries(args.account, args.since, args.until):
+        if args.extract:
+            os.makedirs(args.extract, exist_ok=True)
+            archive.extract(entry, args.extract)
+        print("\t".join([entry.sha256[:12], entry.kind, entry.account, entry.dtstart[:8], entry.dtend[:8],
+                         str(entry.size), entry.name]))
+    return 0
+
+
+def run_catalog(args):
+    import json
+    from QBOfix2024_2 import defineLoggers
+    from qbo_catalog import catalog, select
+
+    defineLoggers("qbo_catalog", args.json_log)
+    entries = select(catalog(args.directory, args.recursive, args.cache), args.account, args.since, args.until)
+    for entry in entries:
+        if args.json:
+            print(json.dumps(entry._asdict()))
+        else:
+            print("\t".join([entry.kind, entry.account, entry.dtstart[:8], entry.dtend[:8], str(entry.xacts),
+                             "" if entry.complete else "INCOMPLETE", entry.path]))
+    return 0
+
+
+def run_backfill(args):
+    from QBOfix2024_2 import defineLoggers
+    from qbo_backfill import backfill
+
+    defineLoggers("qbo_backfill", args.json_log)
+    summary = backfill(args.source, args.output_dir, args.account, args.since, args.until, args.jobs,
+                       payees_path=args.payees, amounts_path=args.amount_rules, profile_paths=args.profiles,
+                       force=args.force)
+    return 0 if summary is not None and not summary.failed else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="qbo", description="Tools for Quickbooks bank downloads.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # options shared by the converters
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--download-dir", help="directory to look for bank downloads in")
+    common.add_argument("--output-dir", help="directory to write the QBO files to")
+    common.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    common.add_argument("--store", help="also add the written transactions to this SQLite transaction store")
+    common.add_argument("--checkpoint", type=int, default=0, metavar="XACTS",
+                        help="stream large files from disk and record a checkpoint every XACTS transactions so a "
+                             "killed conversion resumes where it stopped (see qbo_checkpoint.py)")
+    common.add_argument("--archive", metavar="DIR",
+                        help="store the bank downloads in this archive before removing them (see qbo archive)")
+    common.add_argument("--profile", action="store_true",
+                        help="log wall time, CPU time, transaction rate and peak memory of each stage (see qbo_profile.py)")
+    common.add_argument("--pstats", metavar="FILE", help="profile and also write cProfile statistics to FILE")
+    common.add_argument("--stacks", metavar="FILE", help="profile and also write sampled collapsed stacks to FILE")
+
+    # options of the commands that can run unattended
+    metrics = argparse.ArgumentParser(add_help=False)
+    metrics.add_argument("--metrics-port", type=int, metavar="PORT",
+                         help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics (see qbo_metrics.py)")
+    metrics.add_argument("--metrics-interval", type=float, default=60, metavar="SECONDS",
+                         help="seconds between metrics snapshots written to LOGS while metrics are served")
+
+    # options of the QBO fixer
+    fixer = argparse.ArgumentParser(add_help=False)
+    fixer.add_argument("--jobs", type=int, default=1, help="worker processes rewriting the transactions of large files")
+    fixer.add_argument("--pipeline", type=int, default=0, metavar="THREADS",
+                       help="overlap reading, rewriting and writing of many files using THREADS transform threads")
+    fixer.add_argument("--payees", help="payee index file mapping names to known payees (see qbo payees)")
+    fixer.add_argument("--amount-rules", help="JSON file of rules naming transactions by type and amount (see amount_rules.py)")
+
+    fix = subparsers.add_parser("fix", parents=[common, fixer, metrics], help="modify QBO files in the download directory")
+    fix.set_defaults(func=run_fix)
+
+    convert = subparsers.add_parser("csv2qbo", parents=[common, metrics], help="convert a bank csv download")
+    convert.add_argument("--allow-gaps", action="store_true",
+                         help="convert even when the running balance shows missing or reordered rows")
+    convert.add_argument("--profiles", action="append", default=[], metavar="FILE",
+                         help="JSON file of bank csv layouts (see bank_profiles.py), may be repeated")
+    convert.add_argument("--bank", help="bank profile to convert with instead of recognising it from the file")
+    convert.set_defaults(func=run_csv2qbo)
+
+    watch = subparsers.add_parser("watch", parents=[common, fixer, metrics], help="keep modifying QBO files as they arrive")
+    watch.add_argument("--interval", type=float, default=10, help="seconds between directory checks")
+    watch.set_defaults(func=run_watch)
+
+    fetch = subparsers.add_parser("fetch", parents=[metrics], help="download statement attachments from Gmail")
+    fetch.add_argument("--email", required=True, help="Gmail address")
+    fetch.add_argument("--password", help="app password (default: QBO_GMAIL_PASSWORD environment variable)")
+    fetch.add_argument("--search", default="(UNSEEN)", help="IMAP search criteria")
+    fetch.add_argument("--save-folder", default=".", help="folder to save attachments in")
+    fetch.set_defaults(func=run_fetch)
+
+    server = subparsers.add_parser("serve", parents=[metrics], help="run the long running conversion daemon")
+    server.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    server.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    server.add_argument("--socket", help="listen on this unix socket path instead of TCP")
+    server.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    server.set_defaults(func=run_serve)
+
+    merge = subparsers.add_parser("merge", help="combine overlapping QBO files into one statement per account")
+    merge.add_argument("paths", nargs="+", metavar="PATH", help="QBO files, or directories of QBO files, to merge")
+    merge.add_argument("--output-dir", help="directory to write the merged QBO files to")
+    merge.add_argument("--window-days", type=int, default=3,
+                       help="days a FITID is remembered for duplicate detection (the overlap window)")
+    merge.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    merge.set_defaults(func=run_merge)
+
+    split = subparsers.add_parser("split", help="cut a large QBO file into parts QuickBooks can import")
+    split.add_argument("path", help="QBO file to split")
+    split.add_argument("--max-xacts", type=int, help="transactions per part")
+    split.add_argument("--max-bytes", type=int, help="size of the transactions of a part")
+    split.add_argument("--max-days", type=int, help="days between the first and last transaction of a part")
+    split.add_argument("--output-dir", help="directory to write the parts to")
+    split.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    split.set_defaults(func=run_split)
+
+    store = argparse.ArgumentParser(add_help=False)
+    store.add_argument("--store", default="qbo_transactions.sqlite3", help="SQLite transaction store")
+
+    ingest = subparsers.add_parser("ingest", parents=[store], help="add existing QBO files to the transaction store")
+    ingest.add_argument("paths", nargs="+", metavar="PATH", help="QBO files, or directories searched for QBO files")
+    ingest.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    ingest.set_defaults(func=run_ingest)
+
+    query = subparsers.add_parser("query", parents=[store], help="search the transaction store")
+    query.add_argument("--account", help="ACCTID of the account")
+    query.add_argument("--payee", help="start of the transaction name")
+    query.add_argument("--since", help="first DTPOSTED date, YYYYMMDD")
+    query.add_argument("--until", help="last DTPOSTED date, YYYYMMDD")
+    query.add_argument("--min-amount", help="smallest amount")
+    query.add_argument("--max-amount", help="largest amount")
+    query.add_argument("--limit", type=int, help="return at most this many transactions")
+    query.set_defaults(func=run_query)
+
+    payees = subparsers.add_parser("payees", parents=[store], help="build the known payee index from the transaction store")
+    payees.add_argument("--output", default="payees.json", help="payee index file to write")
+    payees.add_argument("--threshold", type=float, default=0.6,
+                        help="trigram similarity a name needs to be mapped to a known payee")
+    payees.set_defaults(func=run_payees)
+
+    compare = subparsers.add_parser("compare", help="compare the output and speed of every generation of the fixer")
+    compare.add_argument("paths", nargs="*", metavar="PATH", help="QBO files to compare on (default: a generated statement)")
+    compare.add_argument("--xacts", type=int, default=2000, help="transactions of the generated statement")
+    compare.add_argument("--seed", type=int, default=0, help="seed of the generated statement")
+    compare.add_argument("--engine", action="append", metavar="NAME",
+                         help="engine to compare with the reference, may be repeated (default: all)")
+    compare.add_argument("--repeat", type=int, default=3, help="timed runs of each engine, the best one is reported")
+    compare.add_argument("--report", metavar="FILE", help="also write the differences and the timings to this JSON file")
+    compare.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    compare.set_defaults(func=run_compare)
+
+    archive = subparsers.add_parser("archive", help="list, extract or reprocess archived bank downloads")
+    archive.add_argument("directory", help="archive directory given to --archive")
+    archive.add_argument("--account", help="ACCTID of the account")
+    archive.add_argument("--since", help="only statements ending on or after this date, YYYYMMDD")
+    archive.add_argument("--until", help="only statements starting on or before this date, YYYYMMDD")
+    action = archive.add_mutually_exclusive_group()
+    action.add_argument("--extract", metavar="DIR", help="also write the originals to this directory")
+    action.add_argument("--reprocess", metavar="DIR",
+                        help="convert the originals again with the current rules into this directory")
+    archive.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    archive.set_defaults(func=run_archive)
+
+    catalog = subparsers.add_parser("catalog", help="list the account, dates and transactions of a folder of statements")
+    catalog.add_argument("directory", help="directory of QBO and csv files")
+    catalog.add_argument("--recursive", action="store_true", help="also list the files in its subdirectories")
+    catalog.add_argument("--cache", metavar="FILE", help="catalog cache file (default: .qbo_catalog.json in the directory)")
+    catalog.add_argument("--account", help="ACCTID of the account")
+    catalog.add_argument("--since", help="only statements ending on or after this date, YYYYMMDD")
+    catalog.add_argument("--until", help="only statements starting on or before this date, YYYYMMDD")
+    catalog.add_argument("--json", action="store_true", help="print one JSON object per file")
+    catalog.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    catalog.set_defaults(func=run_catalog)
+
+    backfill = subparsers.add_parser("backfill", help="convert a tree of historical statements, skipping those already done")
+    backfill.add_argument("source", help="directory searched recursively for QBO and csv files")
+    backfill.add_argument("--output-dir", required=True, help="directory to write the QBO files and the manifest to")
+    backfill.add_argument("--account", help="ACCTID of the account")
+    backfill.add_argument("--since", help="only statements ending on or after this date, YYYYMMDD")
+    backfill.add_argument("--until", help="only statements starting on or before this date, YYYYMMDD")
+    backfill.add_argument("--jobs", type=int, help="worker processes (default: one per CPU)")
+    backfill.add_argument("--force", action="store_true", help="convert every file again, even those done already")
+    backfill.add_argument("--payees", help="payee index file mapping names to known payees (see qbo payees)")
+    backfill.add_argument("--amount-rules", help="JSON file of rules naming transactions by type and amount (see amount_rules.py)")
+    backfill.add_argument("--profiles", action="append", default=[], metavar="FILE",
+                          help="JSON file of bank csv layouts (see bank_profiles.py), may be repeated")
+    backfill.add_argument("--json-log", action="store_true", help="also write JSON lines stage events to LOGS")
+    backfill.set_defaults(func=run_backfill)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+"""Check if this file is being run directly and activate main function if so.
+"""
+if __name__ == "__main__":
+    sys.exit(main())
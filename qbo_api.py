@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_api / in-memory conversion API for embedding the converters in other programs
+
+The scripts read from the download directory, write to the output directory,
+delete the original and exit the interpreter when something goes wrong. These
+functions do none of that: they read one file-like object, write another and
+raise ConversionError on failure. No state is kept between calls so any number
+of conversions may run on different threads at the same time.
+
+Streams may be text (open(..., "r"), io.StringIO) or binary (open(..., "rb"),
+io.BytesIO). Binary streams are decoded and encoded with the encoding argument,
+cp1252 by default as declared by the CHARSET:1252 header of QBO files. Bytes
+that cp1252 does not define are passed through unchanged.
+
+    with open("download.qbo", "rb") as src, open("fixed.qbo", "wb") as dst:
+        result = fix_qbo(src, dst)
+    print(result.file_name, result.xacts)
+"""
+
+import csv
+import io
+from collections import namedtuple
+
+import csv2qbo
+from QBOfix2024_2 import DEFAULT_RULES, QBO_FILE_EXT, process_qbo_lines
+from qbo_util import chunked
+
+DEFAULT_ENCODING = "cp1252"
+ERRORS = "surrogateescape"  # round trips bytes the encoding does not define
+
+ConversionResult = namedtuple("ConversionResult", "file_date account_number xacts")
+ConversionResult.file_name = property(lambda self: f"{self.file_date}_{self.account_number}{QBO_FILE_EXT}")
+
+
+class ConversionError(Exception):
+    """The input could not be converted."""
+
+
+def _is_text(stream):
+    return isinstance(stream, io.TextIOBase)
+
+
+def _text_in(stream, encoding, newline):
+    """Return (text stream, wrapper to detach afterwards or None)."""
+    if _is_text(stream):
+        return stream, None
+    wrapper = io.TextIOWrapper(stream, encoding=encoding, errors=ERRORS, newline=newline)
+    return wrapper, wrapper
+
+
+def _text_out(stream, encoding):
+    if _is_text(stream):
+        return stream, None
+    wrapper = io.TextIOWrapper(stream, encoding=encoding, errors=ERRORS, newline="", write_through=True)
+    return wrapper, wrapper
+
+
+def _release(wrapper):
+    """Detach a TextIOWrapper so closing it later does not close the caller's stream."""
+    if wrapper is not None:
+        wrapper.flush()
+        wrapper.detach()
+
+
+def fix_qbo(stream_in, stream_out, rules=DEFAULT_RULES, encoding=DEFAULT_ENCODING):
+    """Rewrite the QBO file read from stream_in into stream_out using the CleaningRules rules.
+    Return a ConversionResult.
+    """
+    text_in, in_wrapper = _text_in(stream_in, encoding, newline=None)  # same newlines as read_base_file
+    try:
+        result = process_qbo_lines(text_in, rules)
+    finally:
+        _release(in_wrapper)
+    if result is None:
+        raise ConversionError("QBO data could not be processed, see the log for details")
+    modified_lines, file_date, account_number = result
+    text_out, out_wrapper = _text_out(stream_out, encoding)
+    try:
+        text_out.writelines(chunked(modified_lines))
+    finally:
+        _release(out_wrapper)
+    return ConversionResult(file_date, account_number, modified_lines.count("<STMTTRN>\n"))
+
+
+def _least_recent_row(stream, encoding):
+    """Find the last csv row from the end of a seekable stream. Return None if that is not possible."""
+    raw = stream if not _is_text(stream) else getattr(stream, "buffer", None)
+    if raw is None or not raw.seekable():
+        return None
+    if _is_text(stream):
+        stream.seek(stream.tell())  # drop read ahead so the buffer position matches the text position
+        encoding = stream.encoding
+    return csv2qbo.last_csv_row(raw, encoding)
+
+
+def convert_csv(stream_in, stream_out, profile=csv2qbo.SCHWAB_CHECKING, encoding=DEFAULT_ENCODING):
+    """Convert the bank csv download read from stream_in into a QBO file written to stream_out.
+    profile is a csv2qbo.CsvProfile describing the bank account. Return a ConversionResult.
+    Seekable streams are converted in bounded memory; the last row, which gives DTSTART,
+    is read from the end of the stream first. Other streams are read into memory.
+    """
+    least_recent = _least_recent_row(stream_in, encoding)
+    text_in, in_wrapper = _text_in(stream_in, encoding, newline="")
+    text_out, out_wrapper = _text_out(stream_out, encoding)
+    summary = {}
+    try:
+        rows = csv.reader(text_in, delimiter=",")
+        if least_recent is None:
+            rows = list(rows)
+            least_recent = next((row for row in reversed(rows) if row), None)
+        text_out.writelines(chunked(csv2qbo.iter_qbo_statement(rows, least_recent, profile, summary)))
+    except Exception as e:
+        raise ConversionError(f"csv data could not be converted: {e}") from e
+    finally:
+        _release(in_wrapper)
+        _release(out_wrapper)
+    return ConversionResult(summary["file_date"], profile.account_number, summary["xacts"])
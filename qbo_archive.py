@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_archive / keep the original bank downloads, compressed and deduplicated
+
+The converters delete a download once it is converted, which leaves nothing to convert
+again when the BAD_TEXT rules change. With an archive configured the original is stored
+before it is removed:
+
+    python qbo.py fix --archive D:/Users/Conrad/Archive
+    python qbo.py csv2qbo --archive D:/Users/Conrad/Archive
+    python qbo.py archive D:/Users/Conrad/Archive --account 4552001301 --since 20220101
+    python qbo.py archive D:/Users/Conrad/Archive --since 20220101 --reprocess D:/Users/Conrad/Reprocessed
+
+Originals are content addressed: the file is hashed and compressed in one pass and stored
+as objects/<first two hex digits>/<sha256>.gz (.zst when the zstandard package
+is installed), so the same download archived twice is stored once. index.jsonl, one JSON
+line per archived file, records the hash, the source name, kind (qbo or csv), ACCTID,
+DTSTART, DTEND, original and stored sizes and when it was archived. The account and dates
+come from the head of the QBO file, for a csv download from the QBO file it was converted to.
+Index lines are appended with a single write so several converters can share an archive.
+
+Reprocessing decompresses QBO originals straight into the fixer, without extracting them;
+csv originals are extracted to a temporary directory because the csv converter reads its
+input more than once.
+"""
+
+import datetime as dt
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from pathlib import Path
+from loguru import logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_NAME = "index.jsonl"
+OBJECTS_DIRECTORY = "objects"
+BLOCK_SIZE = 1 << 20
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+CODEC_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+DEFAULT_CODEC = "zstd" if zstandard is not None else "gzip"
+
+ArchiveEntry = namedtuple("ArchiveEntry", "sha256 name kind account dtstart dtend size stored codec archived")
+
+
+def qbo_header_summary(lines):
+    """(ACCTID, DTSTART, DTEND) of a QBO statement, read from the lines before its first transaction."""
+    account = dtstart = dtend = ""
+    for line in lines:
+        line_stripped = line.strip()
+        if line_stripped.startswith("<STMTTRN>"):
+            break
+        if line_stripped.startswith("<ACCTID>") and not account:
+            account = line_stripped[len("<ACCTID>"):].strip()
+        elif line_stripped.startswith("<DTSTART>") and not dtstart:
+            dtstart = line_stripped[len("<DTSTART>"):].strip()
+        elif line_stripped.startswith("<DTEND>") and not dtend:
+            dtend = line_stripped[len("<DTEND>"):].strip()
+    return account, dtstart, dtend
+
+
+def _kind(path):
+    return "csv" if Path(path).suffix.lower() == ".csv" else "qbo"
+
+
+def _compressor(f, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("the zstd codec needs the zstandard package")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(f, closefd=False)
+    return gzip.GzipFile(fileobj=f, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class OriginalArchive:
+    """A directory of compressed originals and the index describing them."""
+
+    def __init__(self, directory, codec=None):
+        self.directory = Path(directory)
+        self.codec = codec or DEFAULT_CODEC
+        if self.codec not in CODEC_SUFFIXES:
+            raise ValueError(f"unknown codec {self.codec}, use one of {', '.join(CODEC_SUFFIXES)}")
+        self.index_path = self.directory / INDEX_NAME
+        self._lock = threading.Lock()
+
+    def object_path(self, sha256, codec):
+        return self.directory / OBJECTS_DIRECTORY / sha256[:2] / f"{sha256}{CODEC_SUFFIXES[codec]}"
+
+    def _store(self, path):
+        """Hash and compress path into a temporary object. Return (sha256, size, temporary path)."""
+        objects = self.directory / OBJECTS_DIRECTORY
+        objects.mkdir(parents=True, exist_ok=True)
+        digest, size = hashlib.sha256(), 0
+        fd, temporary_path = tempfile.mkstemp(dir=objects, suffix=".tmp")
+        try:
+            with open(path, "rb") as source, os.fdopen(fd, "wb") as f:
+                with _compressor(f, self.codec) as compressed:
+                    for block in iter(lambda: source.read(BLOCK_SIZE), b""):
+                        digest.update(block)
+                        compressed.write(block)
+                        size += len(block)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        return digest.hexdigest(), size, temporary_path
+
+    def add(self, path, metadata_path=None):
+        """Archive the file path and return its ArchiveEntry. The account and dates are read from
+        the QBO file metadata_path, path itself by default. A file already archived under the same
+        name is not stored or indexed again.
+        """
+        metadata_path = metadata_path or path
+        account = dtstart = dtend = ""
+        if _kind(metadata_path) == "qbo":
+            with open(metadata_path) as f:
+                account, dtstart, dtend = qbo_header_summary(f)
+        sha256, size, temporary_path = self._store(path)
+        name = Path(path).name
+        existing = next((entry for entry in self.entries() if entry.sha256 == sha256), None)
+        if existing is not None:
+            os.remove(temporary_path)
+            if existing.name == name:
+                logger.info(f"{name} is already archived as {sha256}")
+                return existing
+            codec, stored = existing.codec, existing.stored
+        else:
+            codec, stored = self.codec, os.path.getsize(temporary_path)
+            object_path = self.object_path(sha256, codec)
+            object_path.parent.mkdir(exist_ok=True)
+            os.replace(temporary_path, object_path)
+        entry = ArchiveEntry(sha256, name, _kind(path), account, dtstart, dtend, size, stored, codec,
+                             dt.datetime.now().isoformat(timespec="seconds"))
+        with self._lock, open(self.index_path, "a") as f:
+            f.write(json.dumps(entry._asdict()) + "\n")
+        logger.info(f"Archived {name} ({size} bytes, {stored} stored) as {sha256}")
+        return entry
+
+    def entries(self, account=None, since=None, until=None, kind=None):
+        """The ArchiveEntry of every archived file, oldest first. Filter on the account, on
+        statements overlapping the YYYYMMDD dates since..until and on the kind, qbo or csv.
+        """
+        if not self.index_path.exists():
+            return []
+        entries = []
+        with open(self.index_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = ArchiveEntry(**json.loads(line))
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Skipping an unreadable line of {self.index_path}: {e}")
+                    continue
+                if account and entry.account != account:
+                    continue
+                if kind and entry.kind != kind:
+                    continue
+                if since and entry.dtend and entry.dtend[:8] < since:
+                    continue
+                if until and entry.dtstart and entry.dtstart[:8] > until:
+                    continue
+                entries.append(entry)
+        return entries
+
+    def open_binary(self, entry):
+        path = self.object_path(entry.sha256, entry.codec)
+        if entry.codec == "zstd":
+            if zstandard is None:
+                raise ValueError(f"{entry.name} is zstd compressed, reading it needs the zstandard package")
+            return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return gzip.open(path, "rb")
+
+    def open(self, entry, encoding=None):
+        """The original of entry as a text stream decoded like open() in text mode does."""
+        return io.TextIOWrapper(io.BufferedReader(self.open_binary(entry)), encoding=encoding)
+
+    def extract(self, entry, directory):
+        """Write the original of entry into directory under its source name. Return its Path."""
+        path = Path(directory, entry.name)
+        with self.open_binary(entry) as source, open(path, "wb") as f:
+            shutil.copyfileobj(source, f, BLOCK_SIZE)
+        return path
+
+
+def archive_original(archive_directory, path, metadata_path=None):
+    """Archive path in the archive at archive_directory, see OriginalArchive.add."""
+    return OriginalArchive(archive_directory).add(path, metadata_path)
+
+
+def _reprocess_qbo(archive, entry, output_directory):
+    from QBOfix2024_2 import QBO_FILE_EXT, QBO_RULES, process_qbo_lines, write_qbo_file
+
+    with archive.open(entry) as f:
+        modified_qbo, file_date, acct_number = process_qbo_lines(f, QBO_RULES)
+    clean_output_file = Path(output_directory, "".join([file_date, "_", acct_number, QBO_FILE_EXT]))
+    write_qbo_file(clean_output_file, modified_qbo)
+    return clean_output_file
+
+
+def _reprocess_csv(archive, entry, output_directory):
+    import csv2qbo
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(archive.extract(entry, directory))
+        profile, dialect = csv2qbo.identify_bank(path)
+        if profile is None:
+            return None
+        first, last = csv2qbo.scan_csv_bounds(path, profile, dialect)
+        clean_output_file = Path(output_directory, csv2qbo.output_name(profile, first, last))
+        with open(clean_output_file, "w") as f:
+            if csv2qbo.write_qbo_file(path, f, last, profile, dialect) is None:
+                return None
+    return clean_output_file
+
+
+def reprocess(archive_directory, output_directory, account=None, since=None, until=None):
+    """Convert the matching originals again with the current rules into output_directory.
+    Return the list of files written, None if any original could not be converted.
+    """
+    archive = OriginalArchive(archive_directory)
+    os.makedirs(output_directory, exist_ok=True)
+    written, failed = [], False
+    for entry in archive.entries(account, since, until):
+        convert = _reprocess_csv if entry.kind == "csv" else _reprocess_qbo
+        try:
+            output = convert(archive, entry, output_directory)
+        except (OSError, ValueError, EOFError) as e:
+            logger.error(f"Could not reprocess {entry.name} ({entry.sha256}): {e}")
+            output = None
+        if output is None:
+            failed = True
+            continue
+        logger.info(f"Reprocessed {entry.name} into {output}")
+        written.append(output)
+    return None if failed else written
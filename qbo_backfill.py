@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_backfill / convert years of historical statements, skipping the work already done
+
+    python qbo.py backfill D:/Users/Conrad/Statements --output-dir D:/Users/Conrad/Backfill
+    python qbo.py backfill D:/Users/Conrad/Statements --output-dir D:/Users/Conrad/Backfill \
+        --account 4552001301 --since 20180101 --until 20181231 --jobs 8
+
+The fixer and csv2qbo only look at one flat download directory. backfill walks a whole
+tree of QBO and csv files, picks the ones of the account and dates asked for from the
+qbo_catalog (head and tail sniffing, no parsing) and converts them with a pool of worker
+processes into the same relative directories under the output directory.
+
+Each converted input is recorded in MANIFEST_NAME in the output directory: path, size,
+mtime, sha256, the version of the rules it was converted with, the BAD_TEXT entries that
+changed one of its memos and the files written. A re-run skips inputs recorded with the same
+size and hash (the hash is only computed again when the mtime changed) and the current rule
+version, so a killed backfill carries on where it stopped.
+
+The rule version is a hash of the BAD_TEXT list, the payee index and amount rules files and
+CONVERTER_VERSION; csv files use their bank profile's bad_text instead. After a rule change an
+input recorded with older rules is converted again only when the change can alter its output:
+
+    - a BAD_TEXT entry removed that changed one of its memos
+    - a BAD_TEXT entry added whose text (or pattern) appears in the file
+    - the remaining entries reordered, the payee index or amount rules changed
+
+An added entry is looked for in the raw file, so text that only appears once other entries
+are removed is not noticed; --force converts everything again.
+
+Workers write each output into a temporary directory of their own and the parent process
+moves it into place as <DTEND>_<ACCTID>.qbo. An output is never written over the output of another input
+(a re-download, overlapping statements in one folder): the second input's output gets the
+input name appended, <DTEND>_<ACCTID>_<input name>.qbo, and keeps it on later runs. Outputs
+are never removed, outputs whose name changed are left behind.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from loguru import logger
+
+import QBOfix2024_2
+from QBOfix2024_2 import BAD_TEXT, CleaningRules, QBO_FILE_EXT, compile_bad_text, process_qbo_lines
+from qbo_catalog import CATALOG_NAME, catalog, select
+from structured_log import stage
+
+MANIFEST_NAME = "backfill_manifest.jsonl"
+CONVERTER_VERSION = 1  # raise when a change to the converters alters their output, everything is converted again
+BLOCK_SIZE = 1 << 20
+
+ManifestEntry = namedtuple("ManifestEntry", "path kind size mtime_ns sha256 rule_version matched outputs")
+RuleSet = namedtuple("RuleSet", "bad_text payees amounts converter")
+BackfillSummary = namedtuple("BackfillSummary", "selected skipped converted failed")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_fingerprint(path):
+    return file_sha256(path) if path else None
+
+
+def rule_version(rules):
+    """Short hash identifying a RuleSet."""
+    return hashlib.sha256(json.dumps(rules._asdict(), sort_keys=True).encode()).hexdigest()[:16]
+
+
+class Manifest:
+    """Append only JSON lines record of the converted inputs and of the rule sets they were converted with.
+    The last line recorded for a path wins; compact() rewrites the file with one line each.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}  # path -> ManifestEntry
+        self.rules = {}  # rule version -> RuleSet
+        if self.path.exists():
+            self._load()
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                    if "rules" in data:
+                        self.rules[data["rule_version"]] = RuleSet(**data["rules"])
+                    else:
+                        entry = ManifestEntry(**data)
+                        self.entries[entry.path] = entry
+                except (ValueError, TypeError) as e:  # a line cut short by a killed run
+                    logger.warning(f"Skipping an unreadable line of {self.path}: {e}")
+
+    def _append(self, data):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(data) + "\n")
+
+    def add_rules(self, version, rules):
+        if version not in self.rules:
+            self.rules[version] = rules
+            self._append({"rule_version": version, "rules": rules._asdict()})
+
+    def record(self, entry):
+        self.entries[entry.path] = entry
+        self._append(entry._asdict())
+
+    def compact(self):
+        temporary_path = f"{self.path}.tmp"
+        used = {entry.rule_version for entry in self.entries.values()}
+        with open(temporary_path, "w") as f:
+            for version, rules in self.rules.items():
+                if version in used:
+                    f.write(json.dumps({"rule_version": version, "rules": rules._asdict()}) + "\n")
+            for entry in self.entries.values():
+                f.write(json.dumps(entry._asdict()) + "\n")
+        os.replace(temporary_path, self.path)
+
+
+def _appears(item, text):
+    """True when the BAD_TEXT entry item can match text."""
+    pattern, literal = compile_bad_text([item])[0]
+    return pattern.search(text) is not None if pattern is not None else literal in text
+
+
+def rules_affect(entry, old, new):
+    """True when converting the input of entry with the RuleSet new can give another output
+    than with old, see the module docstring.
+    """
+    if old is None or (old.payees, old.amounts, old.converter) != (new.payees, new.amounts, new.converter):
+        return True
+    kept_old = [item for item in old.bad_text if item in new.bad_text]
+    kept_new = [item for item in new.bad_text if item in old.bad_text]
+    if kept_old != kept_new:
+        return True
+    if any(item not in new.bad_text for item in entry.matched):
+        return True
+    added = [item for item in new.bad_text if item not in old.bad_text]
+    if added:
+        with open(entry.path, errors="replace") as f:
+            text = f.read()
+        return any(_appears(item, text) for item in added)
+    return False
+
+
+def matched_bad_text(memos, rules):
+    """The BAD_TEXT entries of rules that change at least one of memos, as preprocess_memo applies them."""
+    matched = set()
+    for memo in set(memos):
+        for i, (pattern, text) in enumerate(rules.bad_text):
+            cleaned = pattern.sub("", memo) if pattern is not None else memo.replace(text, "")
+            if cleaned != memo:
+                matched.add(i)
+                memo = cleaned
+    return matched
+
+
+_worker_rules = None
+
+
+def _init_worker(bad_text, payees_path, amounts_path, profile_paths):
+    global _worker_rules
+    QBOfix2024_2._quiet_worker()
+    payees = amounts = None
+    if payees_path:
+        from payee_index import PayeeIndex
+
+        payees = PayeeIndex.load(payees_path)
+    if amounts_path:
+        from amount_rules import AmountRuleIndex
+
+        amounts = AmountRuleIndex.load(amounts_path)
+    if profile_paths:
+        import bank_profiles
+
+        for path in profile_paths:
+            bank_profiles.register_file(path)
+    _worker_rules = (bad_text, CleaningRules(bad_text, payees, amounts))
+
+
+def _temporary_output(output_directory, name):
+    """Path of a new file called name in a temporary directory of output_directory unique to
+    this conversion, so the validation report is named after the real output.
+    """
+    return Path(tempfile.mkdtemp(dir=output_directory, suffix=".tmp"), name)
+
+
+def _discard(temporary_path):
+    if temporary_path.exists():
+        temporary_path.unlink()
+    temporary_path.parent.rmdir()
+
+
+def _convert_qbo(path, output_directory):
+    bad_text, rules = _worker_rules
+    with open(path) as f:
+        lines = f.readlines()
+    modified_qbo, file_date, acct_number = process_qbo_lines(lines, rules)
+    temporary_path = _temporary_output(output_directory, "".join([file_date, "_", acct_number, QBO_FILE_EXT]))
+    try:
+        QBOfix2024_2.write_validated(temporary_path, modified_qbo)
+    except BaseException:
+        _discard(temporary_path)
+        raise
+    memos = [line.split(">", 1)[1].strip() for line in lines if line.split(">", 1)[0] == "<MEMO"]
+    return temporary_path, sorted(bad_text[i] for i in matched_bad_text(memos, rules))
+
+
+def _convert_csv(path, output_directory):
+    import bank_profiles
+    import csv2qbo
+
+    profile, dialect = bank_profiles.identify(path)
+    if profile is None:
+        raise ValueError(f"{path} does not match any bank profile")
+    first, last = csv2qbo.scan_csv_bounds(path, profile, dialect)
+    temporary_path = _temporary_output(output_directory, csv2qbo.output_name(profile, first, last))
+    try:
+        with open(temporary_path, "w") as f:
+            if csv2qbo.write_qbo_file(path, f, last, profile, dialect) is None:
+                raise ValueError(f"{path} could not be converted")
+    except BaseException:
+        _discard(temporary_path)
+        raise
+    return temporary_path, []
+
+
+def convert_one(path, kind, output_directory):
+    """Convert the input path in a worker process into a temporary directory of output_directory.
+    Return (sha256 of the input, path of the output in the temporary directory, matched BAD_TEXT
+    entries, error or None); the parent process moves the output into place.
+    """
+    try:
+        os.makedirs(output_directory, exist_ok=True)
+        sha256 = file_sha256(path)
+        temporary_path, matched = (_convert_csv if kind == "csv" else _convert_qbo)(path, output_directory)
+    except Exception as e:
+        return None, None, [], f"{type(e).__name__}: {e}"
+    return sha256, temporary_path, matched, None
+
+
+def output_owners(manifest):
+    """output path -> path of the input the manifest records it was converted from."""
+    return {output: entry.path for entry in manifest.entries.values() for output in entry.outputs}
+
+
+def claim_output(path, output, owners):
+    """The output path the input path writes instead of output: output itself unless another
+    input owns it, then output with the input's name appended. Record the claim in owners.
+    """
+    output, stem = Path(output), Path(path).name.replace(".", "_")
+    candidates = [output, output.with_name(f"{output.stem}_{stem}{output.suffix}")]
+    candidates += [output.with_name(f"{output.stem}_{stem}_{i}{output.suffix}") for i in range(2, 100)]
+    for candidate in candidates:
+        owner = owners.get(str(candidate))
+        if owner is None or owner == path:
+            if candidate != output:
+                logger.warning(f"{owners[str(output)]} is already converted into {output}, {path} is written to {candidate}")
+            owners[str(candidate)] = path
+            return candidate
+    raise ValueError(f"too many inputs convert into {output}")
+
+
+def _csv_rules(bank, converter_version=CONVERTER_VERSION):
+    import bank_profiles
+
+    return RuleSet(list(bank_profiles.get(bank).bad_text), None, None, converter_version)
+
+
+def plan(entries, manifest, qbo_rules, force=False):
+    """Yield (catalog entry, rule version, RuleSet) of the inputs to convert; record the
+    inputs that only need their manifest entry brought up to date.
+    """
+    for entry in entries:
+        rules = _csv_rules(entry.bank) if entry.kind == "csv" else qbo_rules
+        version = rule_version(rules)
+        done = manifest.entries.get(entry.path)
+        if force or done is None or done.size != entry.size:
+            yield entry, version, rules
+            continue
+        sha256 = done.sha256 if done.mtime_ns == entry.mtime_ns else file_sha256(entry.path)
+        if sha256 != done.sha256:
+            yield entry, version, rules
+            continue
+        if done.rule_version != version and rules_affect(done, manifest.rules.get(done.rule_version), rules):
+            yield entry, version, rules
+            continue
+        if (done.mtime_ns, done.rule_version) != (entry.mtime_ns, version):
+            manifest.add_rules(version, rules)
+            manifest.record(done._replace(mtime_ns=entry.mtime_ns, rule_version=version))
+        logger.debug(f"Skipping {entry.path}, converted already")
+
+
+@logger.catch
+def backfill(source_directory, output_directory, account=None, since=None, until=None, workers=None,
+             bad_text=BAD_TEXT, payees_path=None, amounts_path=None, profile_paths=(), force=False):
+    """Convert the QBO and csv files under source_directory of account and dates since..until
+    (YYYYMMDD) into output_directory, see the module docstring. Return a BackfillSummary.
+    """
+    source_directory, output_directory = Path(source_directory), Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    if profile_paths:
+        import bank_profiles
+
+        for path in profile_paths:
+            bank_profiles.register_file(path)
+    manifest = Manifest(output_directory / MANIFEST_NAME)
+    qbo_rules = RuleSet(list(bad_text), _file_fingerprint(payees_path), _file_fingerprint(amounts_path), CONVERTER_VERSION)
+    with stage("backfill", str(source_directory), 0, 0) as fields:
+        entries = catalog(source_directory, recursive=True, cache_path=output_directory / CATALOG_NAME)
+        entries = [entry for entry in select(entries, account, since, until) if entry.kind == "qbo" or entry.bank]
+        work = list(plan(entries, manifest, qbo_rules, force))
+        owners = output_owners(manifest)
+        logger.info(f"{len(entries)} statements selected, {len(work)} to convert, {len(entries) - len(work)} done already")
+        converted = failed = 0
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(list(bad_text), payees_path, amounts_path, list(profile_paths))) as pool:
+            futures = []
+            for entry, version, rules in work:
+                relative = Path(entry.path).parent.relative_to(source_directory)
+                futures.append((pool.submit(convert_one, entry.path, entry.kind, str(output_directory / relative)),
+                                entry, version, rules))
+            for future, entry, version, rules in futures:  # in path order, so clashing names are given out the same way each run
+                sha256, temporary_path, matched, error = future.result()
+                if error is None:
+                    try:
+                        output = claim_output(entry.path, temporary_path.parent.parent / temporary_path.name, owners)
+                        os.replace(temporary_path, output)
+                    except (OSError, ValueError) as e:
+                        error = str(e)
+                    finally:
+                        _discard(temporary_path)
+                if error is not None:
+                    logger.error(f"Could not convert {entry.path}: {error}")
+                    failed += 1
+                    continue
+                manifest.add_rules(version, rules)
+                manifest.record(ManifestEntry(entry.path, entry.kind, entry.size, entry.mtime_ns,
+                                              sha256, version, matched, [str(output)]))
+                converted += 1
+                logger.info(f"Converted {entry.path} into {output}")
+        manifest.compact()
+        fields["xacts"] = sum(entry.xacts for entry, _, _ in work)
+    summary = BackfillSummary(len(entries), len(entries) - len(work), converted, failed)
+    logger.info(f"Backfill done: {summary.converted} converted, {summary.skipped} skipped, {summary.failed} failed")
+    return summary
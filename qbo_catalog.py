@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_catalog / inventory a folder of statements without parsing them
+
+    python qbo.py catalog D:/Users/Conrad/Documents
+    python qbo.py catalog D:/Users/Conrad/Statements --recursive --account 4552001301
+
+Knowing the account, the dates and the number of transactions of each file used to mean
+running process_qbo_lines over all of it. The catalog reads only what it needs:
+
+    QBO   ACCTID, DTSTART and DTEND from the first HEAD_BYTES, </OFX> in the last TAIL_BYTES
+          (a download cut short has none) and the transactions by counting <STMTTRN> in
+          the raw bytes, BLOCK_SIZE at a time, without decoding them
+    csv   the bank profile and first posted row from the first HEAD_BYTES, the last row from
+          the last TAIL_BYTES and the rows by counting line ends the same way
+
+Files are listed with os.scandir, whose entries carry the size and modification time, and
+the results are cached in CATALOG_NAME in the directory, keyed by path, size and mtime, so
+a repeat run only opens the files that are new or changed.
+"""
+
+import csv
+import json
+import locale
+import os
+from collections import namedtuple
+from loguru import logger
+
+import bank_profiles
+from csv2qbo import date_fixer, last_csv_row, posted_rows
+from qbo_archive import qbo_header_summary
+
+CATALOG_NAME = ".qbo_catalog.json"
+CATALOG_VERSION = 1
+HEAD_BYTES = 8192
+TAIL_BYTES = 4096
+BLOCK_SIZE = 1 << 20
+STATEMENT_EXTENSIONS = {".qbo": "qbo", ".csv": "csv"}
+
+CatalogEntry = namedtuple("CatalogEntry", "path kind bank account dtstart dtend xacts complete size mtime_ns")
+
+
+def count_bytes(f, token):
+    """Occurrences of the bytes token in the binary file f, read BLOCK_SIZE at a time from its start."""
+    count, carry = 0, b""
+    f.seek(0)
+    for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+        block = carry + block
+        count += block.count(token)
+        carry = block[-(len(token) - 1):] if len(token) > 1 else b""
+    return count
+
+
+def _head_and_tail(f, size):
+    f.seek(0)
+    head = f.read(HEAD_BYTES)
+    f.seek(max(0, size - TAIL_BYTES))
+    return head, f.read(TAIL_BYTES)
+
+
+def sniff_qbo(f, size):
+    """(bank, account, dtstart, dtend, xacts, complete) of the QBO file open in binary as f."""
+    head, tail = _head_and_tail(f, size)
+    account, dtstart, dtend = qbo_header_summary(head.decode("latin-1").splitlines())
+    return "", account, dtstart, dtend, count_bytes(f, b"<STMTTRN>"), b"</OFX>" in tail.upper()
+
+
+def sniff_csv(f, size):
+    """(bank, account, dtstart, dtend, xacts, complete) of the csv download open in binary as f.
+    xacts counts the lines from the first posted row to the last one, the transactions unless
+    a memo holds a line break or blank lines separate the rows.
+    """
+    encoding = locale.getpreferredencoding(False)
+    head, _ = _head_and_tail(f, size)
+    text = head.decode(encoding, errors="replace")
+    profile, dialect = bank_profiles.identify_head(text)
+    if profile is None:
+        return "", "", "", "", 0, False
+    lines = text.splitlines(keepends=True)
+    complete_lines = lines[:-1] if len(head) < size else lines  # the last line may be cut short
+    first = next(posted_rows(csv.reader(complete_lines, dialect), profile), None)
+    if first is None:
+        return profile.name, profile.account_number, "", "", 0, True
+    before_first = next(i for i, row in enumerate(csv.reader(complete_lines, dialect)) if row == first)
+    f.seek(0)
+    last = last_csv_row(f, encoding, TAIL_BYTES, dialect)
+    fix_date = date_fixer(profile)
+    try:
+        dates = sorted(fix_date(profile.row_mapper(row).date) or "" for row in (first, last))
+    except (ValueError, IndexError):  # a row cut short, or one a registered row mapper refuses
+        dates = ["", ""]
+    f.seek(max(0, size - TAIL_BYTES))
+    tail = f.read(TAIL_BYTES)
+    trailing_line_ends = tail[len(tail.rstrip(b"\r\n")):].count(b"\n")
+    xacts = count_bytes(f, b"\n") - trailing_line_ends + 1 - before_first
+    return profile.name, profile.account_number, dates[0], dates[1], xacts, True
+
+
+SNIFFERS = {"qbo": sniff_qbo, "csv": sniff_csv}
+
+
+def sniff(path, kind, size, mtime_ns):
+    """The CatalogEntry of the statement at path, read from its head and tail."""
+    with open(path, "rb") as f:
+        details = SNIFFERS[kind](f, size)
+    return CatalogEntry(path, kind, *details, size, mtime_ns)
+
+
+def scan_statements(directory, recursive=False):
+    """Yield (path, kind, size, mtime_ns) of the QBO and csv files in directory, with os.scandir."""
+    pending = [directory]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                    continue
+                kind = STATEMENT_EXTENSIONS.get(os.path.splitext(entry.name)[1].lower())
+                if kind is not None and entry.is_file():
+                    stat = entry.stat()
+                    yield entry.path, kind, stat.st_size, stat.st_mtime_ns
+
+
+def load_cache(path):
+    """path -> CatalogEntry of a catalog cache, empty if it is missing, unreadable or of another version."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != CATALOG_VERSION:
+            return {}
+        return {entry[0]: CatalogEntry(*entry) for entry in data["files"]}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Ignoring the unreadable catalog cache {path}: {e}")
+        return {}
+
+
+def save_cache(path, entries):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump({"version": CATALOG_VERSION, "files": [list(entry) for entry in entries]}, f)
+    os.replace(temporary_path, path)
+
+
+def catalog(directory, recursive=False, cache_path=None):
+    """CatalogEntry of every QBO and csv file in directory, sorted by path. Files whose path,
+    size and mtime are in the cache at cache_path (CATALOG_NAME in directory) are not opened.
+    """
+    directory = os.fspath(directory)
+    cache_path = cache_path or os.path.join(directory, CATALOG_NAME)
+    cached = load_cache(cache_path)
+    entries, sniffed = [], 0
+    for path, kind, size, mtime_ns in scan_statements(directory, recursive):
+        entry = cached.get(path)
+        if entry is None or (entry.size, entry.mtime_ns) != (size, mtime_ns):
+            try:
+                entry = sniff(path, kind, size, mtime_ns)
+            except OSError as e:
+                logger.warning(f"Could not read {path}: {e}")
+                continue
+            sniffed += 1
+        entries.append(entry)
+    entries.sort()
+    if sniffed or len(entries) != len(cached):
+        try:
+            save_cache(cache_path, entries)
+        except OSError as e:
+            logger.warning(f"Could not write the catalog cache {cache_path}: {e}")
+    logger.info(f"{len(entries)} statements in {directory}, {sniffed} read, {len(entries) - sniffed} from the cache")
+    return entries
+
+
+def select(entries, account=None, since=None, until=None):
+    """The entries of account overlapping the YYYYMMDD dates since..until."""
+    return [
+        entry for entry in entries
+        if (not account or entry.account == account)
+        and (not since or not entry.dtend or entry.dtend[:8] >= since)
+        and (not until or not entry.dtstart or entry.dtstart[:8] <= until)
+    ]
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_checkpoint / resume a conversion of a very large file where it stopped
+
+    python qbo.py fix --checkpoint 5000
+    python qbo.py csv2qbo --checkpoint 5000
+
+A conversion killed partway through a huge download (out of memory, a stopped scheduled
+task) would otherwise start again from the first transaction. With --checkpoint the
+converters stream the input from disk instead of reading it whole, append their output to
+<output directory>/<input name>.partial and, every N transactions, record in the sidecar
+<output directory>/<input name>.checkpoint:
+
+    input_size, input_mtime   the input the checkpoint belongs to
+    input_offset              bytes of the input consumed, just after a </STMTTRN> (or csv row)
+    output_offset             bytes of the partial output written for them
+    xacts                     transactions written
+    state                     what the converter needs to carry on, e.g. the DTEND and ACCTID seen
+
+A later run finding the checkpoint of an unchanged input (with or without --checkpoint)
+cuts the partial output back to output_offset, seeks the input to input_offset and carries on
+appending. The finished output is renamed into place and the checkpoint removed, so the result
+is byte for byte the file an uninterrupted run writes. Checkpoints of an input that has changed
+since are ignored. The output is flushed to disk before each checkpoint is recorded.
+
+Input lines are read in binary to know their offsets and decoded like open() in text mode does.
+A file with bare carriage return line ends is converted correctly but, as its lines can not be
+told apart in binary, can only be checkpointed at the real line ends.
+"""
+
+import json
+import locale
+import os
+import re
+from collections import namedtuple
+from loguru import logger
+
+CHECKPOINT_XACTS = 5000  # transactions between checkpoints
+PARTIAL_SUFFIX = ".partial"
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+Checkpoint = namedtuple("Checkpoint", "input_size input_mtime input_offset output_offset xacts state")
+
+
+class OffsetLines:
+    """Iterate the text lines of a binary file from offset, translating line ends as text mode open() does.
+    offset is the byte position after the last line returned, None while the rest of a line with
+    bare carriage returns is still being returned.
+    """
+
+    def __init__(self, binary_file, offset=0, encoding=None):
+        self.file = binary_file
+        self.file.seek(offset)
+        self.offset = offset
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self._pending = []
+        self._end = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._pending:
+            raw = self.file.readline()
+            if not raw:
+                raise StopIteration
+            self._end += len(raw)
+            text = raw.decode(self.encoding)
+            if "\r" not in text:
+                self.offset = self._end
+                return text
+            pieces = re.split("(?<=\n)", text.replace("\r\n", "\n").replace("\r", "\n"))
+            self._pending = [piece for piece in reversed(pieces) if piece]
+        line = self._pending.pop()
+        self.offset = None if self._pending else self._end
+        return line
+
+
+class ResumableOutput:
+    """The partial output and the checkpoint sidecar of the conversion of input_path."""
+
+    def __init__(self, input_path, output_directory):
+        self.input_path = str(input_path)
+        name = os.path.basename(self.input_path)
+        self.partial_path = os.path.join(output_directory, name + PARTIAL_SUFFIX)
+        self.checkpoint_path = os.path.join(output_directory, name + CHECKPOINT_SUFFIX)
+
+    def _input_stat(self):
+        stat = os.stat(self.input_path)
+        return stat.st_size, stat.st_mtime
+
+    def load(self):
+        """The Checkpoint left by an earlier run of the unchanged input, None if there is none."""
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = Checkpoint(**json.load(f))
+            partial_size = os.path.getsize(self.partial_path)
+        except (OSError, ValueError, TypeError) as e:
+            if os.path.exists(self.checkpoint_path):
+                logger.warning(f"Ignoring the unreadable checkpoint {self.checkpoint_path}: {e}")
+            return None
+        if (checkpoint.input_size, checkpoint.input_mtime) != self._input_stat() or partial_size < checkpoint.output_offset:
+            logger.warning(f"Ignoring the checkpoint {self.checkpoint_path}, {self.input_path} changed since")
+            return None
+        return checkpoint
+
+    def _save(self, checkpoint):
+        temporary_path = f"{self.checkpoint_path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(checkpoint._asdict(), f)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def write(self, pieces, validator=None, every=CHECKPOINT_XACTS):
+        """Write the conversion, resuming from the checkpoint when there is one.
+        pieces(checkpoint, state) yields (text, is_transaction, input offset) in output order, from
+        the start of the input when checkpoint is None and from checkpoint.input_offset otherwise.
+        It keeps what it needs to resume in the dict state, restored from the checkpoint. The
+        input offset is after the text's input, None when it can not be resumed from there.
+        A StatementValidator validator is fed the whole output, the part written before too.
+        Return (transactions written, state).
+        """
+        checkpoint = self.load()
+        input_size, input_mtime = self._input_stat()
+        if checkpoint is None:
+            open(self.partial_path, "w").close()
+            xacts, state = 0, {}
+        else:
+            logger.info(f"Resuming {os.path.basename(self.input_path)} after {checkpoint.xacts} transactions "
+                        f"(input byte {checkpoint.input_offset}, output byte {checkpoint.output_offset})")
+            os.truncate(self.partial_path, checkpoint.output_offset)
+            xacts, state = checkpoint.xacts, checkpoint.state
+            if validator is not None:
+                with open(self.partial_path) as f:
+                    for line in f:
+                        validator.feed(line)
+        saved = xacts
+        with open(self.partial_path, "a") as f:
+            for text, is_transaction, input_offset in pieces(checkpoint, state):
+                f.write(text)
+                if validator is not None:
+                    for line in text.splitlines():
+                        validator.feed(line)
+                if not is_transaction:
+                    continue
+                xacts += 1
+                if xacts - saved >= every and input_offset is not None:
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._save(Checkpoint(input_size, input_mtime, input_offset, f.tell(), xacts, state))
+                    saved = xacts
+        return xacts, state
+
+    def finish(self, output_path):
+        """Move the complete output to output_path and forget the checkpoint."""
+        os.replace(self.partial_path, output_path)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+def has_checkpoint(input_path, output_directory):
+    """True when a conversion of input_path into output_directory left a checkpoint behind."""
+    return os.path.exists(ResumableOutput(input_path, output_directory).checkpoint_path)
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_differential / run every generation of the QBO fixer on the same statements
+
+    python qbo.py compare                          a generated statement of 2000 transactions
+    python qbo.py compare --xacts 20000 --seed 7
+    python qbo.py compare download.qbo --report compare.json
+
+The repo holds three generations of the fixer and they do not agree on edge cases:
+
+    QBOFIX                  keeps the cleaned memo in MEMO and copies it to NAME, never swaps,
+                            uses its own short bad_text list and takes the first DTEND
+    QBOFIXloguru            swaps NAME and MEMO, writes COLLISION (without a line end, so the
+                            MEMO tag ends up on the NAME line) when they are equal, inserts a
+                            memo when it is missing, fails on an unterminated transaction
+    QBOfix2024_2            the reference: swaps NAME and MEMO, names CHECK PAID transactions
+                            by CHECKNUM and REFNUM, adds "No Memo" when MEMO is missing; the
+                            DEBIT and card number regex of its BAD_TEXT is removed as literal
+                            text (compile_bad_text only compiles entries holding four digits)
+                            so, unlike in the legacy engines, it never matches
+
+Each engine is run on the same lines, the transactions of its output are matched with those of
+the reference by FITID and every field that differs is reported with the kind of edge case that
+explains it (see classify). Engines listed in EQUIVALENT_ENGINES are optimized versions of the
+reference and must produce its output byte for byte; compare fails when they do not. Register a
+new engine in ENGINES (and EQUIVALENT_ENGINES) before retiring the code it replaces.
+
+The engines log every line at debug level; they are silenced while they run so the throughput
+table measures the cleaning and not the logging. Peak memory is measured with tracemalloc in
+this process only, memory used by the worker processes of the parallel engine is not included.
+"""
+
+import importlib
+import json
+import logging
+import random
+import re
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from loguru import logger
+
+import QBOfix2024_2
+
+REFERENCE_ENGINE = "QBOfix2024_2"
+EQUIVALENT_ENGINES = ("QBOfix2024_2_parallel",)
+PARALLEL_WORKERS = 2
+PARALLEL_CHUNK_SIZE = 500  # small enough for the generated statements to be split between the workers
+DEFAULT_XACTS = 2000
+DEFAULT_REPEAT = 3
+
+Engine = namedtuple("Engine", "function strip_bad_text module")
+EngineRun = namedtuple("EngineRun", "engine lines file_date account seconds error")
+Difference = namedtuple("Difference", "engine fitid field kind expected found")
+BenchmarkRow = namedtuple("BenchmarkRow", "engine xacts seconds peak")
+StatementTransaction = namedtuple("StatementTransaction", "trntype dtposted trnamt fitid refnum checknum name memo")
+
+
+def _qbofix(lines):
+    import QBOFIX
+
+    QBOFIX.file_date = QBOFIX.acct_number = ""  # module globals, they would survive from the previous run
+    cleaned = QBOFIX.clean_qbo_file(lines, QBOFIX.bad_text)
+    return cleaned, QBOFIX.file_date, QBOFIX.acct_number
+
+
+def _qbofix_loguru(lines):
+    import QBOFIXloguru
+
+    return QBOFIXloguru.clean_qbo_file(list(lines), QBOFIXloguru.BAD_TEXT)  # it pops its input list empty
+
+
+def _qbofix_2024(lines):
+    return QBOfix2024_2.process_qbo_lines(lines)
+
+
+def _qbofix_2024_parallel(lines):
+    return QBOfix2024_2.process_qbo_lines_parallel(lines, workers=PARALLEL_WORKERS, chunk_size=PARALLEL_CHUNK_SIZE)
+
+
+def _legacy_strip(module, attribute):
+    """Bad text removal of the legacy engines: every entry of the list is a regex, see their Clean_Line."""
+    def strip_bad_text(memo):
+        for item in getattr(importlib.import_module(module), attribute):
+            memo = re.sub(item, "", re.sub(r" +", " ", memo)).strip()
+        return memo
+    return strip_bad_text
+
+
+def _reference_strip(memo):
+    """Bad text removal of QBOfix2024_2.preprocess_memo, without its debug logging."""
+    for pattern, text in QBOfix2024_2.DEFAULT_RULES.bad_text:
+        memo = pattern.sub("", memo) if pattern is not None else memo.replace(text, "")
+    return QBOfix2024_2.MULTIPLE_SPACES.sub(" ", memo).strip()
+
+
+ENGINES = {  # name -> Engine(function of lines returning (lines, file date, account), its bad text removal, its module)
+    "QBOFIX": Engine(_qbofix, _legacy_strip("QBOFIX", "bad_text"), "QBOFIX"),
+    "QBOFIXloguru": Engine(_qbofix_loguru, _legacy_strip("QBOFIXloguru", "BAD_TEXT"), "QBOFIXloguru"),
+    "QBOfix2024_2": Engine(_qbofix_2024, _reference_strip, "QBOfix2024_2"),
+    "QBOfix2024_2_parallel": Engine(_qbofix_2024_parallel, _reference_strip, "QBOfix2024_2"),
+}
+
+
+@contextmanager
+def quiet_engines():
+    """Silence the logging of the engines (loguru and, for QBOFIX, the logging module)."""
+    modules = {engine.module for engine in ENGINES.values()}
+    for module in modules:
+        logger.disable(module)
+    logging.disable(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+        for module in modules:
+            logger.enable(module)
+
+
+def run_engine(name, lines):
+    """Run the engine called name on lines. An engine failing is reported in EngineRun.error."""
+    start = time.perf_counter()
+    try:
+        with quiet_engines():
+            result = ENGINES[name].function(lines)
+    except Exception as e:  # QBOFIX has no logger.catch
+        return EngineRun(name, None, None, None, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+    seconds = time.perf_counter() - start
+    if result is None:  # logger.catch swallowed an exception
+        return EngineRun(name, None, None, None, seconds, "raised an exception")
+    lines, file_date, account = result
+    return EngineRun(name, lines, file_date, account, seconds, None)
+
+
+def parse_transactions(lines):
+    """FITID -> tag:value dict of each transaction in lines, in file order.
+    The lines are joined and split again first, as the file would be written and read back,
+    so a line written without its line end shows up the way QuickBooks would see it.
+    Transactions without a FITID are keyed by their position, "#1", "#2"...
+    """
+    transactions = {}
+    transaction = None
+    for line in "".join(lines).splitlines():
+        line = line.strip()
+        if line.startswith("<STMTTRN>"):
+            transaction = {}
+        elif line.startswith("</STMTTRN>"):
+            if transaction is not None:
+                transactions[transaction.get("FITID") or f"#{len(transactions) + 1}"] = transaction
+            transaction = None
+        elif transaction is not None:
+            tag, value = line[1:].split(">", 1) if line.startswith("<") and ">" in line else ("", line)
+            transaction[tag] = value.strip()
+    return transactions
+
+
+def source_kind(source):
+    """The edge case of the transaction as the bank wrote it, None for an ordinary one."""
+    memo, name = source.get("MEMO"), source.get("NAME")
+    if memo is None:
+        return "missing_memo"
+    if name is None:
+        return "missing_name"
+    if name == memo == "CHECK PAID":
+        return "check_paid"
+    return None
+
+
+def classify(engine, source, expected, found):
+    """The edge case explaining why transaction found of engine differs from expected of the reference.
+    source is the transaction as the bank wrote it.
+    """
+    kind = source_kind(source)
+    if kind in ("missing_memo", "missing_name"):
+        return kind
+    if found.get("NAME", "").startswith("COLLISION"):
+        return "collision"
+    if kind is not None:
+        return kind
+    memo, name = source["MEMO"], source["NAME"]
+    if found.get("NAME") == "NOTHING USEFUL":
+        return "empty_memo"
+    if found.get("MEMO") != expected.get("MEMO") and found.get("MEMO") != name:
+        return "not_swapped"
+    if "BILL PAYMT" in memo:
+        return "bill_pay"
+    if ENGINES[engine].strip_bad_text(memo) != ENGINES[REFERENCE_ENGINE].strip_bad_text(memo):
+        return "bad_text"
+    return "other"
+
+
+def compare_runs(source_lines, reference, run):
+    """The Differences between the output of run and of the reference EngineRun."""
+    if run.error is not None:
+        return [Difference(run.engine, None, "", "error", None, run.error)]
+    differences = []
+    for field, expected, found in (("DTEND", reference.file_date, run.file_date), ("ACCTID", reference.account, run.account)):
+        if expected != found:
+            differences.append(Difference(run.engine, None, field, "header", expected, found))
+    sources = parse_transactions(source_lines)
+    expected_transactions, found_transactions = parse_transactions(reference.lines), parse_transactions(run.lines)
+    for fitid, expected in expected_transactions.items():
+        found = found_transactions.get(fitid)
+        if found is None:
+            kind = source_kind(sources.get(fitid, {})) or "dropped"  # QBOFIX loses the line end of a memo-less NAME
+            differences.append(Difference(run.engine, fitid, "STMTTRN", kind, fitid, None))
+            continue
+        fields = [tag for tag in expected if expected[tag] != found.get(tag)]
+        fields += [tag for tag in found if tag not in expected]
+        if fields:
+            kind = classify(run.engine, sources.get(fitid, {}), expected, found)
+            for field in fields:
+                differences.append(Difference(run.engine, fitid, field, kind, expected.get(field), found.get(field)))
+    for fitid in found_transactions.keys() - expected_transactions.keys():
+        differences.append(Difference(run.engine, fitid, "STMTTRN", "extra", None, fitid))
+    return differences
+
+
+def first_difference(expected_lines, found_lines):
+    """(line index, expected line, found line) of the first line where the outputs differ, None if identical."""
+    for i, (expected, found) in enumerate(zip(expected_lines, found_lines)):
+        if expected != found:
+            return i, expected, found
+    if len(expected_lines) != len(found_lines):
+        i = min(len(expected_lines), len(found_lines))
+        return i, expected_lines[i] if i < len(expected_lines) else None, found_lines[i] if i < len(found_lines) else None
+    return None
+
+
+def compare(lines, engines=None):
+    """Run the engines (all of them by default) on lines.
+    Return (list of Differences against the reference, dict of engine -> first_difference of the
+    EQUIVALENT_ENGINES among them that are not byte identical to the reference).
+    """
+    engines = [name for name in engines or ENGINES if name != REFERENCE_ENGINE]
+    reference = run_engine(REFERENCE_ENGINE, lines)
+    if reference.error is not None:
+        raise ValueError(f"the reference engine {REFERENCE_ENGINE} failed: {reference.error}")
+    differences, mismatches = [], {}
+    for name in engines:
+        run = run_engine(name, lines)
+        differences.extend(compare_runs(lines, reference, run))
+        if name in EQUIVALENT_ENGINES:
+            mismatch = ("error", None, run.error) if run.error else first_difference(reference.lines, run.lines)
+            if mismatch is not None or (run.file_date, run.account) != (reference.file_date, reference.account):
+                mismatches[name] = mismatch
+    return differences, mismatches
+
+
+def summarize(differences):
+    """Counter of (engine, kind) -> transactions (or header fields) that differ."""
+    differing = {(d.engine, d.fitid or d.field, d.kind) for d in differences}
+    return Counter((engine, kind) for engine, _, kind in differing)
+
+
+def log_differences(differences):
+    examples = {}
+    for difference in differences:
+        examples.setdefault((difference.engine, difference.kind), difference)
+    logger.info(f"{'engine':<24}{'kind':<14}{'count':>7}  example")
+    for (engine, kind), count in sorted(summarize(differences).items()):
+        example = examples[engine, kind]
+        logger.info(f"{engine:<24}{kind:<14}{count:>7}  {example.field}: {example.expected!r} -> {example.found!r}")
+
+
+def benchmark(lines, engines=None, repeat=DEFAULT_REPEAT):
+    """A BenchmarkRow per engine: best wall time of repeat runs and the peak traced memory of one more."""
+    xacts = sum(1 for line in lines if line.lstrip().startswith("<STMTTRN>"))
+    rows = []
+    for name in engines or ENGINES:
+        seconds = min(run_engine(name, lines).seconds for _ in range(repeat))
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        run_engine(name, lines)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        if started_tracing:
+            tracemalloc.stop()
+        rows.append(BenchmarkRow(name, xacts, seconds, peak))
+    return rows
+
+
+def log_benchmark(rows):
+    logger.info(f"{'engine':<24}{'xacts':>10}{'wall s':>10}{'xacts/s':>12}{'peak MB':>10}")
+    for row in rows:
+        rate = f"{row.xacts / row.seconds:.0f}" if row.seconds > 0 else "-"
+        logger.info(f"{row.engine:<24}{row.xacts:>10}{row.seconds:>10.3f}{rate:>12}{row.peak / 2**20:>10.1f}")
+
+
+def write_report(path, differences, rows, mismatches):
+    report = {
+        "summary": [{"engine": engine, "kind": kind, "count": count}
+                    for (engine, kind), count in sorted(summarize(differences).items())],
+        "differences": [d._asdict() for d in differences],
+        "benchmark": [row._asdict() for row in rows],
+        "not_equivalent": {engine: list(mismatch) if mismatch else None for engine, mismatch in mismatches.items()},
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+
+
+STATEMENT_HEADER = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+SECURITY:NONE
+ENCODING:USASCII
+CHARSET:1252
+COMPRESSION:NONE
+OLDFILEUID:NONE
+NEWFILEUID:NONE
+
+<OFX>
+<SIGNONMSGSRSV1>
+<SONRS>
+<STATUS>
+<CODE>0
+<SEVERITY>INFO
+</STATUS>
+<LANGUAGE>ENG
+</SONRS>
+</SIGNONMSGSRSV1>
+<BANKMSGSRSV1>
+<STMTTRNRS>
+<TRNUID>0
+<STMTRS>
+<CURDEF>USD
+<BANKACCTFROM>
+<BANKID>043400036
+<ACCTID>{account}
+<ACCTTYPE>CHECKING
+</BANKACCTFROM>
+<BANKTRANLIST>
+<DTSTART>{dtstart}
+<DTEND>{dtend}
+"""
+
+STATEMENT_FOOTER = """</BANKTRANLIST>
+<LEDGERBAL>
+<BALAMT>0.00
+<DTASOF>{dtend}
+</LEDGERBAL>
+</STMTRS>
+</STMTTRNRS>
+</BANKMSGSRSV1>
+</OFX>
+"""
+
+# memos as the bank writes them, with text of each engine's bad text list
+SAMPLE_MEMOS = (
+    "PREAUTHORIZED ACH DEBIT TOUCHTUNES        TT PAYMENT        220401",
+    "POS DB  GROCERY OUTLET 0231",
+    "POS DEBIT 1234 SHELL OIL 57442",
+    "CKCD DEBIT 5678 AMAZON MKTPLACE PMTS",
+    "AC-PAYROLL DIRECT DEPOSIT",
+    "BILL PAYMT VERIZON WIRELESS",
+    "DEPOSIT",
+    "ATM WITHDRAWAL TERMINAL 0042 MAIN ST",
+    "AUTOMATIC TRANSFER TO SAVINGS 0001",
+    "ONLINE TRANSFER-ONLINE TO CHECKING",
+    "ACH CREDIT IRS TREAS 310 TAX REF",
+    "MISCELLANEOUS DEBIT SERVICE CHARGE",
+    "PURCHASE TERMINAL 0231 HOME DEPOT 4410",
+    "ATM MERCHANT PURCHASE COFFEE HOUSE",
+    "CREDIT MEMO-ACH RETURN",
+    "INSURANCE PREMIUM ONLINE PAYMENT FOR POLICY NUMBER 0042-77",
+)
+EDGE_CASES = ("regular",) * 12 + ("check_paid", "missing_memo", "name_is_memo", "empty_memo")
+
+
+def statement_lines(transactions, account="4552001301", dtstart="20220331", dtend="20220701"):
+    """The lines of a QBO statement holding the StatementTransactions. A None name, memo or
+    checknum leaves that tag out of the transaction.
+    """
+    lines = STATEMENT_HEADER.format(account=account, dtstart=dtstart, dtend=dtend).splitlines(keepends=True)
+    for xact in transactions:
+        lines.append("<STMTTRN>\n")
+        for tag, value in zip(("TRNTYPE", "DTPOSTED", "TRNAMT", "FITID", "CHECKNUM", "REFNUM", "NAME", "MEMO"),
+                              (xact.trntype, xact.dtposted, xact.trnamt, xact.fitid, xact.checknum, xact.refnum,
+                               xact.name, xact.memo)):
+            if value is not None:
+                lines.append(f"<{tag}>{value}\n")
+        lines.append("</STMTTRN>\n")
+    lines.extend(STATEMENT_FOOTER.format(dtend=dtend).splitlines(keepends=True))
+    return lines
+
+
+def random_transaction(rng, i):
+    """A StatementTransaction, the i-th of a statement, of a randomly chosen EDGE_CASES kind."""
+    refnum = f"{rng.randrange(10**14, 10**15)}"
+    amount = f"{rng.choice('-+')}{rng.randrange(1, 500000) / 100:.2f}".replace("+", "")
+    dtposted = f"2022{rng.randrange(4, 7):02d}{rng.randrange(1, 29):02d}"
+    fitid = f"{i:08d}{rng.randrange(16**24):024x}"
+    case = rng.choice(EDGE_CASES)
+    if case == "check_paid":
+        return StatementTransaction("CHECK", dtposted, amount, fitid, refnum, str(rng.randrange(1000, 9999)),
+                                    "CHECK PAID", "CHECK PAID")
+    memo = rng.choice(SAMPLE_MEMOS)
+    if case == "missing_memo":
+        return StatementTransaction("DEBIT", dtposted, amount, fitid, refnum, None, refnum, None)
+    if case == "name_is_memo":
+        return StatementTransaction("CREDIT", dtposted, amount, fitid, refnum, None, "DEPOSIT", "DEPOSIT")
+    if case == "empty_memo":
+        memo = rng.choice(("POS ", "ACH DEBIT ", "CKCD "))
+    return StatementTransaction("DEBIT", dtposted, amount, fitid, refnum, None, refnum, memo)
+
+
+def random_statement(xacts=DEFAULT_XACTS, seed=0):
+    """The lines of a statement of xacts random transactions, the same for the same seed."""
+    rng = random.Random(seed)
+    return statement_lines([random_transaction(rng, i) for i in range(xacts)])
+
+
+def compare_files(paths=(), xacts=DEFAULT_XACTS, seed=0, engines=None, repeat=DEFAULT_REPEAT, report_path=None):
+    """Compare and benchmark the engines on the QBO files paths, or on a random statement when
+    there are none. Log the differences and the throughput table. Return True when every engine of
+    EQUIVALENT_ENGINES produced the output of the reference.
+    """
+    inputs = [(str(path), QBOfix2024_2.read_base_file(path)) for path in paths] or \
+             [(f"random statement of {xacts} transactions (seed {seed})", random_statement(xacts, seed))]
+    timed = None if not engines else [REFERENCE_ENGINE] + [name for name in engines if name != REFERENCE_ENGINE]
+    differences, rows, mismatches = [], [], {}
+    for name, lines in inputs:
+        logger.info(f"Comparing the engines on {name}")
+        found, not_equivalent = compare(lines, engines)
+        differences.extend(found)
+        mismatches.update(not_equivalent)
+        rows.extend(benchmark(lines, timed, repeat))
+    log_differences(differences)
+    log_benchmark(rows)
+    for engine, mismatch in mismatches.items():
+        logger.error(f"{engine} is not equivalent to {REFERENCE_ENGINE}: first difference {mismatch}")
+    if report_path:
+        write_report(report_path, differences, rows, mismatches)
+        logger.info(f"Report written to {report_path}")
+    return not mismatches
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_merge / combine overlapping QBO downloads into one statement per account
+
+Downloading a statement every few days leaves several <DTEND>_<ACCTID>.qbo files whose
+date ranges overlap. merge_files() groups them by ACCTID and writes one file per account:
+
+    1. every file is scanned once, line by line, for its ACCTID, DTSTART, DTEND,
+       header, footer and whether its transactions are in DTPOSTED order
+    2. files in ascending order are streamed; other files are sorted in memory
+    3. the streams are k-way merged on DTPOSTED with heapq.merge
+    4. a transaction whose FITID was already written within the last window_days
+       is a duplicate and is dropped; older FITIDs are forgotten as the merge moves on
+       so memory is bounded by the overlap window, not by the size of the files
+    5. header and footer come from the file with the latest DTEND (its ledger balance
+       is the current one) with DTSTART/DTEND widened to cover every file
+"""
+
+import datetime as dt
+import heapq
+from collections import deque, namedtuple
+from pathlib import Path
+from loguru import logger
+
+from QBOfix2024_2 import QBO_FILE_EXT, extract_transaction_details, iter_qbo_blocks, output_path, write_qbo_file
+
+DEFAULT_WINDOW_DAYS = 3
+
+QboFileScan = namedtuple("QboFileScan", "path account dtstart dtend order xacts header footer")
+
+
+def _tag_value(line_stripped, tag):
+    return line_stripped[len(tag):].strip()
+
+
+def scan_qbo_file(path):
+    """Read path once and return a QboFileScan.
+    order is "ascending", "descending" or "unsorted" according to the DTPOSTED values.
+    """
+    account = dtstart = dtend = ""
+    header, footer = [], []
+    in_header, in_transaction = True, False
+    previous = None
+    ascending = descending = True
+    xacts = 0
+    with open(path) as f:
+        for line in f:
+            line_stripped = line.strip()
+            if line_stripped.startswith("<STMTTRN>"):
+                in_header, in_transaction = False, True
+                xacts += 1
+            elif line_stripped.startswith("</STMTTRN>"):
+                in_transaction = False
+                footer = []
+                continue
+            if in_header:
+                header.append(line)
+            elif not in_transaction:
+                footer.append(line)
+            if line_stripped.startswith("<ACCTID>"):
+                account = _tag_value(line_stripped, "<ACCTID>")
+            elif line_stripped.startswith("<DTSTART>") and not dtstart:
+                dtstart = _tag_value(line_stripped, "<DTSTART>")
+            elif line_stripped.startswith("<DTEND>") and not dtend:
+                dtend = _tag_value(line_stripped, "<DTEND>")
+            elif line_stripped.startswith("<DTPOSTED>"):
+                posted = _tag_value(line_stripped, "<DTPOSTED>")
+                if previous is not None:
+                    ascending = ascending and previous <= posted
+                    descending = descending and previous >= posted
+                previous = posted
+    order = "ascending" if ascending else "descending" if descending else "unsorted"
+    return QboFileScan(Path(path), account, dtstart, dtend, order, xacts, header, footer)
+
+
+def _keyed_transactions(path):
+    """Yield (DTPOSTED, FITID, transaction lines) for each transaction in path, in file order."""
+    with open(path) as f:
+        for is_transaction, block in iter_qbo_blocks(f):
+            if is_transaction:
+                details = extract_transaction_details(block)
+                yield details.get("DTPOSTED", ""), details.get("FITID", ""), block
+
+
+def sorted_transactions(scan):
+    """Transactions of a scanned file in ascending DTPOSTED order.
+    Ascending files are streamed, the others are loaded and sorted.
+    """
+    transactions = _keyed_transactions(scan.path)
+    if scan.order == "ascending":
+        return transactions
+    logger.info(f"{scan.path.name} is {scan.order}, sorting its {scan.xacts} transactions in memory.")
+    if scan.order == "descending":
+        return reversed(list(transactions))
+    return sorted(transactions, key=lambda t: t[0])
+
+
+def day_number(dtposted):
+    """Day ordinal of a DTPOSTED value, 0 when it is not a date."""
+    try:
+        return dt.date(int(dtposted[:4]), int(dtposted[4:6]), int(dtposted[6:8])).toordinal()
+    except ValueError:
+        return 0
+
+
+def deduplicate(transactions, window_days=DEFAULT_WINDOW_DAYS, stats=None):
+    """Drop transactions whose FITID was seen within window_days before, in a date ordered stream.
+    Only the FITIDs inside the rolling window are remembered.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("duplicates", 0)
+    stats.setdefault("written", 0)
+    seen = {}  # FITID -> day number it was last seen
+    window = deque()  # (day number, FITID) in the order they were seen
+    for dtposted, fitid, block in transactions:
+        day = day_number(dtposted)
+        while window and window[0][0] < day - window_days:
+            old_day, old_fitid = window.popleft()
+            if seen.get(old_fitid) == old_day:
+                del seen[old_fitid]
+        if fitid and fitid in seen:
+            stats["duplicates"] += 1
+            continue
+        if fitid:
+            seen[fitid] = day
+            window.append((day, fitid))
+        stats["written"] += 1
+        yield block
+
+
+def replace_tag(lines, tag, value):
+    """Return lines with the value of every <tag> line replaced by value."""
+    return [f"{tag}{value}\n" if line.strip().startswith(tag) else line for line in lines]
+
+
+def merged_lines(scans, window_days=DEFAULT_WINDOW_DAYS, stats=None):
+    """Yield the lines of the merged statement of scans, which all belong to one account."""
+    latest = max(scans, key=lambda s: s.dtend)
+    dtstart = min((s.dtstart for s in scans if s.dtstart), default=latest.dtstart)
+    header = replace_tag(replace_tag(latest.header, "<DTSTART>", dtstart), "<DTEND>", latest.dtend)
+    yield from header
+    merged = heapq.merge(*(sorted_transactions(s) for s in scans), key=lambda t: t[0])
+    for block in deduplicate(merged, window_days, stats):
+        yield from block
+    yield from latest.footer
+
+
+@logger.catch
+def merge_files(paths, window_days=DEFAULT_WINDOW_DAYS):
+    """Merge the QBO files in paths into one <DTEND>_<ACCTID>.qbo file per account in the output directory.
+    Return a dict of account -> stats dict (files, transactions read, duplicates dropped, written, output).
+    """
+    accounts = {}
+    for path in paths:
+        scan = scan_qbo_file(path)
+        logger.info(f"{scan.path.name}: account {scan.account} {scan.dtstart}-{scan.dtend}, "
+                    f"{scan.xacts} transactions, {scan.order}")
+        accounts.setdefault(scan.account, []).append(scan)
+    results = {}
+    for account, scans in accounts.items():
+        stats = {"files": len(scans), "read": sum(s.xacts for s in scans)}
+        latest = max(scans, key=lambda s: s.dtend)
+        clean_output_file = output_path(latest.dtend, account)
+        write_qbo_file(clean_output_file, merged_lines(scans, window_days, stats))
+        stats["output"] = str(clean_output_file)
+        logger.info(f"Account {account}: {stats['files']} files, {stats['read']} transactions read, "
+                    f"{stats['duplicates']} duplicates dropped, {stats['written']} written to {clean_output_file}")
+        results[account] = stats
+    return results
+
+
+def expand_paths(arguments):
+    """Expand directories in arguments to the QBO files they contain."""
+    paths = []
+    for argument in arguments:
+        argument = Path(argument)
+        paths.extend(sorted(argument.glob(f"*{QBO_FILE_EXT}")) if argument.is_dir() else [argument])
+    return paths
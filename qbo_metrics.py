@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_metrics / throughput and backlog of the converters while they run unattended
+
+The converters count what they do in the metrics below, kept in memory by REGISTRY.
+Updating a metric takes a lock and a dict lookup and happens once per file (once per
+file or chunk of transactions for qbo_memos_cleaned_total), so metrics are always collected. They are
+only published when asked for:
+
+    python qbo.py watch --metrics-port 9108      http://127.0.0.1:9108/metrics
+    python qbo.py serve                           GET /metrics on the conversion server
+
+and, while publishing, a snapshot is written every --metrics-interval seconds (and when
+the command ends) to LOGS/<program>_metrics.json.
+
+    qbo_files_seen_total{source}          files found waiting to be converted
+    qbo_files_converted_total{source}     files converted and written
+    qbo_transactions_total{source}        transactions written
+    qbo_memos_cleaned_total               memos changed by the BAD_TEXT rules
+    qbo_attachments_downloaded_total      statement attachments saved from Gmail
+    qbo_errors_total{stage}               failures by stage: read, rewrite, write, archive, remove,
+                                          identify, balance, convert, serve, fetch
+    qbo_backlog_files{source}             files waiting in the download directory at the last check
+    qbo_file_latency_seconds{source}      file arrival (its modification time) to output written
+    qbo_cache_hits_total{cache}           lookups answered by a cache: dates parsed by csv2qbo...
+    qbo_cache_misses_total{cache}
+
+source is "qbo" for the fixer and "csv" for csv2qbo. Caches are read when the metrics are
+rendered, so they cost nothing while converting.
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+
+from structured_log import LOG_DIRECTORY
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_SNAPSHOT_INTERVAL = 60
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of series, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}, not {tuple(labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    def value(self, **labels):
+        return self._series.get(self._key(labels), 0)
+
+    def samples(self):
+        """(suffix, label names, label values, value) of every series."""
+        with self._lock:
+            return [("", self.labels, key, value) for key, value in sorted(self._series.items())]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._series.get(key)
+            if counts is None:
+                counts = self._series[key] = [0] * len(self.buckets) + [0.0]  # bucket counts, then the sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += value
+
+    def value(self, **labels):
+        """Number of observations."""
+        counts = self._series.get(self._key(labels))
+        return counts[-2] if counts else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, counts in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(("_bucket", self.labels + ("le",), key + (_number(bound),), count))
+                samples.append(("_sum", self.labels, key, counts[-1]))
+                samples.append(("_count", self.labels, key, counts[-2]))
+        return samples
+
+
+class CacheMetrics:
+    """Hits and misses of functools.lru_cache functions, read from cache_info() when rendered."""
+
+    def __init__(self):
+        self.caches = {}  # name -> cached function
+
+    def register(self, name, function):
+        self.caches[name] = function
+        return function
+
+    def families(self):
+        infos = {name: function.cache_info() for name, function in sorted(self.caches.items())}
+        for field, name, documentation in (
+            ("hits", "qbo_cache_hits_total", "Lookups answered by a cache."),
+            ("misses", "qbo_cache_misses_total", "Lookups a cache had to compute."),
+        ):
+            yield name, "counter", documentation, [
+                ("", ("cache",), (cache,), getattr(info, field)) for cache, info in infos.items()
+            ]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.cache_metrics = CacheMetrics()
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.add(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, documentation, labels, buckets))
+
+    def families(self):
+        """(name, kind, documentation, samples) of every metric."""
+        for metric in self.metrics:
+            yield metric.name, metric.kind, metric.documentation, metric.samples()
+        yield from self.cache_metrics.families()
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, kind, documentation, samples in self.families():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, names, values, value in samples:
+                lines.append(f"{name}{suffix}{_label_text(names, values)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """The metrics as a dict ready for json: name -> list of {labels, value}."""
+        result = {"ts": time.time()}
+        for name, _, _, samples in self.families():
+            for suffix, names, values, value in samples:
+                result.setdefault(name + suffix, []).append({"labels": dict(zip(names, values)), "value": value})
+        return result
+
+    def write_snapshot(self, path):
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(temporary_path, path)
+
+
+REGISTRY = Registry()
+FILES_SEEN = REGISTRY.counter("qbo_files_seen_total", "Files found waiting to be converted.", ("source",))
+FILES_CONVERTED = REGISTRY.counter("qbo_files_converted_total", "Files converted and written.", ("source",))
+TRANSACTIONS = REGISTRY.counter("qbo_transactions_total", "Transactions written.", ("source",))
+MEMOS_CLEANED = REGISTRY.counter("qbo_memos_cleaned_total", "Memos changed by the BAD_TEXT rules.")
+ATTACHMENTS = REGISTRY.counter("qbo_attachments_downloaded_total", "Statement attachments saved from Gmail.")
+ERRORS = REGISTRY.counter("qbo_errors_total", "Failures by stage.", ("stage",))
+BACKLOG = REGISTRY.gauge("qbo_backlog_files", "Files waiting in the download directory at the last check.", ("source",))
+LATENCY = REGISTRY.histogram(
+    "qbo_file_latency_seconds", "Seconds from a file arriving (its modification time) to its output being written.",
+    ("source",),
+)
+
+
+def arrival_time(path):
+    """The modification time of path, when the bank download arrived. None if it is gone."""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+_waiting = {}  # source -> files found waiting by the last files_waiting, already counted in FILES_SEEN
+
+
+def files_waiting(source, paths):
+    """Record the files of source found waiting: BACKLOG is their number and FILES_SEEN counts
+    the ones that were not waiting at the last check, so a file left behind is seen once.
+    """
+    paths = set(paths)
+    BACKLOG.set(len(paths), source=source)
+    FILES_SEEN.inc(len(paths - _waiting.get(source, set())), source=source)
+    _waiting[source] = paths
+
+
+def file_converted(source, xacts, arrived=None):
+    """Count one converted file of xacts transactions that arrived at the time arrived."""
+    FILES_CONVERTED.inc(source=source)
+    TRANSACTIONS.inc(xacts, source=source)
+    if arrived is not None:
+        LATENCY.observe(max(0.0, time.time() - arrived), source=source)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    server_version = "qbo-metrics/1.0"
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics {format % args}")
+
+
+def snapshot_path(program, log_directory=LOG_DIRECTORY):
+    return os.path.join(log_directory, f"{program}_metrics.json")
+
+
+class MetricsPublisher:
+    """Serve /metrics on localhost from a background thread and write periodic snapshots."""
+
+    def __init__(self, program, port=None, interval=DEFAULT_SNAPSHOT_INTERVAL, registry=REGISTRY,
+                 host=DEFAULT_METRICS_HOST, log_directory=LOG_DIRECTORY):
+        self.registry = registry
+        self.interval = interval
+        self.path = snapshot_path(program, log_directory)
+        os.makedirs(log_directory, exist_ok=True)
+        self.server = None
+        if port is not None:
+            handler = type("Handler", (MetricsHandler,), {"registry": registry})
+            self.server = ThreadingHTTPServer((host, port), handler)
+            self.server.daemon_threads = True
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def address(self):
+        return self.server.server_address[:2] if self.server else None
+
+    def start(self):
+        if self.server is not None:
+            self._threads.append(threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True))
+            logger.info("Serving metrics on http://%s:%s/metrics" % self.address)
+        self._threads.append(threading.Thread(target=self._snapshots, name="metrics-snapshot", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _snapshots(self):
+        while not self._stop.wait(self.interval):
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        try:
+            self.registry.write_snapshot(self.path)
+        except OSError as e:
+            logger.warning(f"Could not write the metrics snapshot {self.path}: {e}")
+
+    def stop(self):
+        """Stop serving and write a last snapshot."""
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._write_snapshot()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
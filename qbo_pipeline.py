@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_pipeline / overlap disk and cpu work when a batch of QBO files is processed
+
+process_QBO reads, rewrites and writes one file after another so the disk (or the
+network drive) sits idle while transactions are rewritten and the cpu sits idle while
+files are read. The pipeline runs three stages at once:
+
+    reader  ──read queue──▶  transform threads  ──write queue──▶  writer
+    (prefetches files)       (process_qbo_lines)                 (atomic write, remove original)
+
+Both queues are bounded so a fast reader can only get `prefetch` files ahead of the
+transform stage and memory stays bounded however many files are waiting.
+Each stage records busy time and item counts; run_pipeline logs the utilization of
+every stage when the batch is done so the bottleneck is obvious.
+
+Files are written in the order they finish. Two downloads producing the same
+<DTEND>_<ACCTID>.qbo name overwrite each other just like they do in process_QBO.
+"""
+
+import queue
+import threading
+import time
+from loguru import logger
+
+import QBOfix2024_2
+from QBOfix2024_2 import output_path, read_base_file, remove_original, rewrite_qbo_lines, store_transactions, write_validated
+from qbo_metrics import ERRORS, arrival_time, file_converted
+from structured_log import file_size
+
+DEFAULT_PREFETCH = 4
+_DONE = object()  # end of stream marker passed down the queues
+
+
+class StageMetrics:
+    """Busy time and throughput of one pipeline stage."""
+
+    def __init__(self, name, threads=1):
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.xacts = 0
+        self.nbytes = 0
+        self.busy = 0.0  # seconds spent working, summed over the stage threads
+        self.waiting = 0.0  # seconds blocked on a full output queue (backpressure)
+        self._lock = threading.Lock()
+
+    def record(self, busy, waiting=0.0, xacts=0, nbytes=0):
+        with self._lock:
+            self.items += 1
+            self.busy += busy
+            self.waiting += waiting
+            self.xacts += xacts
+            self.nbytes += nbytes
+
+    def utilization(self, elapsed):
+        """Fraction of the available thread time this stage spent working."""
+        if elapsed <= 0:
+            return 0.0
+        return self.busy / (elapsed * self.threads)
+
+    def summary(self, elapsed):
+        return (
+            f"{self.name}: {self.items} files, {self.xacts} transactions, {self.nbytes} bytes, "
+            f"busy {self.busy:.3f}s, blocked {self.waiting:.3f}s, "
+            f"utilization {self.utilization(elapsed):.0%} of {self.threads} thread(s)"
+        )
+
+
+def _timed_put(q, item):
+    """Put item on q and return the seconds spent waiting for room."""
+    start = time.perf_counter()
+    q.put(item)
+    return time.perf_counter() - start
+
+
+def _reader(names, read_queue, metrics, transform_threads):
+    try:
+        for file_pathobj in names:
+            start = time.perf_counter()
+            records = read_base_file(file_pathobj)
+            busy = time.perf_counter() - start
+            waiting = _timed_put(read_queue, (file_pathobj, records))
+            metrics.record(busy, waiting, nbytes=file_size(file_pathobj) or 0)
+    finally:
+        for _ in range(transform_threads):
+            read_queue.put(_DONE)
+
+
+def _transformer(read_queue, write_queue, metrics):
+    try:
+        while True:
+            item = read_queue.get()
+            if item is _DONE:
+                return
+            file_pathobj, records = item
+            if not records:
+                logger.warning(f"Nothing read from {file_pathobj.name}, leaving it in place.")
+                continue
+            start = time.perf_counter()
+            result = rewrite_qbo_lines(records)
+            busy = time.perf_counter() - start
+            if result is None:
+                logger.error(f"Could not process {file_pathobj.name}, leaving it in place.")
+                ERRORS.inc(stage="rewrite")
+                continue
+            waiting = _timed_put(write_queue, (file_pathobj, result))
+            metrics.record(busy, waiting, xacts=result[0].count("<STMTTRN>\n"))
+    finally:
+        write_queue.put(_DONE)
+
+
+def _write(item, metrics, failures):
+    file_pathobj, (modified_qbo, file_date, acct_number) = item
+    start = time.perf_counter()
+    clean_output_file = output_path(file_date, acct_number)
+    arrived = arrival_time(file_pathobj)
+    try:
+        write_validated(clean_output_file, modified_qbo)
+    except Exception as e:
+        logger.error(f"Error in writing {clean_output_file}")
+        logger.warning(str(e))
+        ERRORS.inc(stage="write")
+        failures.append(file_pathobj)
+        return
+    file_converted("qbo", modified_qbo.count("<STMTTRN>\n"), arrived)
+    logger.info(f"File {clean_output_file} contents written successfully.")
+    store_transactions(modified_qbo, clean_output_file.name)
+    if not remove_original(file_pathobj):
+        failures.append(file_pathobj)
+    metrics.record(time.perf_counter() - start, nbytes=file_size(clean_output_file) or 0)
+
+
+def _writer(write_queue, metrics, transform_threads, failures):
+    """Write every item of write_queue until each transform thread is done. A file that fails
+    is counted in failures; the writer carries on so the transform threads never block on a
+    full queue nobody empties.
+    """
+    finished = 0
+    while finished < transform_threads:
+        item = write_queue.get()
+        if item is _DONE:
+            finished += 1
+            continue
+        try:
+            _write(item, metrics, failures)
+        except Exception:
+            logger.exception(f"Could not complete {item[0].name}, leaving it in place.")
+            failures.append(item[0])
+
+
+@logger.catch
+def run_pipeline(names, transform_threads=2, prefetch=DEFAULT_PREFETCH):
+    """Process the QBO files in names with overlapping read, transform and write stages.
+    Return a dict of StageMetrics keyed by stage name ("read", "transform", "write").
+    """
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    metrics = {
+        "read": StageMetrics("read"),
+        "transform": StageMetrics("transform", transform_threads),
+        "write": StageMetrics("write"),
+    }
+    failures = []
+    threads = [threading.Thread(target=_reader, args=(names, read_queue, metrics["read"], transform_threads), name="qbo-reader")]
+    threads += [
+        threading.Thread(target=_transformer, args=(read_queue, write_queue, metrics["transform"]), name=f"qbo-transform-{i}")
+        for i in range(transform_threads)
+    ]
+    threads.append(threading.Thread(target=_writer, args=(write_queue, metrics["write"], transform_threads, failures), name="qbo-writer"))
+    logger.info(f"Pipeline processing {len(names)} files with {transform_threads} transform threads "
+                f"and {QBOfix2024_2.QBO_WORKERS} worker processes per file.")
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for stage_metrics in metrics.values():
+        logger.info(stage_metrics.summary(elapsed))
+    logger.info(f"Pipeline finished {metrics['write'].items} of {len(names)} files in {elapsed:.3f}s.")
+    if failures:
+        logger.warning(f"{len(failures)} files could not be completed: {', '.join(p.name for p in failures)}")
+    return metrics
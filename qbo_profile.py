@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_profile / where the time and memory of a conversion go
+
+    python qbo.py fix --profile
+    python qbo.py csv2qbo --pstats csv2qbo.pstats --stacks csv2qbo.folded
+
+While profiling() is active every structured_log.stage() also records its wall time,
+CPU time, transactions and peak traced memory. When the command ends a table is logged
+with one line per stage:
+
+    read_base_file / read_csv_file   read the download
+    rewrite_QBO                      parse the QBO blocks and clean the transactions
+    write_QBO                        serialize, validate and write the modified file (with
+                                     --checkpoint also parse and clean it, streamed together)
+    scan_csv_bounds                  find the first and last posted csv rows
+    check_running_balance            check the running balance chain of the csv
+    convert_csv_file                 read, parse, clean, serialize and write the csv conversion,
+                                     streamed together so they can not be timed apart
+    remove_original                  delete the bank download
+    modify_QBO / process_QBO         the enclosing stages of one file / of the batch
+
+Stages nest, the time of an inner stage is also counted in the outer one. Peak memory
+is measured with tracemalloc, which slows Python code down noticeably; compare wall
+times of profiled runs with each other, not with normal runs. Memory allocated by other
+threads at the same time (qbo_pipeline) is included in the peak of the running stage.
+
+--pstats also writes a cProfile file for `python -m pstats` or snakeviz and --stacks
+writes collapsed stacks, sampled every SAMPLE_INTERVAL seconds, for flamegraph.pl or
+speedscope. Nothing here is imported or run unless one of these options is given; a
+disabled stage() only checks that structured_log.PROFILER is None.
+"""
+
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from loguru import logger
+
+import structured_log
+
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+MAX_STACK_DEPTH = 200
+
+StageReport = namedtuple("StageReport", "event calls wall cpu xacts peak")
+
+
+def rate(report):
+    """Transactions per second of wall time, None when not known."""
+    if not report.xacts or report.wall <= 0:
+        return None
+    return report.xacts / report.wall
+
+
+def _traced_peak():
+    return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+
+
+class StageProfiler:
+    """Totals of the stages entered and left by structured_log.stage() while profiling."""
+
+    def __init__(self):
+        self.totals = {}  # event -> [calls, wall, cpu, xacts, peak]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def enter(self, event):
+        stack = self._stack()
+        if stack:
+            # the peak is reset for the inner stage, keep what the outer one reached so far
+            stack[-1][3] = max(stack[-1][3], _traced_peak())
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        stack.append([event, time.perf_counter(), time.process_time(), 0])
+
+    def exit(self, event, fields):
+        stack = self._stack()
+        if not stack or stack[-1][0] != event:
+            return
+        _, wall_start, cpu_start, peak = stack.pop()
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        peak = max(peak, _traced_peak())
+        if stack:
+            stack[-1][3] = max(stack[-1][3], peak)
+        with self._lock:
+            total = self.totals.setdefault(event, [0, 0.0, 0.0, 0, 0])
+            total[0] += 1
+            total[1] += wall
+            total[2] += cpu
+            total[3] += fields.get("xacts") or 0
+            total[4] = max(total[4], peak)
+
+    def report(self):
+        """A StageReport per stage in the order the stages first finished."""
+        with self._lock:
+            return [StageReport(event, *total) for event, total in self.totals.items()]
+
+
+class StackSampler:
+    """Count the call stacks of one thread every interval seconds from a background thread.
+    Works the same on every platform, unlike signal based samplers.
+    """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None and len(names) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def write(self, path):
+        """Write the samples in the collapsed format: frames joined by ";", a space and the count."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def log_report(reports):
+    logger.info(f"{'stage':<24}{'calls':>7}{'wall s':>10}{'cpu s':>10}{'xacts':>10}{'xacts/s':>12}{'peak MB':>10}")
+    for report in reports:
+        xacts_per_second = rate(report)
+        logger.info(
+            f"{report.event:<24}{report.calls:>7}{report.wall:>10.3f}{report.cpu:>10.3f}{report.xacts:>10}"
+            f"{'-' if xacts_per_second is None else f'{xacts_per_second:.0f}':>12}{report.peak / 2**20:>10.1f}"
+        )
+
+
+@contextmanager
+def profiling(stats_path=None, stacks_path=None):
+    """Profile the stages run inside the block and log a table of them at the end, even when
+    the block exits the interpreter. Also write a cProfile file to stats_path and collapsed
+    stacks to stacks_path when given. Yields the StageProfiler.
+    """
+    profiler = StageProfiler()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    sampler = StackSampler().start() if stacks_path else None
+    cprofile = cProfile.Profile() if stats_path else None
+    structured_log.PROFILER = profiler
+    if cprofile is not None:
+        cprofile.enable()
+    try:
+        yield profiler
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+        structured_log.PROFILER = None
+        if sampler is not None:
+            sampler.stop()
+        if started_tracing:
+            tracemalloc.stop()
+        log_report(profiler.report())
+        if cprofile is not None:
+            cprofile.dump_stats(stats_path)
+            logger.info(f"cProfile statistics written to {stats_path}")
+        if sampler is not None:
+            sampler.write(stacks_path)
+            logger.info(f"{sum(sampler.stacks.values())} stack samples written to {stacks_path}")
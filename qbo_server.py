@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_server / long running conversion daemon
+
+Running a converter per file pays interpreter startup, dependency imports and
+logger setup every time. The daemon does that once and keeps the compiled
+BAD_TEXT rules, the hashids encoder and the log sinks warm between requests.
+
+Start it with:
+    python qbo.py serve                         (http://127.0.0.1:8765)
+    python qbo.py serve --socket /tmp/qbo.sock  (unix socket)
+
+Endpoints:
+    POST /fix       body is a QBO file, reply is the rewritten QBO file
+    POST /csv2qbo   body is a schwab.com csv download, reply is the QBO file
+    GET  /health    reply "ok"
+    GET  /metrics   counters of the conversions in the Prometheus text format (see qbo_metrics.py)
+
+The charset of the request body is taken from the Content-Type header
+(default cp1252 like the QBO files themselves) and the reply uses the same charset. Successful replies carry
+X-QBO-Filename (the <DTEND>_<ACCTID>.qbo name the batch tools would use) and
+X-QBO-Transactions headers.
+
+Example:
+    curl --data-binary @download.qbo http://127.0.0.1:8765/fix -o fixed.qbo
+    curl --unix-socket /tmp/qbo.sock --data-binary @download.csv http://localhost/csv2qbo
+"""
+
+import io
+import os
+import socketserver
+import stat
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from loguru import logger
+
+from qbo_api import DEFAULT_ENCODING, ConversionError, convert_csv, fix_qbo
+from qbo_metrics import ERRORS, PROMETHEUS_CONTENT_TYPE, REGISTRY, file_converted
+from QBOfix2024_2 import defineLoggers
+from structured_log import stage
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+QBO_CONTENT_TYPE = "application/vnd.intu.qbo"
+
+
+def fix_payload(payload, charset):
+    """Rewrite the bytes of a QBO file. Return (qbo bytes, output file name, transaction count)."""
+    out = io.BytesIO()
+    result = fix_qbo(io.BytesIO(payload), out, encoding=charset)
+    return out.getvalue(), result.file_name, result.xacts
+
+
+def csv2qbo_payload(payload, charset):
+    """Convert the bytes of a csv download. Return (qbo bytes, output file name, transaction count)."""
+    out = io.BytesIO()
+    result = convert_csv(io.BytesIO(payload), out, encoding=charset)
+    return out.getvalue(), result.file_name, result.xacts
+
+
+ROUTES = {
+    "/fix": fix_payload,
+    "/csv2qbo": csv2qbo_payload,
+}
+SOURCES = {"/fix": "qbo", "/csv2qbo": "csv"}  # metrics source label of each route
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    server_version = "qbo-serve/1.0"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, b"ok\n", "text/plain")
+        elif self.path == "/metrics":
+            self._reply(200, REGISTRY.render().encode(), PROMETHEUS_CONTENT_TYPE)
+        else:
+            self._reply(404, b"not found\n", "text/plain")
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        route = ROUTES.get(path)
+        if route is None:
+            self._reply(404, b"not found\n", "text/plain")
+            return
+        charset = self.headers.get_content_charset() or DEFAULT_ENCODING
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._reply(411, b"Content-Length required\n", "text/plain")
+            return
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            self._reply(400, b"bad Content-Length\n", "text/plain")
+            return
+        payload = self.rfile.read(length)
+        failure = None
+        with stage("serve_" + path.strip("/"), nbytes=length) as fields:
+            try:
+                body, fname, xacts = route(payload, charset)
+            except (LookupError, ConversionError) as e:
+                logger.warning(f"Bad request to {path}: {e}")
+                failure = 400, f"{e}\n".encode()
+            except Exception as e:
+                logger.exception(e)
+                failure = 500, b"conversion failed\n"
+            else:
+                fields["file"], fields["xacts"] = fname, xacts
+            if failure:
+                ERRORS.inc(stage="serve")
+                fields["ok"] = False
+        if failure:  # replied once the stage is logged
+            self._reply(*failure, "text/plain")
+            return
+        file_converted(SOURCES[path], xacts)
+        self._reply(200, body, f"{QBO_CONTENT_TYPE}; charset={charset}",
+                    {"X-QBO-Filename": fname, "X-QBO-Transactions": str(xacts)})
+
+    def _reply(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """Create the conversion server on a unix socket if socket_path is given, else on host:port.
+    A socket left at socket_path by a previous run is replaced, FileExistsError if anything else is there.
+    """
+    if socket_path:
+        try:
+            mode = os.lstat(socket_path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError(f"{socket_path} exists and is not a socket")
+            os.remove(socket_path)  # left over from a previous run
+        return ThreadingUnixHTTPServer(socket_path, ConversionHandler)
+    return ThreadingHTTPServer((host, port), ConversionHandler)
+
+
+@logger.catch
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, structured=False):
+    defineLoggers("qbo_server", structured)
+    server = make_server(host, port, socket_path)
+    where = socket_path or "http://%s:%s" % server.server_address[:2]
+    logger.info(f"Program Start. Serving conversions on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user.")
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+    logger.info("Program End.")
+    return
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_split / cut a QBO file that is too large for QuickBooks into importable parts
+
+QuickBooks Desktop times out on very large Web Connect files. split_file() writes the
+transactions of one QBO file to <name>_part01.qbo, <name>_part02.qbo ... in the output
+directory. A part ends before the transaction that would take it over any of the limits:
+
+    max_xacts   transactions per part
+    max_bytes   characters of transactions per part
+    max_days    days between the first and the last DTPOSTED of a part
+
+Every part gets a copy of the signon and account header with DTSTART/DTEND set to the
+dates of its own transactions (the first part keeps the original DTSTART, the last part
+the original DTEND) and the closing boilerplate, ledger balance included, of the original.
+
+The file is read twice: once by qbo_merge.scan_qbo_file for the header and footer, then
+block by block through iter_qbo_blocks. The transactions of the part being built are held
+in a SpooledTemporaryFile which moves to disk past SPOOL_MAX_SIZE, so memory stays
+constant whatever the size of the file and of the parts.
+"""
+
+import tempfile
+from itertools import chain
+from pathlib import Path
+from loguru import logger
+
+import QBOfix2024_2
+from QBOfix2024_2 import QBO_FILE_EXT, extract_transaction_details, iter_qbo_blocks, write_qbo_file
+from qbo_merge import day_number, replace_tag, scan_qbo_file
+
+SPOOL_MAX_SIZE = 1 << 20  # 1 MiB of transactions kept in memory before spooling to disk
+
+
+class _Part:
+    """Transactions of the part being built."""
+
+    def __init__(self):
+        self.body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+")
+        self.xacts = 0
+        self.nbytes = 0
+        self.first_posted = self.last_posted = ""
+
+    def fits(self, posted, nbytes, max_xacts, max_bytes, max_days):
+        if not self.xacts:
+            return True  # a part always takes at least one transaction
+        if max_xacts and self.xacts + 1 > max_xacts:
+            return False
+        if max_bytes and self.nbytes + nbytes > max_bytes:
+            return False
+        if max_days is not None and abs(day_number(posted) - day_number(self.first_posted)) > max_days:
+            return False
+        return True
+
+    def add(self, block, posted, nbytes):
+        self.body.writelines(block)
+        self.xacts += 1
+        self.nbytes += nbytes
+        if posted:
+            self.first_posted = min(self.first_posted or posted, posted)
+            self.last_posted = max(self.last_posted, posted)
+
+    def lines(self):
+        self.body.seek(0)
+        return self.body
+
+
+def part_path(source, number):
+    """Return the Path of part number of source in the output directory."""
+    return Path(QBOfix2024_2.QBO_MODIFIED_DIRECTORY, f"{Path(source).stem}_part{number:02d}{QBO_FILE_EXT}")
+
+
+@logger.catch
+def split_file(source, max_xacts=None, max_bytes=None, max_days=None):
+    """Split the QBO file source into parts within the given limits. Return the list of part Paths."""
+    if not (max_xacts or max_bytes or max_days is not None):
+        raise ValueError("at least one of max_xacts, max_bytes or max_days is required")
+    scan = scan_qbo_file(source)
+    parts = []
+
+    def write_part(part, last):
+        dtstart = scan.dtstart if not parts else part.first_posted or scan.dtstart
+        dtend = scan.dtend if last else part.last_posted or scan.dtend
+        header = replace_tag(replace_tag(scan.header, "<DTSTART>", dtstart), "<DTEND>", dtend)
+        path = part_path(source, len(parts) + 1)
+        with part.body:
+            write_qbo_file(path, chain(header, part.lines(), scan.footer))
+        logger.info(f"{path.name}: {part.xacts} transactions {dtstart}-{dtend}, {part.nbytes} bytes")
+        parts.append(path)
+
+    part = _Part()
+    with open(source) as f:
+        for is_transaction, block in iter_qbo_blocks(f):
+            if not is_transaction:
+                continue
+            posted = extract_transaction_details(block).get("DTPOSTED", "")
+            nbytes = sum(len(line) for line in block)
+            if not part.fits(posted, nbytes, max_xacts, max_bytes, max_days):
+                write_part(part, last=False)
+                part = _Part()
+            part.add(block, posted, nbytes)
+    write_part(part, last=True)
+    logger.info(f"{Path(source).name}: {scan.xacts} transactions split into {len(parts)} parts.")
+    return parts
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_store / keep every rewritten transaction in a SQLite database
+
+The QBO files are written and forgotten, so a question like "all GM FINANCIAL payments
+in 2022" used to mean parsing every file again. With a store configured the fixer and
+csv2qbo also add the transactions they write to a SQLite database:
+
+    python qbo.py fix --store qbo.sqlite3
+    python qbo.py ingest --store qbo.sqlite3 D:/Users/Conrad/Documents   (history)
+    python qbo.py query --store qbo.sqlite3 --payee "GM FINANCIAL" --since 20220101 --until 20221231
+
+The database runs in WAL mode so queries do not block the writers. Rows are inserted
+with executemany in batches of BATCH_SIZE inside one transaction per batch. A unique
+index on (account, fitid) makes ingesting the same file twice harmless. Dates, amounts
+and payee names are indexed; amounts are stored as integer cents so they compare exactly.
+ingest opens the store in bulk mode: into an empty store it loads without the date, amount
+and payee indexes and builds them once when the store is closed. A store that already
+holds transactions keeps its indexes, others may be querying it.
+"""
+
+import sqlite3
+from collections import namedtuple
+from decimal import Decimal
+from pathlib import Path
+from loguru import logger
+
+from QBOfix2024_2 import QBO_FILE_EXT, iter_qbo_blocks
+from qbo_util import amount_cents, tag_values
+
+DEFAULT_STORE_PATH = "qbo_transactions.sqlite3"
+BATCH_SIZE = 20000
+
+TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    account TEXT NOT NULL,
+    fitid TEXT NOT NULL,
+    trntype TEXT,
+    dtposted TEXT,
+    amount_cents INTEGER,
+    name TEXT,
+    memo TEXT,
+    source TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_account_fitid ON transactions (account, fitid);
+"""
+
+# maintained while inserting they cost four times the insert itself, bulk loads rebuild them once at the end
+SECONDARY_INDEXES = """
+CREATE INDEX IF NOT EXISTS transactions_dtposted ON transactions (dtposted);
+CREATE INDEX IF NOT EXISTS transactions_amount ON transactions (amount_cents);
+CREATE INDEX IF NOT EXISTS transactions_name ON transactions (name);
+"""
+
+INSERT = """INSERT OR IGNORE INTO transactions
+    (account, fitid, trntype, dtposted, amount_cents, name, memo, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
+StoredTransaction = namedtuple("StoredTransaction", "account fitid trntype dtposted amount name memo source")
+
+
+class TransactionStore:
+    """SQLite database of transactions. Use as a context manager or call close()."""
+
+    def __init__(self, path=DEFAULT_STORE_PATH, bulk=False):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, safe in WAL mode
+        self.connection.execute("PRAGMA cache_size=-65536")  # 64 MiB
+        self.connection.executescript(TABLE_SCHEMA)
+        self.bulk = bulk and self.connection.execute("SELECT 1 FROM transactions LIMIT 1").fetchone() is None
+        if self.bulk:
+            for name in ("transactions_dtposted", "transactions_amount", "transactions_name"):
+                self.connection.execute(f"DROP INDEX IF EXISTS {name}")
+        else:
+            self.connection.executescript(SECONDARY_INDEXES)  # also the ones an interrupted bulk load left out
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, account, details, source=None):
+        """Queue one transaction given as a dict of QBO tag:value.
+        One without a FITID is skipped, the unique index would take it for any other one.
+        """
+        fitid = details.get("FITID", "")
+        if not fitid:
+            logger.warning(f"Not storing a transaction of {source} without a FITID: "
+                           f"{details.get('DTPOSTED', '')[:8]} {details.get('TRNAMT')} {details.get('NAME')}")
+            return
+        self._pending.append((
+            account,
+            fitid,
+            details.get("TRNTYPE"),
+            details.get("DTPOSTED", "")[:8],
+            amount_cents(details.get("TRNAMT")),
+            details.get("NAME"),
+            details.get("MEMO"),
+            source,
+        ))
+        if len(self._pending) >= BATCH_SIZE:
+            self.flush()
+
+    def add_qbo_lines(self, lines, source=None):
+        """Queue the transactions of the lines of a QBO file. Return how many were read."""
+        found = {}
+        count = 0
+        for is_transaction, block in iter_qbo_blocks(lines, found):
+            if is_transaction:
+                self.add(found["ACCTID"], tag_values(block), source)
+                count += 1
+        return count
+
+    def flush(self):
+        if self._pending:
+            with self.connection:
+                self.connection.executemany(INSERT, self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        if self.bulk:
+            self.connection.executescript(SECONDARY_INDEXES)
+            self.connection.execute("ANALYZE")  # statistics for the query planner to choose between the indexes
+        self.connection.close()
+
+    def query(self, account=None, payee=None, since=None, until=None, min_amount=None, max_amount=None, limit=None):
+        """Return the StoredTransactions matching every given filter, oldest first.
+        payee matches the start of the name; since/until are YYYYMMDD dates, both included;
+        amounts are in dollars.
+        """
+        sql, parameters = select_sql(account, payee, since, until, min_amount, max_amount, limit)
+        self.flush()
+        return [
+            StoredTransaction(*row[:4], None if row[4] is None else Decimal(row[4]) / 100, *row[5:])
+            for row in self.connection.execute(sql, parameters)
+        ]
+
+
+def select_sql(account=None, payee=None, since=None, until=None, min_amount=None, max_amount=None, limit=None):
+    """(sql, parameters) of TransactionStore.query."""
+    clauses, parameters = [], []
+    if account:
+        clauses.append("account = ?")
+        parameters.append(account)
+    if payee:
+        # a range on the name lets the index do the prefix match
+        clauses.append("name >= ? AND name < ?")
+        parameters += [payee, payee + "\uffff"]
+    if since:
+        clauses.append("dtposted >= ?")
+        parameters.append(since)
+    if until:
+        clauses.append("dtposted <= ?")
+        parameters.append(until)
+    if min_amount is not None:
+        clauses.append("amount_cents >= ?")
+        parameters.append(amount_cents(min_amount))
+    if max_amount is not None:
+        clauses.append("amount_cents <= ?")
+        parameters.append(amount_cents(max_amount))
+    sql = "SELECT account, fitid, trntype, dtposted, amount_cents, name, memo, source FROM transactions"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY dtposted, rowid"
+    if limit:
+        sql += " LIMIT ?"
+        parameters.append(limit)
+    return sql, parameters
+
+
+def store_qbo_lines(path, lines, source=None):
+    """Add the transactions of the lines of a QBO file to the store at path.
+    A failing store is logged and never stops the conversion that called it.
+    """
+    try:
+        with TransactionStore(path) as store:
+            count = store.add_qbo_lines(lines, source)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not add {source} to the transaction store {path}: {e}")
+        return None
+    logger.info(f"{count} transactions of {source} added to the transaction store {path}.")
+    return count
+
+
+@logger.catch
+def ingest_paths(path, sources):
+    """Add the QBO files in sources, directories are searched recursively, to the store at path.
+    Return the number of transactions read.
+    """
+    count = 0
+    with TransactionStore(path, bulk=True) as store:
+        for source in sources:
+            source = Path(source)
+            files = sorted(source.rglob(f"*{QBO_FILE_EXT}")) if source.is_dir() else [source]
+            for qbo_file in files:
+                with open(qbo_file) as f:
+                    count += store.add_qbo_lines(f, qbo_file.name)
+    logger.info(f"{count} transactions read into {path}.")
+    return count
@@ -0,0 +1,49 @@
+# qbo_test_data.py
+"""Statements and hypothesis strategies shared by the test modules."""
+
+from pathlib import Path
+
+from hypothesis import strategies as st
+
+import csv2qbo
+from QBOfix2024_2 import BAD_TEXT
+
+SAMPLE_QBO = Path(__file__).with_name("input_reference.qbo.bak")
+
+SCHWAB_CSV = """Transactions  for Checking account XXXXXX-090258
+Date,Type,Check #,Description,Withdrawal (-),Deposit (+),RunningBalance
+Pending Transactions
+03/02/2019,ACH,,PENDING THING,$5.00,,
+Posted Transactions
+03/01/2019,ACH,,POS DB  WALMART  1234,$747.06,,"$2,500.00"
+02/28/2019,DEPOSIT,,DEPOSIT,, $590.15,"$3,247.06"
+02/28/2019,CHECK,1001,CHECK,$124.02,,"$2,656.91"
+02/27/2019,ACH,,AC-BANK OF AMERICA -ONLINE PMT,$10.00,,"$2,780.93"
+"""
+
+
+def schwab_rows(size):
+    """The csv rows of a schwab.com download with size posted transactions."""
+    rows = [[csv2qbo.schwabHeader], list(csv2qbo.SCHWAB_HEADER), [csv2qbo.POSTED_MARKER]]
+    for i in range(size):
+        date = f"{1 + i // 28 % 12:02d}/{1 + i % 28:02d}/2019"  # a year of dates, as many as a real statement
+        if i % 3:
+            rows.append([date, "ACH", "", f"POS DB  STORE {i}", f"${i % 500}.{i % 100:02d}", "", "$1,000.00"])
+        else:
+            rows.append([date, "DEPOSIT", "", "DEPOSIT", "", f"${i % 900}.25", "$1,000.00"])
+    return rows
+
+
+@st.composite
+def memo_text(draw, text=st.text(min_size=1)):
+    """text with one of the BAD_TEXT patterns inserted."""
+    base_text = draw(text)
+    bad_text = draw(st.sampled_from(BAD_TEXT))
+    return base_text + bad_text + base_text
+
+
+# lines of well formed and malformed QBO files
+qbo_line = st.sampled_from([
+    "<STMTTRN>\n", "</STMTTRN>\n", "  <STMTTRN>\n", "<NAME>CHECK PAID\n", "<MEMO>CHECK PAID\n",
+    "<MEMO>POS DB  GROCERY\n", "<DTEND>20220701\n", "<ACCTID>4552001301\n", "<TRNAMT>-1.00\n", "OFXHEADER:100\n", "\n",
+])
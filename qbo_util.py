@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_util / small helpers shared by the converters, the store and the rules
+
+Kept free of the modules that use them so importing one helper does not pull in a
+database or a converter.
+"""
+
+from decimal import Decimal, InvalidOperation
+
+WRITE_CHUNK_SIZE = 1 << 20  # characters joined into each write
+
+
+def amount_cents(trnamt):
+    """Integer cents of a TRNAMT value, None if it is not a number."""
+    try:
+        return int((Decimal(trnamt) * 100).to_integral_value())
+    except (InvalidOperation, TypeError):
+        return None
+
+
+def tag_values(transaction_lines):
+    """tag:value of the lines of a QBO transaction, values stripped. Lines without a tag are skipped."""
+    details = {}
+    for line in transaction_lines:
+        # Split the line at the first occurrence of ">" to separate the tag from its value
+        if line.startswith("<"):
+            tag, sep, value = line[1:].partition(">")
+            if sep:
+                details[tag] = value.strip()
+    return details
+
+
+def chunked(pieces, chunk_size=WRITE_CHUNK_SIZE):
+    """Join the strings of pieces into strings of about chunk_size characters.
+    Pieces end with a newline, so each chunk holds whole lines.
+    """
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
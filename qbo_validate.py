@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+""" qbo_validate / check a statement while it is being written
+
+A StatementValidator watches the lines of a QBO file go by on their way to the output
+file, so checking costs no second read. When the file is written report() returns a
+dict, saved as JSON in LOGS/validation/<file name>.json, with these checks:
+
+    date_out_of_range   DTPOSTED outside DTSTART..DTEND
+    duplicate_fitid     FITID already used earlier in the file
+    name_too_long       NAME longer than QuickBooks' NAME_LIMIT characters
+    bad_amount          TRNAMT that is not a number
+    balance             sum of TRNAMT == LEDGERBAL - opening balance
+
+The balance can only be checked when the opening balance is known, as it is for csv2qbo
+downloads carrying the bank's running balance; otherwise "balance_ok" is null.
+
+Writers pass their output through qbo_util.chunked() first so the validator and the file
+see a few large strings instead of one call per line.
+"""
+
+import json
+import os
+from decimal import Decimal, InvalidOperation
+from loguru import logger
+
+from structured_log import LOG_DIRECTORY
+
+NAME_LIMIT = 32
+MAX_EXAMPLES = 20  # FITIDs listed per failed check, the count is always complete
+REPORT_DIRECTORY = os.path.join(LOG_DIRECTORY, "validation")
+CHECKS = ("date_out_of_range", "duplicate_fitid", "name_too_long", "bad_amount")
+
+
+def parse_amount(text):
+    """Decimal of a TRNAMT or BALAMT value, None if it is not a number."""
+    try:
+        return Decimal(text)
+    except (InvalidOperation, TypeError):
+        return None
+
+
+class StatementValidator:
+    """Checks of one QBO file fed line by line."""
+
+    def __init__(self, source):
+        self.source = source
+        self.dtstart = self.dtend = None
+        self.ledger_balance = None
+        self.xacts = 0
+        self.total = Decimal(0)
+        self.failures = {check: 0 for check in CHECKS}
+        self.examples = {check: [] for check in CHECKS}
+        self._fitids = set()
+        self._transaction = None  # tag:value of the transaction being read
+        self._balance = None  # "LEDGERBAL" or "AVAILBAL" while inside one
+
+    def watch(self, pieces):
+        """Yield pieces (lines or blocks of lines) unchanged while feeding them to the validator."""
+        for piece in pieces:
+            for line in piece.splitlines():
+                self.feed(line)
+            yield piece
+
+    def feed(self, line):
+        line = line.strip()
+        if not line.startswith("<"):
+            return
+        tag, _, value = line[1:].partition(">")
+        if self._transaction is not None:
+            if tag == "/STMTTRN":
+                self._check_transaction(self._transaction)
+                self._transaction = None
+            else:
+                self._transaction[tag] = value.strip()
+        elif tag == "STMTTRN":
+            self._transaction = {}
+        elif tag == "DTSTART" and self.dtstart is None:
+            self.dtstart = value.strip()[:8]
+        elif tag == "DTEND" and self.dtend is None:
+            self.dtend = value.strip()[:8]
+        elif tag in ("LEDGERBAL", "AVAILBAL"):
+            self._balance = tag
+        elif tag in ("/LEDGERBAL", "/AVAILBAL"):
+            self._balance = None
+        elif tag == "BALAMT" and self._balance == "LEDGERBAL":
+            self.ledger_balance = parse_amount(value.strip())
+
+    def _fail(self, check, fitid):
+        self.failures[check] += 1
+        if len(self.examples[check]) < MAX_EXAMPLES:
+            self.examples[check].append(fitid)
+
+    def _check_transaction(self, details):
+        self.xacts += 1
+        fitid = details.get("FITID", "")
+        amount = parse_amount(details.get("TRNAMT"))
+        if amount is None:
+            self._fail("bad_amount", fitid)
+        else:
+            self.total += amount
+        posted = details.get("DTPOSTED", "")[:8]
+        if (self.dtstart and posted < self.dtstart) or (self.dtend and posted > self.dtend):
+            self._fail("date_out_of_range", fitid)
+        if fitid in self._fitids:
+            self._fail("duplicate_fitid", fitid)
+        self._fitids.add(fitid)
+        if len(details.get("NAME", "")) > NAME_LIMIT:
+            self._fail("name_too_long", fitid)
+
+    def report(self, opening_balance=None):
+        """The result of every check as a dict ready for json."""
+        balance_ok = None
+        if opening_balance is not None and self.ledger_balance is not None:
+            balance_ok = opening_balance + self.total == self.ledger_balance
+        return {
+            "file": self.source,
+            "ok": not any(self.failures.values()) and balance_ok is not False,
+            "xacts": self.xacts,
+            "dtstart": self.dtstart,
+            "dtend": self.dtend,
+            "total": str(self.total),
+            "opening_balance": None if opening_balance is None else str(opening_balance),
+            "ledger_balance": None if self.ledger_balance is None else str(self.ledger_balance),
+            "balance_ok": balance_ok,
+            "failures": self.failures,
+            "examples": {check: fitids for check, fitids in self.examples.items() if fitids},
+        }
+
+
+def save_report(report, directory=None):
+    """Write report as <directory>/<file>.json and log its outcome. Return the path written,
+    None if the report could not be written; that is only warned about, the statement itself
+    is fine.
+    """
+    directory = directory or REPORT_DIRECTORY
+    path = os.path.join(directory, report["file"] + ".json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        logger.warning(f"Could not save the validation report {path}: {e}")
+        path = None
+    if report["ok"]:
+        logger.info(f"{report['file']} validated: {report['xacts']} transactions, total {report['total']}.")
+    else:
+        failed = {check: count for check, count in report["failures"].items() if count}
+        if report["balance_ok"] is False:
+            failed["balance"] = f"{report['opening_balance']} + {report['total']} != {report['ledger_balance']}"
+        logger.warning(f"{report['file']} failed validation {failed}" + (f", see {path}" if path else ""))
+    return path
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+""" structured_log / optional JSON lines sink with per-stage timing events
+
+The free text loguru messages are meant for people. This module adds a second,
+machine readable stream so throughput can be aggregated across many runs without
+parsing log prose. Enable it with add_structured_sink() after the normal loggers
+are defined; wrap each stage of work in the stage() context manager.
+
+Each event is written as one JSON object per line to
+    ./LOGS/<program>_<YYYYMMDD>.jsonl
+
+Event schema (every key is always present, unknown values are null):
+    ts          ISO-8601 timestamp with UTC offset of the moment the stage finished
+    program     name of the running script e.g. "QBOfix2024_2.py"
+    event       stage name: "read_base_file", "rewrite_QBO", "write_QBO", "modify_QBO",
+                "process_QBO", "read_csv_file", "scan_csv_bounds", "check_running_balance",
+                "convert_csv_file", "remove_original", or "serve_fix" and "serve_csv2qbo" for
+                requests handled by qbo_server
+    file        file name (no directory) handled by the stage, or the directory for batch stages
+    bytes       size in bytes of the data the stage handled:
+                    read stages    -> size of the input file
+                    scan_csv_bounds, check_running_balance -> size of the csv file
+                    modify_QBO, write_QBO -> size of the output file written
+                    remove_original -> size of the file removed
+                    convert stages -> length of the QBO text produced
+                    serve stages   -> size of the request body
+                    process_QBO    -> total input bytes of every file in the batch
+    xacts       number of transactions handled by the stage
+    elapsed_ms  wall clock duration of the stage in milliseconds (float)
+    ok          false if the stage raised an exception or handled a failure and set
+                fields["ok"] = False, true otherwise
+
+Example aggregation:
+    events = [json.loads(line) for line in open("LOGS/QBOfix2024_2.py_20240301.jsonl")]
+    rate = sum(e["xacts"] for e in events if e["event"] == "modify_QBO") / (
+        sum(e["elapsed_ms"] for e in events if e["event"] == "modify_QBO") / 1000)
+
+Stages are also what qbo_profile.py measures when a command runs with --profile.
+"""
+
+import json
+import os
+import time
+import datetime as dt
+from contextlib import contextmanager
+from loguru import logger
+
+LOG_DIRECTORY = "./LOGS/"
+PROFILER = None  # a qbo_profile.StageProfiler while profiling
+
+
+def _is_stage_event(record):
+    """Only records produced by stage() carry the 'event' extra key."""
+    return "event" in record["extra"]
+
+
+def _json_formatter(program):
+    def formatter(record):
+        extra = record["extra"]
+        event = {
+            "ts": record["time"].isoformat(),
+            "program": program,
+            "event": extra["event"],
+            "file": extra.get("file"),
+            "bytes": extra.get("bytes"),
+            "xacts": extra.get("xacts"),
+            "elapsed_ms": extra.get("elapsed_ms"),
+            "ok": extra.get("ok", True),
+        }
+        # loguru treats the returned value as a format template so the json
+        # text is passed through the record instead of embedded with its braces
+        extra["_json"] = json.dumps(event)
+        return "{extra[_json]}\n"
+    return formatter
+
+
+def add_structured_sink(program, log_directory=LOG_DIRECTORY):
+    """Add a JSON lines sink receiving only stage events. Return the loguru handler id."""
+    os.makedirs(log_directory, exist_ok=True)
+    log_path = os.path.join(log_directory, f"{program}_{dt.datetime.now():%Y%m%d}.jsonl")
+    handler_id = logger.add(
+        log_path,
+        level="DEBUG",
+        format=_json_formatter(program),
+        filter=_is_stage_event,
+        encoding="utf8",
+        retention="10 days",
+    )
+    print(f"Structured stage events to {log_path}")
+    return handler_id
+
+
+def file_size(path):
+    """Return the size of path in bytes or None if it can not be determined."""
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+@contextmanager
+def stage(event, file=None, nbytes=None, xacts=None):
+    """Time the enclosed block and log it as a stage event.
+    The yielded dict may be updated inside the block, e.g. fields["xacts"] = count
+    once the number of transactions is known, or fields["ok"] = False when the block
+    handles a failure without raising.
+    """
+    fields = {"file": file, "bytes": nbytes, "xacts": xacts}
+    profiler = PROFILER
+    if profiler is not None:
+        profiler.enter(event)
+    start = time.perf_counter()
+    ok = True
+    try:
+        yield fields
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        ok = fields.pop("ok", True) and ok
+        if profiler is not None:
+            profiler.exit(event, fields)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+        logger.bind(event=event, elapsed_ms=elapsed_ms, ok=ok, **fields).debug(
+            f"stage {event}: file={fields['file']} bytes={fields['bytes']} "
+            f"xacts={fields['xacts']} elapsed={elapsed_ms}ms"
+        )
@@ -46,17 +46,7 @@ def test_preprocess_memo_special_characters(input_str):
     assert "  " not in result, "There should not be consecutive spaces"
     # Add more specific assertions here
 
-from hypothesis.strategies import composite
-
-@composite
-def memo_text(draw, text=st.text(min_size=1)):
-    # Generate a base text
-    base_text = draw(text)
-    # Optionally add a bad pattern
-    bad_text = draw(st.sampled_from(BAD_TEXT))
-    # Create a new text by inserting the bad pattern into the base text
-    new_text = base_text + bad_text + base_text
-    return new_text
+from qbo_test_data import memo_text
 
 @given(memo_text())
 def test_composite_preprocess_memo(input_str):
@@ -180,3 +170,22 @@ def test_process_qbo_lines_empty_input():
     assert qbo_file_date == '19700101', "Expected default qbo_file_date to be '19700101'"
     assert account_number == '42', "Expected default account_number to be '42'"
 
+
+
+from QBOfix2024_2 import iter_qbo_blocks, process_qbo_lines_parallel, _chunk_blocks, _process_blocks
+from qbo_test_data import SAMPLE_QBO, qbo_line
+
+@given(st.lists(qbo_line, max_size=40), st.integers(min_value=1, max_value=4))
+def test_chunked_blocks_match_serial_processing(lines, chunk_size):
+    # splitting at <STMTTRN> boundaries must not change a single line, even for malformed files
+    expected = process_qbo_lines(lines)
+    found = {}
+    chunked = []
+    for chunk in _chunk_blocks(iter_qbo_blocks(lines, found), chunk_size):
+        chunked.extend(_process_blocks(chunk))
+    assert (chunked, found['DTEND'], found['ACCTID']) == expected
+
+def test_process_qbo_lines_parallel_is_byte_identical():
+    lines = SAMPLE_QBO.read_text().splitlines(keepends=True) * 5
+    expected = process_qbo_lines(lines)
+    assert process_qbo_lines_parallel(lines, workers=2, chunk_size=100) == expected
@@ -0,0 +1,52 @@
+# test_amount_rules.py
+
+import json
+import pickle
+
+from hypothesis import given, strategies as st
+
+from QBOfix2024_2 import CleaningRules, process_transaction
+from amount_rules import AmountRuleIndex, applies_on, _rule_from_dict
+
+RULES = [
+    {"name": "Rent", "trntype": "CHECK", "amount": "-300.00", "days": [1, 2, 3]},
+    {"name": "Electric", "trntype": "DEBIT", "min": "-180", "max": "-60", "from": "20220101"},
+    {"name": "Small debit", "trntype": "DEBIT", "min": "-100", "max": "-90"},
+    {"name": "Payroll", "amount": "1520.75"},
+]
+
+
+def test_exact_range_and_date_windows():
+    index = AmountRuleIndex.from_dicts(RULES)
+    assert index.match("CHECK", "-300.00", "20220401") == "Rent"
+    assert index.match("CHECK", "-300", "20220415") is None  # not in the first days of the month
+    assert index.match("DEBIT", "-300.00", "20220401") is None  # wrong type
+    assert index.match("DEBIT", "-75.10", "20220505") == "Electric"
+    assert index.match("DEBIT", "-75.10", "20211231") is None  # before the rule starts
+    assert index.match("DEBIT", "-95.00", "20220505") == "Small debit"  # narrower range wins
+    assert index.match("CREDIT", "1520.75", "20220505") == "Payroll"  # any type
+    assert index.match("CREDIT", "not a number") is None
+
+
+@given(st.lists(st.tuples(st.integers(-500, 500), st.integers(0, 200), st.sampled_from(["DEBIT", "CHECK", None])),
+                max_size=40),
+       st.integers(-600, 600), st.sampled_from(["DEBIT", "CHECK", "CREDIT"]))
+def test_index_matches_linear_scan(ranges, cents, trntype):
+    rules = [{"name": f"rule{i}", "trntype": t, "min": low / 100, "max": (low + width) / 100}
+             for i, (low, width, t) in enumerate(ranges)]
+    parsed = [_rule_from_dict(rule, order) for order, rule in enumerate(rules)]
+    candidates = [r for r in parsed if r.trntype in (trntype, "*") and r.low <= cents <= r.high and applies_on(r, "")]
+    # a linear scan: the first exact rule, else the narrowest range listed first
+    expected = min(candidates, key=lambda r: (r.high != r.low, r.high - r.low, r.order), default=None)
+    found = AmountRuleIndex.from_dicts(rules).match(trntype, str(cents / 100))
+    assert found == (expected.name if expected else None)
+
+
+def test_rules_name_checks_and_pickle(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(RULES))
+    rules = pickle.loads(pickle.dumps(CleaningRules(amounts=AmountRuleIndex.load(path))))
+    check = ["<STMTTRN>\n", "<TRNTYPE>CHECK\n", "<DTPOSTED>20220402\n", "<TRNAMT>-300.00\n", "<FITID>1\n",
+             "<CHECKNUM>9017\n", "<NAME>CHECK PAID\n", "<MEMO>CHECK PAID\n", "</STMTTRN>\n"]
+    assert "<NAME>Rent\n" in process_transaction(check, rules)
+    assert "<NAME>9017\n" in process_transaction(check)
@@ -0,0 +1,125 @@
+# test_bank_profiles.py
+
+import csv
+import io
+import json
+
+import pytest
+
+import bank_profiles
+import csv2qbo
+from csv2qbo import RowFields, scan_csv_bounds, write_qbo_file
+from qbo_test_data import SCHWAB_CSV
+
+CREDIT_UNION = {
+    "name": "credit_union_checking",
+    "header": ["Posting Date", "Description", "Amount", "Check Number", "Balance"],
+    "columns": {"date": "Posting Date", "description": "Description", "amount": "Amount",
+                "check": "Check Number", "balance": "Balance"},
+    "decimal": ",",
+    "date_format": "%Y-%m-%d",
+    "newest_first": False,
+    "fi": {"org": "Credit Union", "fid": "777", "bank_id": "123456789", "account_id": "55501", "account_type": "CHECKING"},
+}
+
+CREDIT_UNION_CSV = """Account 55501
+Posting Date;Description;Amount;Check Number;Balance
+2019-02-27;OPENING DEPOSIT;1.100,50;;2.100,50
+2019-02-28;CHECK;-20,00;1001;2.080,50
+2019-03-01;POS GROCER;-5,25;;2.075,25
+"""
+
+
+@pytest.fixture(autouse=True)
+def registry(tmp_path, monkeypatch):
+    """Profiles registered by a test are forgotten after it."""
+    monkeypatch.setattr(bank_profiles, "_loaders", dict(bank_profiles._loaders))
+    monkeypatch.setattr(bank_profiles, "_profiles", None)
+
+
+@pytest.fixture
+def credit_union_csv(tmp_path):
+    profile_file = tmp_path / "credit_union.json"
+    profile_file.write_text(json.dumps(CREDIT_UNION))
+    bank_profiles.register_file(str(profile_file))
+    path = tmp_path / "export.csv"
+    path.write_text(CREDIT_UNION_CSV)
+    return str(path)
+
+
+def test_identify_schwab(tmp_path):
+    path = tmp_path / "download.csv"
+    path.write_text(SCHWAB_CSV)
+    profile, dialect = bank_profiles.identify(str(path))
+    assert profile is csv2qbo.SCHWAB_CHECKING
+    assert dialect.delimiter == ","
+
+
+def test_unknown_layout(tmp_path):
+    path = tmp_path / "other.csv"
+    path.write_text("When,What,How much\n01/01/2019,X,1.00\n")
+    assert bank_profiles.identify(str(path)) == (None, None)
+
+
+def test_json_profile_semicolons_oldest_first(credit_union_csv):
+    assert bank_profiles.names() == ["credit_union_checking", "schwab_checking"]
+    profile, dialect = bank_profiles.identify(credit_union_csv)
+    assert profile.name == "credit_union_checking" and dialect.delimiter == ";"
+    first, last = scan_csv_bounds(credit_union_csv, profile, dialect)
+    assert first[0] == "2019-02-27" and last[0] == "2019-03-01"
+    assert csv2qbo.check_running_balance(credit_union_csv, profile, dialect) == []
+    out = io.StringIO()
+    assert write_qbo_file(credit_union_csv, out, last, profile, dialect) == 3
+    qbo = out.getvalue()
+    assert "<ACCTID>55501\n" in qbo and "<ORG>Credit Union\n" in qbo
+    assert "<DTSTART>20190227\n<DTEND>20190301\n" in qbo
+    assert "<TRNTYPE>CHECK\n<DTPOSTED>20190228\n<TRNAMT>-20.00\n" in qbo
+    assert "<LEDGERBAL>\n<BALAMT>2075.25\n<DTASOF>20190301000000.000[-6:CST]\n" in qbo
+
+
+def test_get_named_profile(credit_union_csv):
+    assert bank_profiles.get("credit_union_checking").account_number == "55501"
+    with pytest.raises(KeyError):
+        bank_profiles.get("nobody")
+
+
+@pytest.mark.parametrize("sign, columns, row, expected", [
+    ("signed", {"date": "D", "description": "N", "amount": "A"}, ["01/02/2019", "X", "-1,234.50", ""],
+     RowFields("01/02/2019", "DEBIT", "", "X", "-1234.50", "")),
+    ("negated", {"date": "D", "description": "N", "amount": "A"}, ["01/02/2019", "X", "12.5", ""],
+     RowFields("01/02/2019", "DEBIT", "", "X", "-12.50", "")),
+    ("split", {"date": "D", "description": "N", "withdrawal": "A", "deposit": "B"}, ["01/02/2019", "X", "", "$3.00"],
+     RowFields("01/02/2019", "CREDIT", "", "X", "3.00", "")),
+    ("split", {"date": "D", "description": "N", "withdrawal": "A", "deposit": "B", "check": "C"},
+     ["01/02/2019", "X", "$0.07", "", " 42 "], RowFields("01/02/2019", "CHECK", "42", "X", "-0.07", "")),
+])
+def test_compile_row_mapper(sign, columns, row, expected):
+    assert bank_profiles.compile_row_mapper(("D", "N", "A", "B", "C"), columns, sign)(row) == expected
+
+
+def test_row_without_amount(credit_union_csv):
+    mapper = bank_profiles.compile_row_mapper(("D", "A"), {"date": "D", "amount": "A"})
+    assert mapper(["01/02/2019", ""]).amount is None
+    with pytest.raises(ValueError):
+        bank_profiles.compile_row_mapper(("D", "A"), {"date": "D", "amount": "A"}, "sideways")
+
+    with open(credit_union_csv, "a") as f:
+        f.write("2019-03-02;PENDING;;;2.075,25\n2019-03-03;POS GROCER;-1,00;;2.074,25\n")
+    profile, dialect = bank_profiles.identify(credit_union_csv)
+    assert csv2qbo.check_running_balance(credit_union_csv, profile, dialect) == []
+    with pytest.raises(ValueError):
+        csv2qbo.format_statement_block(mapper(["01/02/2019", ""]))
+
+
+def test_profiles_with_the_same_header_are_refused(tmp_path):
+    profile_file = tmp_path / "twins.json"
+    profile_file.write_text(json.dumps([CREDIT_UNION, dict(CREDIT_UNION, name="other_union")]))
+    bank_profiles.register_file(str(profile_file))
+    with pytest.raises(ValueError, match="other_union"):
+        bank_profiles.names()
+
+
+def test_sniff_falls_back_to_excel(tmp_path):
+    path = tmp_path / "one.csv"
+    path.write_text("x\n")
+    assert bank_profiles.sniff_dialect(str(path)) is csv.excel
@@ -0,0 +1,73 @@
+# test_complexity.py
+#
+# Each hot path is timed at geometrically increasing input sizes and the exponent k of
+# time ~ size**k is fitted on a log-log scale. A linear path gives k close to 1 (less for the
+# smallest sizes, where fixed costs dominate); an accidental list.pop(0) or string += in a loop
+# gives k close to 2. The sizes are kept small so the whole module runs in a few seconds.
+
+import math
+import timeit
+
+import pytest
+from loguru import logger
+
+import csv2qbo
+from QBOfix2024_2 import extract_transaction_details, preprocess_memo, process_qbo_lines
+from qbo_differential import random_statement
+from qbo_test_data import schwab_rows
+
+MAX_EXPONENT = 1.3  # clearly above linear, with room for timing noise
+SIZES = (500, 1000, 2000, 4000, 8000)
+REPEAT = 5
+QUIET_MODULES = ("QBOfix2024_2", "csv2qbo", "structured_log")
+
+
+@pytest.fixture(autouse=True, scope="module")
+def quiet():
+    """Logging would be timed along with the work."""
+    for module in QUIET_MODULES:
+        logger.disable(module)
+    yield
+    for module in QUIET_MODULES:
+        logger.enable(module)
+
+
+def scaling_exponent(function, make_input, sizes=SIZES, repeat=REPEAT):
+    """Least squares slope of log(best time of repeat calls of function) against log(size).
+    Inputs are built before timing; timeit switches the garbage collector off while timing.
+    """
+    points = []
+    for size in sizes:
+        argument = make_input(size)
+        seconds = min(timeit.repeat(lambda: function(argument), number=1, repeat=repeat))
+        points.append((math.log(size), math.log(max(seconds, 1e-9))))
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / sum((x - mean_x) ** 2 for x, _ in points)
+
+
+def long_memo(size):
+    words = ["POS DB ", "GROCERY", "  ", "DEBIT 1234", "ACH ", "BILL PAYMT", "OUTLET", "PURCHASE "]
+    return " ".join(words[i % len(words)] for i in range(size))
+
+
+def tag_lines(size):
+    return [f"<TAG{i}>value {i}\n" for i in range(size)]
+
+
+@pytest.mark.parametrize("name, function, make_input", [
+    ("process_qbo_lines", process_qbo_lines, random_statement),
+    ("preprocess_memo", preprocess_memo, long_memo),
+    ("extract_transaction_details", extract_transaction_details, tag_lines),
+    ("convert_csv_file", lambda rows: csv2qbo.convert_csv_file(rows, csv2qbo.bad_text), schwab_rows),
+])
+def test_hot_path_is_not_superlinear(name, function, make_input):
+    exponent = scaling_exponent(function, make_input)
+    assert exponent < MAX_EXPONENT, f"{name} time grows as size**{exponent:.2f}"
+
+
+def test_quadratic_behavior_is_detected():
+    def positions(items):
+        return [items.index(item) for item in items]
+
+    assert scaling_exponent(positions, lambda size: list(range(size // 2)), repeat=3) > 1.6
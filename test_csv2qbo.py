@@ -0,0 +1,159 @@
+# test_csv2qbo.py
+
+import io
+import json
+import sys
+
+import pytest
+from hypothesis import given, strategies as st
+
+import csv2qbo
+from csv2qbo import convert_csv_file, read_csv_file, scan_csv_bounds, write_qbo_file
+from qbo_test_data import SCHWAB_CSV
+
+
+@pytest.fixture
+def schwab_csv(tmp_path):
+    path = tmp_path / "download.csv"
+    path.write_text(SCHWAB_CSV)
+    return str(path)
+
+
+def test_streaming_matches_list_conversion(schwab_csv):
+    expected = "".join(convert_csv_file(read_csv_file(schwab_csv), csv2qbo.bad_text))
+    most_recent, least_recent = scan_csv_bounds(schwab_csv)
+    out = io.StringIO()
+    assert write_qbo_file(schwab_csv, out, least_recent) == 4
+    assert out.getvalue() == expected
+    assert "<DTSTART>20190227\n<DTEND>20190301\n" in expected
+
+
+def test_repeated_dates_are_parsed_once(schwab_csv):
+    csv2qbo.qbo_date.cache_clear()
+    write_qbo_file(schwab_csv, io.StringIO(), scan_csv_bounds(schwab_csv)[1])
+    info = csv2qbo.qbo_date.cache_info()
+    assert info.misses == 3 and info.hits > 0  # 03/01, 02/28 twice and 02/27
+    assert csv2qbo.Fix_date("02/28/2019") == csv2qbo.date_fixer(csv2qbo.SCHWAB_CHECKING)("02/28/2019") == "20190228"
+    assert csv2qbo.qbo_date(" 2019-02-28", "%Y-%m-%d") == "20190228"
+
+
+def test_failed_remove_exits(schwab_csv, tmp_path, monkeypatch):
+    monkeypatch.setattr(csv2qbo, "basedirectory", str(tmp_path))
+    monkeypatch.setattr(csv2qbo, "outputdirectory", str(tmp_path / "out") + "/")
+    (tmp_path / "out").mkdir()
+    monkeypatch.setattr(csv2qbo.logger, "configure", lambda **kwargs: None)  # keep the test log handlers
+    monkeypatch.setattr(csv2qbo.logger, "add", lambda *args, **kwargs: None)
+
+    def remove(path):
+        raise PermissionError(13, "Permission denied", path)
+
+    monkeypatch.setattr(csv2qbo.os, "remove", remove)
+    errors = csv2qbo.ERRORS.value(stage="remove")
+    with pytest.raises(SystemExit) as exit_info:
+        csv2qbo.Main()
+    assert exit_info.value.code == 1 and csv2qbo.ERRORS.value(stage="remove") == errors + 1
+
+
+def test_scan_csv_bounds(schwab_csv):
+    most_recent, least_recent = scan_csv_bounds(schwab_csv)
+    assert most_recent[0] == "03/01/2019"
+    assert least_recent[:4] == ["02/27/2019", "ACH", "", "AC-BANK OF AMERICA -ONLINE PMT"]
+
+
+def test_last_row_longer_than_read_block(tmp_path):
+    path = tmp_path / "long.csv"
+    path.write_text("Posted Transactions\n01/02/2019,ACH,,X,$1.00,,$2.00\n01/01/2019,ACH,,%s,$1.00,,$3.00\n\n" % ("Y" * 100))
+    assert csv2qbo._last_csv_row(str(path), block_size=16)[3] == "Y" * 100
+
+
+def test_no_posted_transactions(tmp_path):
+    path = tmp_path / "pending.csv"
+    path.write_text("Pending Transactions\n03/02/2019,ACH,,PENDING THING,$5.00,,\n")
+    assert scan_csv_bounds(str(path)) == (None, None)
+    out = io.StringIO()
+    assert write_qbo_file(str(path), out, None) == 0
+    assert out.getvalue() == csv2qbo.qbo_file_header
+
+
+def test_real_balances_and_validation_report(schwab_csv, validation_reports):
+    most_recent, least_recent = scan_csv_bounds(schwab_csv)
+    out = io.StringIO()
+    write_qbo_file(schwab_csv, out, least_recent)
+    assert "<LEDGERBAL>\n<BALAMT>2500.00\n<DTASOF>20190301000000.000[-6:CST]\n" in out.getvalue()
+    assert "<AVAILBAL>\n<BALAMT>2500.00\n" in out.getvalue()
+    report = json.loads((validation_reports / "download.csv.json").read_text())
+    assert report["ok"] and report["balance_ok"] is True
+    assert (report["opening_balance"], report["total"], report["ledger_balance"]) == ("2790.93", "-290.93", "2500.00")
+
+
+def test_running_balance_chain(schwab_csv, tmp_path):
+    assert csv2qbo.check_running_balance(schwab_csv) == []
+    lines = SCHWAB_CSV.splitlines()
+    missing = tmp_path / "missing.csv"
+    missing.write_text("\n".join(lines[:6] + lines[7:]) + "\n")  # drop the 02/28 deposit
+    assert csv2qbo.check_running_balance(str(missing)) == [csv2qbo.BalanceBreak(6, 190985, 250000)]
+    swapped = tmp_path / "swapped.csv"
+    swapped.write_text("\n".join(lines[:6] + [lines[7], lines[6]] + lines[8:]) + "\n")
+    assert [b.line for b in csv2qbo.check_running_balance(str(swapped))] == [6, 7, 8]
+
+
+BALANCE_CHAINS = [  # rows most recent first
+    ([], [], []),
+    ([-500, 300, None], [1000, 1500, 1200], []),
+    ([-500, 300, None], [1000, 1600, 1200], [0, 1]),
+    ([-500, 300, 100], [1000, None, 1200], []),  # pairs holding an unknown value are skipped
+    ([None, 300, 100], [1000, 1600, 1200], [1]),
+]
+
+
+@pytest.mark.parametrize("amounts, balances, expected", BALANCE_CHAINS)
+def test_balance_breaks_without_numpy(monkeypatch, amounts, balances, expected):
+    monkeypatch.setitem(sys.modules, "numpy", None)  # import numpy raises ImportError
+    assert csv2qbo.balance_breaks(amounts, balances) == expected
+
+
+def test_balance_breaks_with_numpy_match_pure_python():
+    pytest.importorskip("numpy")
+
+    @given(st.lists(st.tuples(st.one_of(st.none(), st.integers(-10**9, 10**9)),
+                              st.one_of(st.none(), st.integers(-10**9, 10**9))), max_size=30))
+    def check(pairs):
+        amounts, balances = [a for a, _ in pairs], [b for _, b in pairs]
+        with_numpy = csv2qbo.balance_breaks(amounts, balances)
+        sys.modules["numpy"], saved = None, sys.modules["numpy"]
+        try:
+            assert csv2qbo.balance_breaks(amounts, balances) == with_numpy
+        finally:
+            sys.modules["numpy"] = saved
+
+    check()
+
+
+@pytest.mark.parametrize("row, trnamt, fitid", [
+    (["02/28/2019", "DEPOSIT", "", "DEPOSIT", "", " $590.15", "$3,247.06"], "590.15", "20190228$590.15oQx1zDEPOSIT"),
+    (["03/01/2019", "ACH", "", "POS DB  WALMART  1234", " $747.06", "", "$2,500.00"], "-747.06", "20190301-$747.06g5vplDB WALMART"),
+    (["03/01/2019", "ACH", "", "POS DB  WALMART  1234", "$747.06", "", "$2,500.00"], "-747.06", "20190301-747.06g5vplDB WALMART "),
+])
+def test_spaced_amounts_keep_their_fitid(row, trnamt, fitid):
+    # the FITIDs the converter has always written, QuickBooks would import the rows again if they changed
+    block = "".join(csv2qbo.create_qbo_statement_block(row))
+    assert f"<TRNAMT>{trnamt}\n<FITID>{fitid}\n" in block
+
+
+@pytest.mark.parametrize("text, cents", [
+    ("$2,500.00", 250000), (" $590.15", 59015), ("-$5.00", -500), ("($5.5)", -550), ("$.07", 7), ("", None), ("$1.234", None),
+])
+def test_money_cents(text, cents):
+    assert csv2qbo.money_cents(text) == cents
+
+
+@pytest.mark.parametrize("fields", [
+    csv2qbo.RowFields("02/28/2019", "CHECK", "1001", "CHECK  {0}", "-124.02", "$2,656.91"),
+    csv2qbo.RowFields("03/01/2019", "DEBIT", "", "POS DB  WALMART  1234", "-747.06", ""),
+])
+def test_statement_block_template(fields):
+    block = csv2qbo.format_statement_block(fields)
+    assert "".join(csv2qbo.qbo_statement_block(fields)) == block
+    assert block.startswith("<STMTTRN>\n<TRNTYPE>" + fields.trntype + "\n") and block.endswith("</STMTTRN>\n")
+    assert ("<CHECKNUM>1001\n" in block) == (fields.trntype == "CHECK")
+    assert "<MEMO>" + csv2qbo.Clean_Line(csv2qbo.bad_text, fields.description) + "\n" in block
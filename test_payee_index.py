@@ -0,0 +1,74 @@
+# test_payee_index.py
+
+import pickle
+import random
+import string
+
+from hypothesis import given, strategies as st
+
+import payee_index
+from QBOfix2024_2 import CleaningRules, process_qbo_lines
+from payee_index import PayeeIndex, build_from_store, payee_key, trigrams
+from qbo_store import TransactionStore
+from qbo_test_data import SAMPLE_QBO
+
+
+def test_variants_resolve_to_one_payee():
+    index = PayeeIndex.from_history([
+        ("GM FINANCIAL BillPay 05140050876", 3),
+        ("GM FINANCIAL BillPay 05140050707", 1),
+        ("TOUCHTUNES TT PAYMENT 220701 673", 2),
+        ("TOUCHTUNES TT PAYMENT 220401 673", 1),
+        ("DEPOSIT", 11),
+    ])
+    assert len(index) == 3
+    assert index.resolve("GM FINANCIAL BillPay 05140050264") == "GM FINANCIAL BillPay"
+    assert index.resolve("TOUCHTUNES TT PAYMNT 220603") == "TOUCHTUNES TT PAYMENT"
+    assert index.resolve("HARBOR FREIGHT TOOLS") == "HARBOR FREIGHT TOOLS"  # unknown, unchanged
+    assert index.resolve("12345") == "12345"
+
+
+@given(st.text(alphabet=string.ascii_uppercase + " ", min_size=1, max_size=30), st.lists(
+    st.text(alphabet=string.ascii_uppercase + " ", min_size=1, max_size=30), max_size=30))
+def test_lookup_matches_brute_force(name, known):
+    index = PayeeIndex(threshold=0.5)
+    for payee in known:
+        index.add(payee)
+    query = trigrams(payee_key(name))
+    best = 0.0
+    for key in index.keys:
+        grams = trigrams(key)
+        best = max(best, len(query & grams) / len(query | grams))
+    found = index.lookup(name)
+    if best >= 0.5 and payee_key(name):
+        assert found is not None and abs(found[1] - best) < 1e-9
+    else:
+        assert found is None
+
+
+def test_lookup_scores_few_of_many_payees(tmp_path, monkeypatch):
+    rng = random.Random(7)
+    index = PayeeIndex()
+    for _ in range(30000):
+        index.add(" ".join("".join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 9))) for _ in range(3)))
+    index.save(tmp_path / "payees.json")
+    index = PayeeIndex.load(tmp_path / "payees.json")
+    names = [name[:-2] + "XY" for name in rng.sample(index.names, 1000)]
+    scored = []  # lookup takes the trigrams of the query and of each candidate it scores
+    monkeypatch.setattr(payee_index, "trigrams", lambda key: scored.append(key) or trigrams(key))
+    for name in names:
+        assert index.lookup(name) is not None
+    assert (len(scored) - len(names)) / len(names) < 20
+
+
+def test_rules_with_payees_rename_and_pickle(tmp_path):
+    lines = SAMPLE_QBO.read_text().splitlines(keepends=True)
+    plain, _, _ = process_qbo_lines(lines)
+    with TransactionStore(tmp_path / "store.sqlite3") as store:
+        store.add_qbo_lines(plain)
+    build_from_store(tmp_path / "store.sqlite3", tmp_path / "payees.json")
+    rules = pickle.loads(pickle.dumps(CleaningRules(payees=PayeeIndex.load(tmp_path / "payees.json"))))
+    resolved, _, _ = process_qbo_lines(lines, rules)
+    names = {line for line in resolved if line.startswith("<NAME>")}
+    assert "<NAME>GM FINANCIAL BillPay\n" in names
+    assert len(names) < len({line for line in plain if line.startswith("<NAME>")})
@@ -0,0 +1,65 @@
+# test_qbo.py
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from qbo import build_parser, main, HEAVY_MODULES, STARTUP_BUDGET_MS
+
+QBO_SCRIPT = str(Path(__file__).with_name("qbo.py"))
+
+
+def importtime(*args):
+    """Run qbo.py under -X importtime and return {top level module: cumulative microseconds}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", QBO_SCRIPT, *args],
+        capture_output=True, text=True, check=True,
+    )
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line.split("|")
+        imports[package.strip()] = (int(cumulative), package.startswith(" ") and not package.startswith("  "))
+    return imports
+
+
+@pytest.mark.parametrize("args", [["--help"], ["fix", "--help"], ["csv2qbo", "--help"]])
+def test_help_does_not_import_heavy_dependencies(args):
+    imports = importtime(*args)
+    for module in HEAVY_MODULES:
+        assert module not in imports, f"{module} imported at startup"
+
+
+def test_startup_within_budget():
+    imports = importtime("--help")
+    # site is interpreter startup and not part of the qbo command
+    total_us = sum(us for name, (us, top_level) in imports.items() if top_level and name != "site")
+    assert total_us < STARTUP_BUDGET_MS * 1000
+
+
+REQUIRED_ARGUMENTS = {
+    "fetch": ["--email", "me@example.com"],
+    "merge": ["a.qbo"],
+    "split": ["a.qbo"],
+    "ingest": ["a.qbo"],
+    "archive": ["archive"],
+    "catalog": ["."],
+    "backfill": [".", "--output-dir", "out"],
+}
+
+
+def test_subcommands_are_registered():
+    parser = build_parser()
+    for command in ("fix", "csv2qbo", "watch", "fetch", "serve", "merge", "split", "ingest", "query", "payees", "compare",
+                    "archive", "catalog", "backfill"):
+        args = parser.parse_args([command] + REQUIRED_ARGUMENTS.get(command, []))
+        assert args.command == command
+        assert callable(args.func)
+
+
+def test_compare_refuses_an_unknown_engine(capsys):
+    assert main(["compare", "--engine", "bogus", "--xacts", "5"]) == 2
+    assert "bogus" in capsys.readouterr().err
@@ -0,0 +1,83 @@
+# test_qbo_api.py
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from QBOfix2024_2 import CleaningRules, process_qbo_lines
+from qbo_api import ConversionError, convert_csv, fix_qbo
+from qbo_test_data import SAMPLE_QBO, SCHWAB_CSV
+
+
+def expected_fix():
+    with open(SAMPLE_QBO) as f:
+        lines, _, _ = process_qbo_lines(f.readlines())
+    return "".join(lines)
+
+
+def test_fix_qbo_binary_streams():
+    out = io.BytesIO()
+    result = fix_qbo(io.BytesIO(SAMPLE_QBO.read_bytes()), out)
+    assert out.getvalue().decode("cp1252") == expected_fix()
+    assert result.file_name == "20220701_4552001301.qbo"
+    assert result.xacts == 116
+
+
+def test_fix_qbo_text_streams_and_custom_rules():
+    out = io.StringIO()
+    fix_qbo(io.StringIO(SAMPLE_QBO.read_text()), out, CleaningRules(bad_text=["TOUCHTUNES"]))
+    assert "TOUCHTUNES" not in out.getvalue().split("<NAME>", 2)[1]
+
+
+def test_fix_qbo_leaves_caller_streams_open():
+    src, dst = io.BytesIO(SAMPLE_QBO.read_bytes()), io.BytesIO()
+    fix_qbo(src, dst)
+    assert not src.closed and not dst.closed
+
+
+@pytest.mark.parametrize("make_stream", [
+    lambda: io.BytesIO(SCHWAB_CSV.encode()),
+    lambda: io.StringIO(SCHWAB_CSV),
+])
+def test_convert_csv_streams(make_stream):
+    out = io.StringIO()
+    result = convert_csv(make_stream(), out)
+    text = out.getvalue()
+    assert "<DTSTART>20190227\n<DTEND>20190301\n" in text
+    assert text.count("<STMTTRN>") == result.xacts == 4
+    assert result.file_date == "20190301"
+
+
+def test_convert_csv_open_file(tmp_path):
+    path = tmp_path / "download.csv"
+    path.write_text(SCHWAB_CSV)
+    with open(path) as text_file, open(path, "rb") as binary_file:
+        text_out, binary_out = io.StringIO(), io.BytesIO()
+        convert_csv(text_file, text_out)
+        convert_csv(binary_file, binary_out)
+    assert text_out.getvalue() == binary_out.getvalue().decode()
+
+
+def test_convert_csv_error():
+    with pytest.raises(ConversionError):
+        convert_csv(io.StringIO("Posted Transactions\nnot a date,ACH\n"), io.StringIO())
+
+
+def test_concurrent_conversions_do_not_share_state():
+    payload = SAMPLE_QBO.read_bytes()
+
+    def fix_once(_):
+        out = io.BytesIO()
+        fix_qbo(io.BytesIO(payload), out)
+        return out.getvalue()
+
+    def convert_once(i):
+        out = io.StringIO()
+        csv_text = SCHWAB_CSV.replace("03/01/2019", f"03/{i % 28 + 1:02d}/2019")
+        return convert_csv(io.StringIO(csv_text), out).file_date, i
+
+    with ThreadPoolExecutor(8) as pool:
+        assert len(set(pool.map(fix_once, range(16)))) == 1
+        for file_date, i in pool.map(convert_once, range(32)):
+            assert file_date == f"201903{i % 28 + 1:02d}"
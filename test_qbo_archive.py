@@ -0,0 +1,92 @@
+# test_qbo_archive.py
+
+import gzip
+
+import pytest
+
+import QBOfix2024_2
+import csv2qbo
+from qbo_archive import OriginalArchive, archive_original, qbo_header_summary, reprocess
+from qbo_test_data import SAMPLE_QBO, SCHWAB_CSV
+
+
+@pytest.fixture
+def download(tmp_path):
+    (tmp_path / "download").mkdir()
+    path = tmp_path / "download" / "download.qbo"
+    path.write_text(SAMPLE_QBO.read_text())
+    return path
+
+
+def test_fixer_archives_the_original_and_reprocessing_matches(tmp_path, monkeypatch, download):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    monkeypatch.setattr(QBOfix2024_2, "QBO_ARCHIVE_DIRECTORY", tmp_path / "archive")
+    original = download.read_bytes()
+    QBOfix2024_2.modify_QBO(QBOfix2024_2.read_base_file(download), download)
+    assert not download.exists()
+    [written] = tmp_path.glob("*.qbo")
+
+    archive = OriginalArchive(tmp_path / "archive")
+    [entry] = archive.entries()
+    account, dtstart, dtend = qbo_header_summary(original.decode().splitlines())
+    assert (entry.name, entry.kind, entry.account, entry.dtstart, entry.dtend) == ("download.qbo", "qbo", account, dtstart, dtend)
+    assert entry.size == len(original) and entry.stored < entry.size
+    with archive.open_binary(entry) as f:
+        assert f.read() == original
+
+    assert reprocess(tmp_path / "archive", tmp_path / "again") == [tmp_path / "again" / written.name]
+    assert (tmp_path / "again" / written.name).read_bytes() == written.read_bytes()
+
+
+def test_identical_downloads_are_stored_once(tmp_path, download):
+    archive = OriginalArchive(tmp_path / "archive")
+    first = archive.add(download)
+    assert archive.add(download) == first
+    renamed = download.with_name("download (1).qbo")
+    renamed.write_bytes(download.read_bytes())
+    second = archive.add(renamed)
+    assert second.sha256 == first.sha256 and second.name == "download (1).qbo"
+    assert [entry.name for entry in archive.entries()] == ["download.qbo", "download (1).qbo"]
+    assert len(list((tmp_path / "archive" / "objects").rglob("*.gz"))) == 1
+    with archive.open(second) as f:
+        assert f.read() == download.read_text()
+
+
+def test_entries_filter_on_account_and_dates(tmp_path, download):
+    archive = OriginalArchive(tmp_path / "archive")
+    entry = archive.add(download)
+    assert archive.entries(account=entry.account) == [entry]
+    assert archive.entries(account="0") == []
+    assert archive.entries(since=entry.dtstart[:8], until=entry.dtend[:8]) == [entry]
+    assert archive.entries(since=entry.dtstart[:8], until=entry.dtstart[:8]) == [entry]  # overlapping is enough
+    assert archive.entries(since="29990101") == [] and archive.entries(until="19000101") == []
+    assert archive.entries(kind="csv") == []
+
+
+def test_csv_original_is_indexed_from_its_conversion(tmp_path):
+    path = tmp_path / "download.csv"
+    path.write_text(SCHWAB_CSV)
+    first, last = csv2qbo.scan_csv_bounds(str(path))
+    converted = tmp_path / csv2qbo.output_name(csv2qbo.SCHWAB_CHECKING, first, last)
+    with open(converted, "w") as f:
+        csv2qbo.write_qbo_file(str(path), f, last)
+    entry = archive_original(tmp_path / "archive", path, converted)
+    assert (entry.kind, entry.account, entry.dtend[:8]) == ("csv", "440024090258", "20190301")
+    [output] = reprocess(tmp_path / "archive", tmp_path / "again")
+    assert output.name == converted.name and output.read_bytes() == converted.read_bytes()
+
+
+def test_download_that_can_not_be_archived_is_kept(tmp_path, download):
+    (tmp_path / "archive").write_text("not a directory")
+    QBOfix2024_2.QBO_ARCHIVE_DIRECTORY, saved = tmp_path / "archive", QBOfix2024_2.QBO_ARCHIVE_DIRECTORY
+    try:
+        assert QBOfix2024_2.remove_original(download) is False
+    finally:
+        QBOfix2024_2.QBO_ARCHIVE_DIRECTORY = saved
+    assert download.exists()
+
+
+def test_objects_are_plain_gzip(tmp_path, download):
+    entry = OriginalArchive(tmp_path / "archive", codec="gzip").add(download)
+    path = OriginalArchive(tmp_path / "archive").object_path(entry.sha256, "gzip")
+    assert gzip.decompress(path.read_bytes()) == download.read_bytes()
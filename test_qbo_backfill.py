@@ -0,0 +1,130 @@
+# test_qbo_backfill.py
+
+import csv
+import os
+
+import pytest
+
+import QBOfix2024_2
+import qbo_backfill
+from QBOfix2024_2 import BAD_TEXT, CleaningRules, process_qbo_lines
+from qbo_backfill import MANIFEST_NAME, Manifest, backfill, convert_one
+from qbo_differential import StatementTransaction, statement_lines
+from qbo_test_data import schwab_rows
+
+
+def statement(memos, account, dtend):
+    return "".join(statement_lines([
+        StatementTransaction("DEBIT", dtend, "-1.00", f"{account}{i}", str(i), None, str(i), memo)
+        for i, memo in enumerate(memos)
+    ], account=account, dtstart=dtend[:6] + "01", dtend=dtend))
+
+
+@pytest.fixture
+def history(tmp_path):
+    source = tmp_path / "statements"
+    for year, memos in (("2021", ["POS DB GROCERY", "CKCD 1234 OUTLET"]), ("2022", ["POS DB GROCERY", "OUTLET"])):
+        (source / year / "checking").mkdir(parents=True)
+        (source / year / "checking" / "download.qbo").write_text(statement(memos, "4552001301", f"{year}0630"))
+    (source / "2022" / "savings").mkdir()
+    (source / "2022" / "savings" / "download.qbo").write_text(statement(["TRANSFER SAVINGS"], "9990001", "20220630"))
+    with open(source / "2019.csv", "w", newline="") as f:
+        csv.writer(f).writerows(schwab_rows(30))
+    return source
+
+
+def converted(summary):
+    return summary.converted, summary.skipped, summary.failed
+
+
+def test_backfill_converts_the_tree_once(history, tmp_path):
+    output = tmp_path / "backfill"
+    assert converted(backfill(history, output, workers=2)) == (4, 0, 0)
+    source = history / "2021" / "checking" / "download.qbo"
+    expected, _, _ = process_qbo_lines(source.read_text().splitlines(keepends=True))
+    assert (output / "2021" / "checking" / "20210630_4552001301.qbo").read_text() == "".join(expected)
+    assert (output / "2022" / "savings" / "20220630_9990001.qbo").exists()
+    assert len(list(output.glob("*.qbo"))) == 1  # the csv download
+
+    assert converted(backfill(history, output, workers=2)) == (0, 4, 0)
+    os.utime(source, ns=(0, 10 ** 9))  # touched, same bytes
+    assert converted(backfill(history, output, workers=2)) == (0, 4, 0)
+    source.write_text(source.read_text().replace("OUTLET", "OUTLET STORE"))
+    assert converted(backfill(history, output, workers=2)) == (1, 3, 0)
+    entries = Manifest(output / MANIFEST_NAME).entries
+    assert sorted(entries[str(source)].matched) == ["CKCD ", "POS DB "]
+
+
+def test_filters_on_account_and_dates(history, tmp_path):
+    assert converted(backfill(history, tmp_path / "a", account="9990001", workers=1)) == (1, 0, 0)
+    assert converted(backfill(history, tmp_path / "b", since="20220101", workers=1)) == (2, 0, 0)
+    assert converted(backfill(history, tmp_path / "c", until="20191231", workers=1)) == (1, 0, 0)
+
+
+def test_rule_change_converts_only_the_affected_files(history, tmp_path):
+    output = tmp_path / "backfill"
+    backfill(history, output, workers=2)
+    before = {path: path.read_text() for path in output.rglob("*.qbo")}
+
+    removed = [item for item in BAD_TEXT if item != "CKCD "]  # only the 2021 statement has one
+    assert converted(backfill(history, output, workers=2, bad_text=removed)) == (1, 3, 0)
+    changed = [path for path in output.rglob("*.qbo") if path.read_text() != before[path]]
+    assert changed == [output / "2021" / "checking" / "20210630_4552001301.qbo"]
+
+    added = removed + ["SAVINGS"]  # only in the savings statement
+    assert converted(backfill(history, output, workers=2, bad_text=added)) == (1, 3, 0)
+    assert converted(backfill(history, output, workers=2, bad_text=added + ["NOWHERE"])) == (0, 4, 0)
+    assert converted(backfill(history, output, workers=2, bad_text=list(reversed(added)))) == (3, 1, 0)  # not the csv
+    assert converted(backfill(history, output, workers=2, bad_text=added, force=True)) == (4, 0, 0)
+
+
+def test_failed_file_is_retried(history, tmp_path):
+    broken = history / "2022" / "broken.csv"
+    with open(broken, "w", newline="") as f:
+        csv.writer(f).writerows(schwab_rows(3)[:3] + [["not a date", "ACH", "", "X", "$1.00", "", "$1.00"]])
+    output = tmp_path / "backfill"
+    assert converted(backfill(history, output, workers=2)) == (4, 0, 1)
+    assert not list(output.rglob("*.tmp"))
+    broken.unlink()
+    assert converted(backfill(history, output, workers=2)) == (0, 4, 0)
+
+
+def test_inputs_converting_into_the_same_name_keep_their_own_output(tmp_path):
+    source, output = tmp_path / "statements", tmp_path / "backfill"
+    source.mkdir()
+    (source / "a.qbo").write_text(statement(["POS DB GROCERY"], "4552001301", "20220630"))
+    (source / "b.qbo").write_text(statement(["OUTLET"], "4552001301", "20220630"))
+    assert converted(backfill(source, output, workers=2)) == (2, 0, 0)
+    first, second = output / "20220630_4552001301.qbo", output / "20220630_4552001301_b_qbo.qbo"
+    assert "GROCERY" in first.read_text() and "OUTLET" in second.read_text()
+    entries = Manifest(output / MANIFEST_NAME).entries
+    assert [entries[str(source / name)].outputs for name in ("a.qbo", "b.qbo")] == [[str(first)], [str(second)]]
+
+    (source / "b.qbo").write_text(statement(["OUTLET STORE"], "4552001301", "20220630"))
+    (source / "a.qbo").unlink()  # b's reconversion may still not take a's output
+    assert converted(backfill(source, output, workers=2)) == (1, 0, 0)
+    assert "GROCERY" in first.read_text() and "OUTLET STORE" in second.read_text()
+    assert not list(output.glob("*.tmp"))
+
+
+@pytest.fixture
+def worker_rules(monkeypatch):
+    """The rules _init_worker sets up in a worker process, for convert_one run in this one."""
+    monkeypatch.setattr(qbo_backfill, "_worker_rules", (BAD_TEXT, CleaningRules(BAD_TEXT)))
+
+
+def test_failed_qbo_write_leaves_nothing_behind(history, tmp_path, monkeypatch, worker_rules):
+    def full_disk(path, lines):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(QBOfix2024_2, "write_qbo_file", full_disk)
+    output = tmp_path / "backfill"
+    sha256, temporary_path, _, error = convert_one(str(history / "2022" / "savings" / "download.qbo"), "qbo", str(output))
+    assert temporary_path is None and "No space left" in error
+    assert list(output.iterdir()) == []
+
+
+def test_qbo_outputs_are_validated(history, tmp_path, worker_rules, validation_reports):
+    _, temporary_path, _, error = convert_one(str(history / "2022" / "savings" / "download.qbo"), "qbo", str(tmp_path))
+    assert error is None and temporary_path.name == "20220630_9990001.qbo"
+    assert (validation_reports / "20220630_9990001.qbo.json").exists()
@@ -0,0 +1,98 @@
+# test_qbo_catalog.py
+
+import csv
+import os
+import time
+
+import pytest
+
+import qbo_catalog
+from QBOfix2024_2 import iter_qbo_blocks
+from qbo_archive import qbo_header_summary
+from qbo_catalog import CATALOG_NAME, catalog, count_bytes, select
+from qbo_differential import random_statement
+from qbo_test_data import schwab_rows
+
+STATEMENTS = 2000
+
+
+@pytest.fixture
+def statements(tmp_path):
+    (tmp_path / "2022").mkdir()
+    qbo = tmp_path / "2022" / "20220701_4552001301.qbo"
+    qbo.write_text("".join(random_statement(300, seed=3)))
+    with open(tmp_path / "download.csv", "w", newline="") as f:
+        csv.writer(f).writerows(schwab_rows(250))
+    (tmp_path / "notes.txt").write_text("not a statement")
+    return tmp_path
+
+
+def test_catalog_matches_full_parsing(statements):
+    entries = {os.path.basename(entry.path): entry for entry in catalog(statements, recursive=True)}
+    assert sorted(entries) == ["20220701_4552001301.qbo", "download.csv"]
+
+    qbo = entries["20220701_4552001301.qbo"]
+    with open(qbo.path) as f:
+        lines = f.readlines()
+    found = {}
+    for _ in iter_qbo_blocks(lines, found):
+        pass
+    account, dtstart, dtend = qbo_header_summary(lines)
+    assert (qbo.kind, qbo.account, qbo.dtstart, qbo.dtend, qbo.xacts) == ("qbo", account, dtstart, found["DTEND"], found["STMTTRN"])
+    assert qbo.complete and qbo.size == os.path.getsize(qbo.path)
+
+    schwab = entries["download.csv"]
+    assert (schwab.kind, schwab.bank, schwab.xacts, schwab.complete) == ("csv", "schwab_checking", 250, True)
+    assert (schwab.dtstart, schwab.dtend) == ("20190101", "20190926")  # the first and last rows
+
+
+def test_only_the_top_directory_without_recursive(statements):
+    assert [os.path.basename(entry.path) for entry in catalog(statements)] == ["download.csv"]
+
+
+def test_truncated_download_is_incomplete(tmp_path):
+    text = "".join(random_statement(50, seed=4))
+    (tmp_path / "cut.qbo").write_text(text[:len(text) // 2])
+    [entry] = catalog(tmp_path)
+    assert not entry.complete and 0 < entry.xacts < 50
+
+
+def test_repeat_run_reads_only_changed_files(tmp_path, monkeypatch):
+    text = "".join(random_statement(5, seed=5))
+    for i in range(STATEMENTS):
+        (tmp_path / f"{i:05d}.qbo").write_text(text)
+    first = catalog(tmp_path)
+    assert (tmp_path / CATALOG_NAME).exists()
+
+    changed = tmp_path / "00007.qbo"
+    changed.write_text("".join(random_statement(9, seed=5)))
+    os.utime(changed, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    sniffed = []
+    original = qbo_catalog.sniff
+    monkeypatch.setattr(qbo_catalog, "sniff", lambda *args: sniffed.append(args[0]) or original(*args))
+    second = catalog(tmp_path)
+    assert sniffed == [str(changed)]
+    assert [entry.xacts for entry in second] == [9 if entry.path == str(changed) else 5 for entry in first]
+
+
+def test_count_bytes_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(qbo_catalog, "BLOCK_SIZE", 7)
+    path = tmp_path / "tags.qbo"
+    path.write_bytes(b"<STMTTRN>x" * 20)
+    with open(path, "rb") as f:
+        assert count_bytes(f, b"<STMTTRN>") == 20
+
+
+def test_select_on_account_and_dates(statements):
+    entries = catalog(statements, recursive=True)
+    assert [entry.kind for entry in select(entries, account="4552001301")] == ["qbo"]
+    assert [entry.kind for entry in select(entries, until="20191231")] == ["csv"]
+
+
+def test_csv_with_an_unreadable_first_row_has_no_start_date(tmp_path):
+    rows = schwab_rows(5)
+    rows[3][0] = "not a date"
+    with open(tmp_path / "download.csv", "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+    [entry] = catalog(tmp_path)
+    assert (entry.bank, entry.dtstart, entry.dtend, entry.xacts) == ("schwab_checking", "", "20190105", 5)
@@ -0,0 +1,146 @@
+# test_qbo_checkpoint.py
+
+import csv
+import json
+import os
+import tempfile
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+import QBOfix2024_2
+import csv2qbo
+from qbo_checkpoint import Checkpoint, OffsetLines, ResumableOutput, has_checkpoint
+from qbo_differential import random_statement
+from qbo_test_data import qbo_line, schwab_rows
+
+
+class Killed(BaseException):
+    """Stands for the process being killed: no except Exception clause stops it."""
+
+
+def kill_after(monkeypatch, module, name, calls):
+    original = getattr(module, name)
+    count = [0]
+
+    def function(*args, **kwargs):
+        count[0] += 1
+        if count[0] > calls:
+            raise Killed()
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, function)
+
+
+def qbo_download(directory, newline="\n"):
+    directory.mkdir(exist_ok=True)
+    path = directory / "download.qbo"
+    path.write_bytes("".join(random_statement(500, seed=1)).replace("\n", newline).encode())
+    return path
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+def test_fixer_resumes_byte_identical(tmp_path, monkeypatch, validation_reports, newline):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    clean = qbo_download(tmp_path / "clean", newline)
+    QBOfix2024_2.modify_QBO(QBOfix2024_2.read_base_file(clean), clean)
+    output = tmp_path / "20220701_4552001301.qbo"
+    expected, expected_report = output.read_bytes(), json.loads((validation_reports / f"{output.name}.json").read_text())
+    output.unlink()
+
+    download = qbo_download(tmp_path / "download", newline)
+    with monkeypatch.context() as patch:
+        kill_after(patch, QBOfix2024_2, "process_transaction", 230)
+        with pytest.raises(Killed):
+            QBOfix2024_2.modify_QBO_resumable(download, every=50)
+    checkpoint = ResumableOutput(download, tmp_path).load()
+    assert checkpoint.xacts == 200 and not output.exists()
+    assert has_checkpoint(download, tmp_path)
+
+    assert QBOfix2024_2.modify_QBO_resumable(download, every=50) == 500
+    assert output.read_bytes() == expected
+    assert json.loads((validation_reports / f"{output.name}.json").read_text()) == expected_report
+    assert sorted(os.listdir(tmp_path)) == ["20220701_4552001301.qbo", "clean", "download", "validation"]
+    assert not download.exists()
+
+
+def test_process_qbo_resumes_a_checkpointed_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    monkeypatch.setattr(QBOfix2024_2, "QBO_DOWNLOAD_DIRECTORY", tmp_path / "download")
+    download = qbo_download(tmp_path / "download")
+    expected = "".join(QBOfix2024_2.process_qbo_lines(QBOfix2024_2.read_base_file(download))[0])
+    monkeypatch.setattr(QBOfix2024_2, "QBO_CHECKPOINT_XACTS", 100)
+    with monkeypatch.context() as patch:
+        kill_after(patch, QBOfix2024_2, "process_transaction", 150)
+        with pytest.raises(Killed):
+            QBOfix2024_2.process_QBO()
+    monkeypatch.setattr(QBOfix2024_2, "QBO_CHECKPOINT_XACTS", 0)  # the checkpoint alone makes the next run resume
+    QBOfix2024_2.process_QBO()
+    assert (tmp_path / "20220701_4552001301.qbo").read_text() == expected
+
+
+def test_csv_conversion_resumes_byte_identical(tmp_path, monkeypatch, validation_reports):
+    path = tmp_path / "download.csv"
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(schwab_rows(700))  # \r\n line ends
+    first, last = csv2qbo.scan_csv_bounds(str(path))
+    with open(tmp_path / "clean.qbo", "w") as f:
+        assert csv2qbo.write_qbo_file(str(path), f, last) == 700
+    expected_report = json.loads((validation_reports / "clean.qbo.json").read_text())
+
+    output = str(tmp_path / "resumed.qbo")
+    with monkeypatch.context() as patch:
+        kill_after(patch, csv2qbo, "format_statement_block", 321)
+        with pytest.raises(Killed):
+            csv2qbo.write_qbo_file_resumable(str(path), output, first, last, every=40)
+    assert ResumableOutput(path, tmp_path).load().xacts == 320
+    assert csv2qbo.write_qbo_file_resumable(str(path), output, first, last, every=40) == 700
+    assert (tmp_path / "resumed.qbo").read_bytes() == (tmp_path / "clean.qbo").read_bytes()
+    report = json.loads((validation_reports / "resumed.qbo.json").read_text())
+    assert {**report, "file": "clean.qbo"} == expected_report
+    assert not has_checkpoint(path, tmp_path)
+
+
+def test_checkpoint_of_a_changed_input_is_ignored(tmp_path):
+    download = qbo_download(tmp_path / "download")
+    output = ResumableOutput(download, tmp_path)
+    (tmp_path / "download.qbo.partial").write_text("<OFX>\n")
+    stat = os.stat(download)
+    (tmp_path / "download.qbo.checkpoint").write_text(json.dumps(
+        Checkpoint(stat.st_size, stat.st_mtime, 10, 6, 1, {})._asdict()))
+    assert output.load() is not None
+    download.write_text("changed\n")
+    assert output.load() is None
+
+
+@given(st.lists(qbo_line, max_size=40), st.sampled_from(["\n", "\r\n", "\r"]))
+@settings(deadline=None)
+def test_resuming_at_any_checkpoint_matches_serial_processing(lines, newline):
+    text = "".join(lines)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "download.qbo")
+        with open(path, "wb") as f:
+            f.write(text.replace("\n", newline).encode())
+        with open(path) as f:
+            expected, dtend, acctid = QBOfix2024_2.process_qbo_lines(f.readlines())
+        state, pieces, checkpoints = {}, [], []
+        for text, is_transaction, offset in QBOfix2024_2.iter_modified_pieces(path, None, state):
+            pieces.append(text)
+            if is_transaction and offset is not None:
+                checkpoints.append((len(pieces), Checkpoint(0, 0, offset, 0, 0, json.loads(json.dumps(state)))))
+        assert "".join(pieces) == "".join(expected)
+        assert (state["DTEND"], state["ACCTID"]) == (dtend, acctid)
+        for written, checkpoint in checkpoints:
+            state = checkpoint.state
+            resumed = [text for text, _, _ in QBOfix2024_2.iter_modified_pieces(path, checkpoint, state)]
+            assert "".join(pieces[:written] + resumed) == "".join(expected)
+            assert (state["DTEND"], state["ACCTID"]) == (dtend, acctid)
+
+
+def test_offset_lines_translate_line_ends(tmp_path):
+    path = tmp_path / "lines.txt"
+    path.write_bytes(b"a\r\nb\rc\nd")
+    with open(path, "rb") as f:
+        lines = OffsetLines(f)
+        found = [(line, lines.offset) for line in lines]
+    assert found == [("a\n", 3), ("b\n", None), ("c\n", 7), ("d", 8)]
@@ -0,0 +1,86 @@
+# test_qbo_differential.py
+
+import json
+
+from hypothesis import given, settings, strategies as st
+
+import qbo_differential
+from qbo_differential import (StatementTransaction, compare, compare_files, random_statement, run_engine,
+                              statement_lines, summarize)
+from qbo_test_data import memo_text
+
+KNOWN_KINDS = {"check_paid", "missing_memo", "missing_name", "collision", "empty_memo", "not_swapped", "bill_pay",
+               "bad_text", "header"}
+
+# bank text: no tag or line end characters, those are covered by test_QBOfix2024_2
+bank_text = st.text(alphabet=st.characters(whitelist_categories=("Lu", "Nd", "Zs"), max_codepoint=127), min_size=1)
+
+
+@st.composite
+def statement_transactions(draw):
+    i = draw(st.integers(min_value=0, max_value=10**6))
+    refnum = str(draw(st.integers(min_value=10**14, max_value=10**15 - 1)))
+    if draw(st.booleans()):
+        name = memo = "CHECK PAID"
+        checknum = str(draw(st.integers(min_value=1000, max_value=9999)))
+    else:
+        name = draw(st.one_of(st.just(refnum), bank_text, st.none()))
+        memo = draw(st.one_of(memo_text(bank_text), bank_text, st.none()))
+        checknum = None
+    amount = draw(st.decimals(min_value=-5000, max_value=5000, places=2))
+    return StatementTransaction("DEBIT", "20220401", str(amount), f"{i:08d}", refnum, checknum, name, memo)
+
+
+@given(st.lists(statement_transactions(), min_size=1, max_size=20, unique_by=lambda xact: xact.fitid))
+@settings(deadline=None, max_examples=50)
+def test_every_difference_is_a_known_edge_case(transactions):
+    lines = statement_lines(transactions)
+    differences, mismatches = compare(lines, ["QBOFIX", "QBOFIXloguru"])
+    assert mismatches == {}
+    kinds = {difference.kind for difference in differences}
+    assert kinds <= KNOWN_KINDS, [d for d in differences if d.kind not in KNOWN_KINDS][:3]
+
+
+def test_known_differences_of_the_legacy_engines():
+    lines = statement_lines([
+        StatementTransaction("CHECK", "20220401", "-10.00", "1", "111", "1001", "CHECK PAID", "CHECK PAID"),
+        StatementTransaction("DEBIT", "20220401", "-2.00", "2", "222", None, "222", None),
+        StatementTransaction("DEBIT", "20220401", "-3.00", "3", "333", None, "333", "BILL PAYMT POWER CO"),
+    ])
+    differences, _ = compare(lines, ["QBOFIX", "QBOFIXloguru"])
+    kinds = {(d.engine, d.fitid): d.kind for d in differences}
+    assert kinds[("QBOFIX", "1")] == "check_paid"
+    assert kinds[("QBOFIXloguru", "1")] == "collision"
+    assert kinds[("QBOFIX", "2")] == kinds[("QBOFIXloguru", "2")] == "missing_memo"
+    assert kinds[("QBOFIX", "3")] == "not_swapped"
+    assert kinds[("QBOFIXloguru", "3")] == "bill_pay"
+    assert ("QBOFIX", "DTEND") not in kinds
+    assert summarize(differences)[("QBOFIXloguru", "collision")] == 1
+
+
+def test_unterminated_transaction_is_an_engine_error():
+    lines = random_statement(3)
+    lines = lines[:lines.index("</STMTTRN>\n")]
+    assert run_engine("QBOFIXloguru", lines).error is not None
+    assert run_engine("QBOfix2024_2", lines).error is None
+
+
+def test_parallel_engine_is_byte_identical():
+    differences, mismatches = compare(random_statement(1200, seed=3), ["QBOfix2024_2_parallel"])
+    assert differences == [] and mismatches == {}
+
+
+def test_engine_that_is_not_equivalent_fails(tmp_path, monkeypatch):
+    def uppercase_names(lines):
+        modified, file_date, account = qbo_differential._qbofix_2024(lines)
+        return [line.upper() if line.startswith("<NAME>") else line for line in modified], file_date, account
+
+    engine = qbo_differential.Engine(uppercase_names, qbo_differential._reference_strip, "QBOfix2024_2")
+    monkeypatch.setitem(qbo_differential.ENGINES, "uppercase", engine)
+    monkeypatch.setattr(qbo_differential, "EQUIVALENT_ENGINES", ("uppercase",))
+    report_path = tmp_path / "compare.json"
+    assert not compare_files(xacts=50, engines=["uppercase"], repeat=1, report_path=str(report_path))
+    report = json.loads(report_path.read_text())
+    assert report["not_equivalent"]["uppercase"][0] > 0
+    assert [row["engine"] for row in report["benchmark"]] == ["QBOfix2024_2", "uppercase"]
+    assert report["benchmark"][1]["xacts"] == 50 and report["benchmark"][1]["peak"] > 0
@@ -0,0 +1,40 @@
+# test_qbo_merge.py
+
+from pathlib import Path
+
+import QBOfix2024_2
+from qbo_merge import deduplicate, merge_files, scan_qbo_file
+from qbo_test_data import SAMPLE_QBO
+
+
+def split_sample():
+    """Return (header, list of transaction texts, footer) of the sample QBO file."""
+    text = SAMPLE_QBO.read_text()
+    first, last = text.index("<STMTTRN>"), text.rindex("</STMTTRN>\n") + len("</STMTTRN>\n")
+    transactions = [t + "</STMTTRN>\n" for t in text[first:last].split("</STMTTRN>\n")[:-1]]
+    return text[:first], transactions, text[last:]
+
+
+def test_overlapping_files_merge_to_original(tmp_path, monkeypatch):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    header, transactions, footer = split_sample()
+    older = tmp_path / "older.qbo"
+    older.write_text(header.replace("<DTEND>20220701", "<DTEND>20220515") + "".join(transactions[:70]) + footer)
+    newer = tmp_path / "newer.qbo"  # newest first, overlapping 30 transactions
+    newer.write_text(header.replace("<DTSTART>20220331", "<DTSTART>20220501")
+                     + "".join(reversed(transactions[40:])) + footer)
+    assert scan_qbo_file(newer).order == "descending"
+
+    results = merge_files([older, newer])
+
+    stats = results["4552001301"]
+    assert (stats["files"], stats["read"], stats["duplicates"], stats["written"]) == (2, 146, 30, 116)
+    assert Path(stats["output"]) == tmp_path / "20220701_4552001301.qbo"
+    assert Path(stats["output"]).read_text() == SAMPLE_QBO.read_text()
+
+
+def test_fitids_are_forgotten_outside_the_window():
+    transactions = [("20220101", "A", 1), ("20220102", "A", 2), ("20220110", "A", 3), ("20220110", "", 4)]
+    stats = {}
+    assert list(deduplicate(transactions, window_days=3, stats=stats)) == [1, 3, 4]
+    assert stats == {"duplicates": 1, "written": 3}
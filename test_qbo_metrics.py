@@ -0,0 +1,89 @@
+# test_qbo_metrics.py
+
+import json
+import urllib.request
+from functools import lru_cache
+
+import pytest
+
+import QBOfix2024_2
+import qbo_metrics
+from qbo_metrics import MetricsPublisher, Registry
+from qbo_test_data import SAMPLE_QBO
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    files = registry.counter("files_total", "Files.", ("source",))
+    latency = registry.histogram("latency_seconds", "Latency.", ("source",), buckets=(1, 10))
+    files.inc(source="qbo")
+    files.inc(2, source='c"sv')
+    latency.observe(0.5, source="qbo")
+    latency.observe(5, source="qbo")
+
+    @lru_cache(maxsize=None)
+    def square(x):
+        return x * x
+
+    registry.cache_metrics.register("squares", square)
+    square(2), square(2), square(3)
+    text = registry.render()
+    assert '# TYPE files_total counter\nfiles_total{source="c\\"sv"} 2\nfiles_total{source="qbo"} 1\n' in text
+    assert 'latency_seconds_bucket{source="qbo",le="1"} 1\n' in text
+    assert 'latency_seconds_bucket{source="qbo",le="10"} 2\n' in text
+    assert 'latency_seconds_bucket{source="qbo",le="+Inf"} 2\n' in text
+    assert 'latency_seconds_sum{source="qbo"} 5.5\nlatency_seconds_count{source="qbo"} 2\n' in text
+    assert 'qbo_cache_hits_total{cache="squares"} 1\n' in text
+    assert 'qbo_cache_misses_total{cache="squares"} 2\n' in text
+    with pytest.raises(ValueError):
+        files.inc(kind="qbo")
+
+
+def test_fixer_counts(sample_download):
+    metrics = (qbo_metrics.FILES_SEEN, qbo_metrics.FILES_CONVERTED, qbo_metrics.TRANSACTIONS, qbo_metrics.LATENCY)
+    before = [metric.value(source="qbo") for metric in metrics]
+    cleaned = qbo_metrics.MEMOS_CLEANED.value()
+    QBOfix2024_2.process_QBO()
+    after = [metric.value(source="qbo") for metric in metrics]
+    assert [b - a for a, b in zip(before, after)] == [1, 1, 116, 1]
+    assert qbo_metrics.MEMOS_CLEANED.value() > cleaned
+    assert qbo_metrics.BACKLOG.value(source="qbo") == 1
+
+
+def test_file_left_in_the_download_directory_is_seen_once(sample_download, monkeypatch):
+    monkeypatch.setattr(qbo_metrics, "_waiting", {})
+    monkeypatch.setattr(QBOfix2024_2, "modify_QBO", lambda lines, path: None)  # as if it could not be converted
+    before = qbo_metrics.FILES_SEEN.value(source="qbo")
+    QBOfix2024_2.process_QBO()
+    QBOfix2024_2.process_QBO()
+    assert sample_download.exists() and qbo_metrics.FILES_SEEN.value(source="qbo") - before == 1
+
+
+def test_parallel_memos_are_counted():
+    lines = SAMPLE_QBO.read_text().splitlines(keepends=True)
+    start = qbo_metrics.MEMOS_CLEANED.value()
+    QBOfix2024_2.process_qbo_lines(lines)
+    serial = qbo_metrics.MEMOS_CLEANED.value() - start
+    QBOfix2024_2.process_qbo_lines_parallel(lines, workers=2, chunk_size=50)
+    assert qbo_metrics.MEMOS_CLEANED.value() - start == 2 * serial > 0
+
+
+def test_resumable_memos_are_counted(tmp_path, monkeypatch):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    download = tmp_path / "download.qbo"
+    download.write_text(SAMPLE_QBO.read_text())
+    start = qbo_metrics.MEMOS_CLEANED.value()
+    QBOfix2024_2.process_qbo_lines(SAMPLE_QBO.read_text().splitlines(keepends=True))
+    serial = qbo_metrics.MEMOS_CLEANED.value() - start
+    QBOfix2024_2.modify_QBO_resumable(download, every=50)
+    assert qbo_metrics.MEMOS_CLEANED.value() - start == 2 * serial > 0
+
+
+def test_publisher_serves_and_snapshots(tmp_path):
+    registry = Registry()
+    registry.counter("files_total", "Files.").inc(3)
+    with MetricsPublisher("unit", port=0, interval=60, registry=registry, log_directory=str(tmp_path)) as publisher:
+        with urllib.request.urlopen("http://%s:%s/metrics" % publisher.address) as response:
+            assert "files_total 3\n" in response.read().decode()
+    snapshot = json.loads((tmp_path / "unit_metrics.json").read_text())
+    assert snapshot["files_total"] == [{"labels": {}, "value": 3}]
@@ -0,0 +1,57 @@
+# test_qbo_pipeline.py
+
+import threading
+
+import pytest
+
+import QBOfix2024_2
+import qbo_pipeline
+from QBOfix2024_2 import process_qbo_lines
+from qbo_pipeline import run_pipeline
+from qbo_test_data import SAMPLE_QBO
+
+
+def make_downloads(download, count):
+    sample = SAMPLE_QBO.read_text()
+    expected = {}
+    for i in range(count):
+        text = sample.replace("<ACCTID>4552001301", f"<ACCTID>{1000 + i}")
+        path = download / f"download{i}.qbo"
+        path.write_text(text)
+        lines, file_date, account = process_qbo_lines(text.splitlines(keepends=True))
+        expected[f"{file_date}_{account}.qbo"] = "".join(lines)
+    return expected
+
+
+def test_pipeline_matches_serial_output(directories):
+    download, output = directories
+    expected = make_downloads(download, 6)
+    metrics = run_pipeline(sorted(download.glob("*.qbo")), transform_threads=3, prefetch=2)
+    assert {p.name: p.read_text() for p in output.iterdir()} == expected
+    assert list(download.iterdir()) == []
+    assert metrics["read"].items == metrics["transform"].items == metrics["write"].items == 6
+    assert metrics["transform"].xacts == 6 * 116
+    assert all(0 <= m.utilization(60) <= 1 for m in metrics.values())
+
+
+def test_process_QBO_uses_pipeline(directories, monkeypatch):
+    download, output = directories
+    expected = make_downloads(download, 3)
+    monkeypatch.setattr(QBOfix2024_2, "QBO_PIPELINE_THREADS", 2)
+    QBOfix2024_2.process_QBO()
+    assert {p.name: p.read_text() for p in output.iterdir()} == expected
+
+
+def test_writer_survives_an_unexpected_error(directories, monkeypatch):
+    download, output = directories
+    make_downloads(download, 6)
+
+    def remove_original(path):
+        raise RuntimeError("archive unreachable")
+
+    monkeypatch.setattr(qbo_pipeline, "remove_original", remove_original)
+    finished = threading.Thread(target=run_pipeline, args=(sorted(download.glob("*.qbo")), 2, 1), daemon=True)
+    finished.start()
+    finished.join(timeout=30)
+    assert not finished.is_alive(), "the pipeline hangs once the writer thread dies"
+    assert len(list(download.iterdir())) == 6 and len(list(output.iterdir())) == 6
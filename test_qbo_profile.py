@@ -0,0 +1,40 @@
+# test_qbo_profile.py
+
+import pstats
+
+import QBOfix2024_2
+import structured_log
+from qbo_profile import profiling, rate
+from structured_log import stage
+
+
+def test_nested_stages_and_peak_memory():
+    with profiling() as profiler:
+        with stage("outer") as fields:
+            with stage("inner", xacts=10):
+                block = bytearray(8 << 20)
+                del block
+            fields["xacts"] = 10
+            with stage("inner", xacts=5):
+                pass
+    assert structured_log.PROFILER is None
+    reports = {report.event: report for report in profiler.report()}
+    assert list(reports) == ["inner", "outer"]
+    assert (reports["inner"].calls, reports["inner"].xacts) == (2, 15)
+    assert reports["outer"].wall >= reports["inner"].wall
+    assert reports["inner"].peak >= 8 << 20 and reports["outer"].peak >= reports["inner"].peak
+    assert rate(reports["inner"]) > 0
+
+
+def test_fixer_stages_and_output_files(tmp_path, sample_download):
+    stats_path, stacks_path = tmp_path / "fix.pstats", tmp_path / "fix.folded"
+    with profiling(str(stats_path), str(stacks_path)) as profiler:
+        QBOfix2024_2.process_QBO()
+    reports = {report.event: report for report in profiler.report()}
+    for event in ("read_base_file", "rewrite_QBO", "write_QBO", "modify_QBO", "remove_original", "process_QBO"):
+        assert reports[event].calls == 1, event
+    assert reports["rewrite_QBO"].xacts == reports["write_QBO"].xacts == 116
+    assert any(function == "process_transaction" for _, _, function in pstats.Stats(str(stats_path)).stats)
+    for line in stacks_path.read_text().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0 and stack
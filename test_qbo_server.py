@@ -0,0 +1,129 @@
+# test_qbo_server.py
+
+import json
+import socket
+import threading
+import http.client
+
+import pytest
+from loguru import logger
+
+from QBOfix2024_2 import process_qbo_lines
+from qbo_server import make_server
+from structured_log import add_structured_sink
+from qbo_test_data import SAMPLE_QBO
+
+
+@pytest.fixture
+def server():
+    server = make_server("127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, path, body):
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.request("POST", path, body, {"Content-Type": "text/plain; charset=utf-8"})
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_fix_matches_batch_conversion(server):
+    payload = SAMPLE_QBO.read_bytes()
+    response, body = post(server, "/fix", payload)
+    assert response.status == 200
+    with open(SAMPLE_QBO) as f:
+        expected, file_date, account_number = process_qbo_lines(f.readlines())
+    assert body.decode() == "".join(expected)
+    assert response.getheader("X-QBO-Filename") == f"{file_date}_{account_number}.qbo"
+    assert int(response.getheader("X-QBO-Transactions")) == expected.count("<STMTTRN>\n")
+
+
+def test_csv2qbo_endpoint(server):
+    payload = (
+        "Posted Transactions\n"
+        '03/01/2019,ACH,,POS DB  WALMART  1234,$747.06,,"$2,500.00"\n'
+        '02/28/2019,DEPOSIT,,DEPOSIT,, $590.15,"$3,247.06"\n'
+    )
+    response, body = post(server, "/csv2qbo", payload.encode())
+    assert response.status == 200
+    text = body.decode()
+    assert "<DTSTART>20190228\n<DTEND>20190301\n" in text
+    assert text.count("<STMTTRN>") == 2
+    assert response.getheader("X-QBO-Filename") == "20190301_.qbo"
+
+
+def test_unknown_path(server):
+    response, _ = post(server, "/nothing", b"")
+    assert response.status == 404
+
+
+def raw_request(server, request):
+    with socket.create_connection(server.server_address[:2]) as client:
+        client.sendall(request)
+        return client.makefile("rb").readline()
+
+
+def test_missing_content_length(server):
+    assert raw_request(server, b"POST /fix HTTP/1.0\r\n\r\n").startswith(b"HTTP/1.0 411")
+
+
+@pytest.mark.parametrize("length", [b"ten", b"-5"])
+def test_bad_content_length(server, length):
+    status = raw_request(server, b"POST /fix HTTP/1.0\r\nContent-Length: " + length + b"\r\n\r\n")
+    assert status.startswith(b"HTTP/1.0 400")
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="unix sockets only")
+def test_unix_socket(tmp_path):
+    socket_path = str(tmp_path / "qbo.sock")
+    server = make_server(socket_path=socket_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = socket.socket(socket.AF_UNIX)
+        client.connect(socket_path)
+        client.sendall(b"GET /health HTTP/1.0\r\n\r\n")
+        reply = client.makefile("rb").read()
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert reply.startswith(b"HTTP/1.0 200") and reply.endswith(b"ok\n")
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="unix sockets only")
+def test_socket_path_that_is_not_a_socket_is_kept(tmp_path):
+    path = tmp_path / "qbo.sock"
+    path.write_text("not a socket")
+    with pytest.raises(FileExistsError):
+        make_server(socket_path=str(path))
+    assert path.read_text() == "not a socket"
+
+
+def test_failed_request_is_logged_as_failed(server, tmp_path):
+    handler_id = add_structured_sink("unit_test", str(tmp_path))
+    try:
+        connection = http.client.HTTPConnection(*server.server_address[:2])
+        connection.request("POST", "/fix", b"<OFX>", {"Content-Type": "text/plain; charset=no-such-charset"})
+        response = connection.getresponse()
+        response.read()
+    finally:
+        logger.remove(handler_id)
+    assert response.status == 400
+    (log_file,) = tmp_path.glob("unit_test_*.jsonl")
+    [event] = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert (event["event"], event["ok"]) == ("serve_fix", False)
+
+
+def test_metrics_endpoint(server):
+    post(server, "/fix", SAMPLE_QBO.read_bytes())
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.request("GET", "/metrics")
+    response = connection.getresponse()
+    text = response.read().decode()
+    assert response.status == 200 and response.getheader("Content-Type").startswith("text/plain; version=0.0.4")
+    assert "# TYPE qbo_files_converted_total counter\n" in text
+    assert 'qbo_transactions_total{source="qbo"} ' in text
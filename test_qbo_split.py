@@ -0,0 +1,39 @@
+# test_qbo_split.py
+
+from pathlib import Path
+
+import pytest
+
+import QBOfix2024_2
+import qbo_split
+from qbo_merge import merge_files, scan_qbo_file
+from qbo_split import split_file
+from qbo_test_data import SAMPLE_QBO
+
+
+@pytest.fixture
+def output(tmp_path, monkeypatch):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("limits", [{"max_xacts": 25}, {"max_bytes": 4000}, {"max_days": 14}])
+def test_parts_respect_limits_and_merge_back(output, monkeypatch, limits):
+    monkeypatch.setattr(qbo_split, "SPOOL_MAX_SIZE", 512)  # force the parts through disk
+    parts = split_file(SAMPLE_QBO, **limits)
+    assert len(parts) > 1
+    assert parts[0].name == "input_reference.qbo_part01.qbo"
+    scans = [scan_qbo_file(p) for p in parts]
+    assert sum(s.xacts for s in scans) == 116
+    assert scans[0].dtstart == "20220331" and scans[-1].dtend == "20220701"
+    for scan in scans:
+        assert scan.account == "4552001301" and scan.footer == scans[0].footer
+        assert scan.dtstart <= scan.dtend
+        if "max_xacts" in limits:
+            assert scan.xacts <= 25
+    merged = merge_files(parts)["4552001301"]
+    assert Path(merged["output"]).read_text() == SAMPLE_QBO.read_text()
+
+
+def test_a_limit_is_required(output):
+    assert split_file(SAMPLE_QBO) is None
@@ -0,0 +1,88 @@
+# test_qbo_store.py
+
+import sqlite3
+from contextlib import closing
+from decimal import Decimal
+
+import pytest
+
+import QBOfix2024_2
+from QBOfix2024_2 import process_qbo_lines
+from qbo_store import TransactionStore, ingest_paths, select_sql
+from qbo_test_data import SAMPLE_QBO
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return tmp_path / "store.sqlite3"
+
+
+def test_rewritten_transactions_are_stored_once(store_path):
+    lines, _, account = process_qbo_lines(SAMPLE_QBO.read_text().splitlines(keepends=True))
+    with TransactionStore(store_path) as store:
+        assert store.add_qbo_lines(lines, "sample.qbo") == 116
+        assert store.add_qbo_lines(lines, "sample.qbo") == 116
+    with TransactionStore(store_path) as store:
+        rows = store.query()
+        assert len(rows) == 116 and {row.account for row in rows} == {account}
+        assert store.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert [r.dtposted for r in rows] == sorted(r.dtposted for r in rows)
+        payments = store.query(payee=rows[0].name)
+        assert payments and all(r.name.startswith(rows[0].name) for r in payments)
+        in_april = store.query(since="20220401", until="20220430")
+        assert in_april and all("20220401" <= r.dtposted <= "20220430" for r in in_april)
+        debits = store.query(max_amount="-100")
+        assert debits and all(r.amount <= Decimal("-100") for r in debits)
+
+
+def test_ingest_and_indexed_lookup(store_path, tmp_path):
+    history = tmp_path / "history"
+    history.mkdir()
+    sample = SAMPLE_QBO.read_text()
+    for i in range(20):
+        (history / f"{i}.qbo").write_text(sample.replace("<ACCTID>4552001301", f"<ACCTID>{i}"))
+    assert ingest_paths(store_path, [history]) == 20 * 116
+    with TransactionStore(store_path) as store:
+        plan = " ".join(row[3] for row in store.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM transactions WHERE name >= ? AND name < ?", ("A", "A\uffff")))
+        assert "transactions_name" in plan
+        sql, parameters = select_sql(account="7", since="20220601", limit=10)
+        plan = " ".join(row[3] for row in store.connection.execute("EXPLAIN QUERY PLAN " + sql, parameters))
+        assert "USING INDEX" in plan and "SCAN transactions" not in plan
+        rows = store.query(account="7", since="20220601", limit=10)
+        assert len(rows) == 10 and all(r.account == "7" for r in rows)
+
+
+def test_fixer_feeds_the_store(store_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    monkeypatch.setattr(QBOfix2024_2, "QBO_STORE_PATH", str(store_path))
+    original = tmp_path / "download.qbo"
+    original.write_text(SAMPLE_QBO.read_text())
+    QBOfix2024_2.modify_QBO(QBOfix2024_2.read_base_file(original), original)
+    with TransactionStore(store_path) as store:
+        assert len(store.query(account="4552001301")) == 116
+
+
+def test_bulk_load_keeps_the_indexes_of_a_store_in_use(store_path, tmp_path):
+    def indexes():
+        with closing(sqlite3.connect(store_path)) as connection:
+            return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    lines, _, _ = process_qbo_lines(SAMPLE_QBO.read_text().splitlines(keepends=True))
+    with TransactionStore(store_path) as store:
+        store.add_qbo_lines(lines, "sample.qbo")
+    expected = indexes()
+    assert "transactions_dtposted" in expected
+    with TransactionStore(store_path, bulk=True) as store:
+        assert not store.bulk and indexes() == expected  # seen by another connection while loading
+    (tmp_path / "empty.sqlite3").touch()
+    with TransactionStore(tmp_path / "empty.sqlite3", bulk=True) as store:
+        assert store.bulk
+
+
+def test_transactions_without_fitid_are_skipped(store_path):
+    with TransactionStore(store_path) as store:
+        store.add("1", {"FITID": "", "TRNAMT": "-1.00", "NAME": "FIRST"})
+        store.add("1", {"TRNAMT": "-2.00", "NAME": "SECOND"})
+        store.add("1", {"FITID": "A1", "TRNAMT": "-3.00", "NAME": "THIRD"})
+        assert [row.name for row in store.query()] == ["THIRD"]
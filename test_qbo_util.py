@@ -0,0 +1,20 @@
+# test_qbo_util.py
+
+from qbo_util import amount_cents, chunked, tag_values
+
+
+def test_chunked_keeps_whole_lines():
+    lines = [f"<NAME>{i}\n" for i in range(1000)]
+    chunks = list(chunked(lines, chunk_size=100))
+    assert "".join(chunks) == "".join(lines)
+    assert all(chunk.endswith("\n") and len(chunk) < 100 + 10 for chunk in chunks)
+    assert list(chunked([])) == []
+
+
+def test_amount_cents():
+    assert [amount_cents(value) for value in ("-12.34", "5", "0.005", "", None)] == [-1234, 500, 0, None, None]
+
+
+def test_tag_values():
+    lines = ["<STMTTRN>\n", "<NAME>GM FINANCIAL  \n", "<MEMO>a>b\n", "  <TRNAMT>-1.00\n", "text\n", "</STMTTRN>\n"]
+    assert tag_values(lines) == {"STMTTRN": "", "NAME": "GM FINANCIAL", "MEMO": "a>b", "/STMTTRN": ""}
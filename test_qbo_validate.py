@@ -0,0 +1,60 @@
+# test_qbo_validate.py
+
+import json
+from decimal import Decimal
+from pathlib import Path
+
+import QBOfix2024_2
+from QBOfix2024_2 import process_qbo_lines
+from qbo_validate import StatementValidator, save_report
+from qbo_test_data import SAMPLE_QBO
+
+
+def transaction(fitid, posted, amount, name):
+    return f"<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>{posted}\n<TRNAMT>{amount}\n<FITID>{fitid}\n<NAME>{name}\n</STMTTRN>\n"
+
+
+def test_failures_are_counted():
+    statement = (
+        "<BANKTRANLIST>\n<DTSTART>20220101\n<DTEND>20220131\n"
+        + transaction("A", "20220105", "-10.00", "OK")
+        + transaction("A", "20220106", "-5.00", "DUPLICATE")
+        + transaction("B", "20220201", "-1.00", "AFTER DTEND")
+        + transaction("C", "20220110", "x", "N" * 40)
+        + "</BANKTRANLIST>\n<LEDGERBAL>\n<BALAMT>84.00\n</LEDGERBAL>\n<AVAILBAL>\n<BALAMT>1\n</AVAILBAL>\n"
+    )
+    validator = StatementValidator("statement.qbo")
+    assert "".join(validator.watch([statement])) == statement
+    report = validator.report(opening_balance=Decimal("100"))
+    assert report["failures"] == {"date_out_of_range": 1, "duplicate_fitid": 1, "name_too_long": 1, "bad_amount": 1}
+    assert report["examples"]["duplicate_fitid"] == ["A"]
+    assert (report["total"], report["ledger_balance"], report["balance_ok"]) == ("-16.00", "84.00", True)
+    assert not report["ok"]
+
+
+def test_fixer_writes_a_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    lines, file_date, account = process_qbo_lines(SAMPLE_QBO.read_text().splitlines(keepends=True))
+    output = tmp_path / f"{file_date}_{account}.qbo"
+    QBOfix2024_2.write_validated(output, lines)
+    assert output.read_text() == "".join(lines)
+    report = json.loads((tmp_path / "validation" / f"{output.name}.json").read_text())
+    assert report["ok"] and report["xacts"] == 116 and report["balance_ok"] is None
+    assert report["ledger_balance"] == "18503.50"
+
+
+def test_report_that_can_not_be_saved_is_only_a_warning(tmp_path, monkeypatch):
+    monkeypatch.setattr(QBOfix2024_2, "QBO_MODIFIED_DIRECTORY", tmp_path)
+    (tmp_path / "validation").write_text("not a directory")
+    (tmp_path / "download").mkdir()
+    download = tmp_path / "download" / "download.qbo"
+    download.write_text(SAMPLE_QBO.read_text())
+    QBOfix2024_2.modify_QBO(QBOfix2024_2.read_base_file(download), download)
+    assert len(list(tmp_path.glob("*.qbo"))) == 1
+    assert not download.exists()
+
+
+def test_save_report_logs_failures(tmp_path):
+    validator = StatementValidator("empty.qbo")
+    path = save_report(validator.report(Decimal("1.00")), str(tmp_path))
+    assert json.loads(Path(path).read_text())["xacts"] == 0
@@ -0,0 +1,40 @@
+# test_structured_log.py
+
+import json
+from loguru import logger
+
+import QBOfix2024_2
+from structured_log import add_structured_sink, stage
+
+
+def test_stage_events_written_as_json_lines(tmp_path):
+    handler_id = add_structured_sink("unit_test", str(tmp_path))
+    try:
+        with stage("read_base_file", "download.qbo", 1234) as fields:
+            fields["xacts"] = 7
+        logger.info("free text messages are not stage events")
+    finally:
+        logger.remove(handler_id)
+    (log_file,) = tmp_path.glob("unit_test_*.jsonl")
+    events = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert len(events) == 1
+    event = events[0]
+    assert set(event) == {"ts", "program", "event", "file", "bytes", "xacts", "elapsed_ms", "ok"}
+    assert event["event"] == "read_base_file"
+    assert (event["file"], event["bytes"], event["xacts"]) == ("download.qbo", 1234, 7)
+    assert event["elapsed_ms"] >= 0 and event["ok"] is True
+
+
+def test_handled_failure_is_not_ok(tmp_path, monkeypatch, sample_download):
+    def refuse(path):
+        raise PermissionError(13, "Permission denied", str(path))
+
+    monkeypatch.setattr(QBOfix2024_2.os, "remove", refuse)
+    handler_id = add_structured_sink("unit_test", str(tmp_path))
+    try:
+        assert QBOfix2024_2.remove_original(sample_download) is False
+    finally:
+        logger.remove(handler_id)
+    (log_file,) = tmp_path.glob("unit_test_*.jsonl")
+    [event] = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert (event["event"], event["ok"]) == ("remove_original", False)
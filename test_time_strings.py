@@ -0,0 +1,36 @@
+# test_time_strings.py
+
+import re
+
+import pytest
+
+import time_strings
+from time_strings import CachedClock, LOCAL_NOW_STRING, LOCAL_NOW_FILENAME_STRING, UTC_NOW_STRING
+
+
+def test_string_formats_unchanged():
+    assert re.fullmatch(r"\d{4}-\d\d-\d\d_\d\d:\d\d:\d\dEST", LOCAL_NOW_STRING())
+    assert re.fullmatch(r"\d{4}-\d\d-\d\d_\d\d:\d\d:\d\dUTC", UTC_NOW_STRING())
+    assert re.fullmatch(r"\d{4}-\d\d-\d\d_\d{6}EST", LOCAL_NOW_FILENAME_STRING())
+
+
+@pytest.mark.parametrize("second, expected", [
+    (1709308800, "2024-03-01_11:00:00EST"),  # 16:00 UTC in standard time
+    (1719849600, "2024-07-01_12:00:00EST"),  # 16:00 UTC in daylight saving time
+])
+def test_local_clock_timezone(monkeypatch, second, expected):
+    monkeypatch.setattr(time_strings, "time", lambda: second + 0.5)
+    clock = CachedClock(time_strings.tz_LOCAL, "EST")
+    assert clock.now_string() == expected
+    assert clock.filename_string() == expected.replace(":", "")
+
+
+def test_clock_reuses_string_within_one_second(monkeypatch):
+    now = [100.1]
+    monkeypatch.setattr(time_strings, "time", lambda: now[0])
+    clock = CachedClock(time_strings.tz_UTC, "UTC")
+    first = clock.now_string()
+    now[0] = 100.9
+    assert clock.now_string() is first
+    now[0] = 101.0
+    assert clock.now_string() != first
@@ -5,12 +5,16 @@
 
 
 from datetime import datetime, date
-from time import sleep
-import pytz
+from time import sleep, time
+from zoneinfo import ZoneInfo
 
 
-tz_UTC = pytz.timezone("UTC")
-tz_LOCAL = pytz.timezone("America/Louisville")
+tz_UTC = ZoneInfo("UTC")
+tz_LOCAL = ZoneInfo("America/Louisville")
+
+# characters windows does not allow in file names
+FILENAME_UNSAFE_CHARACTERS = "\\/:*?<>|"
+_FILENAME_SAFE_TABLE = dict.fromkeys(map(ord, FILENAME_UNSAFE_CHARACTERS))
 
 
 def timefstring(dtobj):
@@ -18,6 +22,43 @@ def timefstring(dtobj):
     """
     return f'{dtobj.strftime("%Y-%m-%d_%H:%M:%S")}'
 
+def filename_safe(text):
+    """Remove the characters that are not allowed in file names."""
+    return text.translate(_FILENAME_SAFE_TABLE)
+
+
+class CachedClock:
+    """Formatted 'now' strings for one timezone, computed at most once per second.
+    Timestamps are used for file naming and logging many times per run and only
+    have one second resolution, so the formatted strings are reused until the
+    wall clock moves on to the next second.
+    """
+
+    def __init__(self, tz, suffix):
+        self._tz = tz
+        self._suffix = suffix
+        self._cache = (None, "", "")  # (epoch second, timestamp string, filename safe string)
+
+    def _current(self):
+        second = int(time())
+        cache = self._cache
+        if cache[0] != second:
+            stamp = "".join([timefstring(datetime.fromtimestamp(second, self._tz)), self._suffix])
+            cache = (second, stamp, filename_safe(stamp))
+            self._cache = cache  # a single assignment keeps this safe to share between threads
+        return cache
+
+    def now_string(self):
+        return self._current()[1]
+
+    def filename_string(self):
+        return self._current()[2]
+
+
+UTC_CLOCK = CachedClock(tz_UTC, 'UTC')
+LOCAL_CLOCK = CachedClock(tz_LOCAL, 'EST')
+
+
 def LOCAL_TODAY():
     return  date.today()
 
@@ -31,13 +72,17 @@ def LOCAL_TODAY_STRING():
     return LOCAL_TODAY().strftime("%Y-%m-%d")
 
 def UTC_NOW_STRING():
-    return "".join([timefstring(UTC_NOW()), 'UTC'])
+    return UTC_CLOCK.now_string()
 
 def LOCAL_NOW():
     return datetime.now(tz_LOCAL)
 
 def LOCAL_NOW_STRING():
-    return "".join([timefstring(LOCAL_NOW()), 'EST'])
+    return LOCAL_CLOCK.now_string()
+
+def LOCAL_NOW_FILENAME_STRING():
+    """LOCAL_NOW_STRING without the characters windows does not allow in file names."""
+    return LOCAL_CLOCK.filename_string()
 
 
 if __name__ == "__main__":
@@ -49,6 +94,6 @@ if __name__ == "__main__":
         print(f"LOCAL TODAY_STRING: {LOCAL_TODAY_STRING()} type: {type(LOCAL_TODAY_STRING())}")
         print(f"UTC NOW_STRING: {UTC_NOW_STRING()} type: {type(UTC_NOW_STRING())}")
         print(f"LOCAL NOW_STRING: {LOCAL_NOW_STRING()} type: {type(LOCAL_NOW_STRING())}")
+        print(f"LOCAL NOW_FILENAME_STRING: {LOCAL_NOW_FILENAME_STRING()} type: {type(LOCAL_NOW_FILENAME_STRING())}")
         sleep(2)
         print()
-